@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark the regex sentence segmenter against NLTK punkt
+
+Reports the speed of both segmenters and the boundary agreement of the regex
+segmenter with punkt on a corpus of text or PDF files (test_pdf.pdf and the
+built-in sample text by default).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from nltk.tokenize import sent_tokenize
+
+from services.pdf_processor import PDFProcessor
+from services.sentence_segmenter import boundary_agreement, regex_sentences
+
+SAMPLE_TEXT = """
+Artificial Intelligence (AI) is a branch of computer science that aims to create intelligent machines.
+Dr. Smith et al. reported an accuracy of 97.5 percent on the U.S. benchmark, i.e. a 3.2 point gain.
+The results are shown in Fig. 4 and Table 2... but the variance is high. Is that significant? It is!
+Mr. J. R. Doe, Ph.D., joined Acme Inc. in Jan. 2021. He works on NLP, vision, speech, etc. The team grew.
+"We shipped it," she said. The next release (v2.1) follows in Q3.
+"""
+
+
+def load_corpus(paths):
+    """Texts of the given .txt or .pdf files"""
+    texts = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            with open(path, "rb") as handle:
+                text, _ = asyncio.run(PDFProcessor().process_pdf(handle))
+        else:
+            with open(path, encoding="utf-8") as handle:
+                text = handle.read()
+        texts.append(text)
+    return texts
+
+
+def time_segmenter(segmenter, texts, repeat):
+    """Best wall time of segmenting every text, over ``repeat`` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            segmenter(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the regex sentence segmenter against punkt")
+    parser.add_argument("files", nargs="*", help="Text or PDF files (default: test_pdf.pdf and a built-in sample)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per segmenter")
+    args = parser.parse_args()
+
+    paths = args.files
+    if not paths:
+        default_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_pdf.pdf")
+        paths = [default_pdf] if os.path.exists(default_pdf) else []
+    texts = load_corpus(paths) + ([] if args.files else [SAMPLE_TEXT])
+
+    try:
+        reference = [sent_tokenize(text) for text in texts]
+    except LookupError as e:
+        print(f"NLTK punkt data is required for the comparison: {e}")
+        return 1
+
+    candidate = [regex_sentences(text) for text in texts]
+    matched = candidate_total = reference_total = 0
+    for text, expected, found in zip(texts, reference, candidate):
+        scores = boundary_agreement(text, expected, found)
+        matched += scores["matched"]
+        reference_total += scores["reference"]
+        candidate_total += scores["candidate"]
+
+    precision = matched / candidate_total if candidate_total else 1.0
+    recall = matched / reference_total if reference_total else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    characters = sum(len(text) for text in texts)
+    punkt_time = time_segmenter(sent_tokenize, texts, args.repeat)
+    regex_time = time_segmenter(regex_sentences, texts, args.repeat)
+
+    print(f"Corpus: {len(texts)} texts, {characters} characters, {sum(map(len, reference))} punkt sentences")
+    print(f"punkt: {punkt_time * 1000:.1f} ms ({characters / punkt_time / 1e6:.1f} M chars/s)")
+    print(f"regex: {regex_time * 1000:.1f} ms ({characters / regex_time / 1e6:.1f} M chars/s), "
+          f"{punkt_time / regex_time:.1f}x faster")
+    print(f"Boundary agreement with punkt: precision {precision:.3f}, recall {recall:.3f}, F1 {f1:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,10 @@
 Configuration settings for the enhanced Python service
 """
 
+import hashlib
+import json
 import os
+import tempfile
 from typing import Optional
 
 class Config:
@@ -13,10 +16,42 @@ class Config:
     USE_OPENROUTER: bool = os.getenv("USE_OPENROUTER", "true").lower() == "true"
     OPENROUTER_SITE_URL: str = os.getenv("OPENROUTER_SITE_URL", "http://localhost:3000")
     OPENROUTER_SITE_NAME: str = os.getenv("OPENROUTER_SITE_NAME", "Assist2")
+    LLM_MAX_PROMPT_TOKENS: int = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "0"))
+    LLM_MAX_COMPLETION_TOKENS: int = int(os.getenv("LLM_MAX_COMPLETION_TOKENS", "2000"))
     
     # Text Compression Configuration
     COMPRESSION_TARGET: int = int(os.getenv("COMPRESSION_TARGET", "2000"))
     COMPRESSION_METHOD: str = os.getenv("COMPRESSION_METHOD", "smart")
+    COMPRESSION_WINDOW_SIZE: int = int(os.getenv("COMPRESSION_WINDOW_SIZE", "50000"))
+    COMPRESSION_WORKERS: int = int(os.getenv("COMPRESSION_WORKERS", "1"))
+    COMPRESSION_CACHE_ITEMS: int = int(os.getenv("COMPRESSION_CACHE_ITEMS", "20000"))
+    SENTENCE_SEGMENTER: str = os.getenv("SENTENCE_SEGMENTER", "punkt")
+    
+    # Embedding Configuration
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_BATCH_WAIT_MS: float = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+    EMBEDDING_CHUNK_TOKENS: int = int(os.getenv("EMBEDDING_CHUNK_TOKENS", "256"))
+    EMBEDDING_CHUNK_OVERLAP: int = int(os.getenv("EMBEDDING_CHUNK_OVERLAP", "32"))
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_ONNX_DIR: str = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(tempfile.gettempdir(), "assist_onnx_models"))
+    EMBEDDING_BACKEND_MIN_COSINE: float = float(os.getenv("EMBEDDING_BACKEND_MIN_COSINE", "0.99"))
+    DOCUMENT_EMBEDDING_STRATEGY: str = os.getenv("DOCUMENT_EMBEDDING_STRATEGY", "mean")
+    EMBEDDING_FORMAT: str = os.getenv("EMBEDDING_FORMAT", "json")
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_DIR: str = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "assist_embedding_cache"))
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "20000"))
+    EMBEDDING_CACHE_MAX_DISK_MB: int = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_MB", "1024"))
+    
+    # Vector Index Configuration
+    VECTOR_INDEX_ENABLED: bool = os.getenv("VECTOR_INDEX_ENABLED", "true").lower() == "true"
+    VECTOR_INDEX_DIR: str = os.getenv("VECTOR_INDEX_DIR", os.path.join(tempfile.gettempdir(), "assist_vector_index"))
+    VECTOR_INDEX_NPROBE: int = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+    VECTOR_INDEX_TRAIN_THRESHOLD: int = int(os.getenv("VECTOR_INDEX_TRAIN_THRESHOLD", "10000"))
+    
+    # Document Similarity Graph Configuration
+    SIMILARITY_GRAPH_PATH: str = os.getenv("SIMILARITY_GRAPH_PATH", os.path.join(tempfile.gettempdir(), "assist_document_embeddings"))
+    SIMILARITY_GRAPH_TOP_K: int = int(os.getenv("SIMILARITY_GRAPH_TOP_K", "10"))
+    SIMILARITY_GRAPH_THRESHOLD: float = float(os.getenv("SIMILARITY_GRAPH_THRESHOLD", "0.5"))
     
     # Graph Building Configuration
     MAX_GRAPH_NODES: int = int(os.getenv("MAX_GRAPH_NODES", "50"))
@@ -36,8 +71,32 @@ class Config:
     
     # Performance Configuration
     MAX_TEXT_LENGTH: int = int(os.getenv("MAX_TEXT_LENGTH", "100000"))
+    MAX_DOCUMENT_LENGTH: int = int(os.getenv("MAX_DOCUMENT_LENGTH", "20000000"))
     REQUEST_TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "30"))
     
+    # PDF Extraction Configuration
+    PDF_ENGINE: str = os.getenv("PDF_ENGINE", "auto")
+    PDF_LAYOUT_PATH_THRESHOLD: int = int(os.getenv("PDF_LAYOUT_PATH_THRESHOLD", "50"))
+    PDF_WORKERS: int = int(os.getenv("PDF_WORKERS", "1"))
+    PDF_PAGES_PER_SHARD: int = int(os.getenv("PDF_PAGES_PER_SHARD", "25"))
+    PDF_PARALLEL_MIN_PAGES: int = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "50"))
+    UPLOAD_MMAP_THRESHOLD_MB: int = int(os.getenv("UPLOAD_MMAP_THRESHOLD_MB", "8"))
+    
+    # PDF Sandbox Configuration
+    PDF_SANDBOX_ENABLED: bool = os.getenv("PDF_SANDBOX_ENABLED", "true").lower() == "true"
+    PDF_SANDBOX_WORKERS: int = int(os.getenv("PDF_SANDBOX_WORKERS", "2"))
+    PDF_SANDBOX_TIMEOUT: float = float(os.getenv("PDF_SANDBOX_TIMEOUT", "120"))
+    PDF_SANDBOX_PAGE_TIMEOUT: float = float(os.getenv("PDF_SANDBOX_PAGE_TIMEOUT", "20"))
+    PDF_SANDBOX_MAX_RSS_MB: int = int(os.getenv("PDF_SANDBOX_MAX_RSS_MB", "1024"))
+    PDF_SANDBOX_MAX_TASKS: int = int(os.getenv("PDF_SANDBOX_MAX_TASKS", "50"))
+    PDF_SANDBOX_QUEUE_TIMEOUT: float = float(os.getenv("PDF_SANDBOX_QUEUE_TIMEOUT", "30"))
+    
+    # Result Cache Configuration
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_DIR: str = os.getenv("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "assist_result_cache"))
+    RESULT_CACHE_MEMORY_ITEMS: int = int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", "64"))
+    RESULT_CACHE_MAX_DISK_MB: int = int(os.getenv("RESULT_CACHE_MAX_DISK_MB", "1024"))
+    
     # Testing Configuration
     TEST_MODE: bool = os.getenv("TEST_MODE", "false").lower() == "true"
     MOCK_OPENROUTER: bool = os.getenv("MOCK_OPENROUTER", "false").lower() == "true"
@@ -53,12 +112,63 @@ class Config:
         if cls.COMPRESSION_TARGET <= 0:
             errors.append("COMPRESSION_TARGET must be positive")
         
+        if cls.LLM_MAX_PROMPT_TOKENS < 0 or cls.LLM_MAX_COMPLETION_TOKENS <= 0:
+            errors.append("LLM_MAX_PROMPT_TOKENS must not be negative and LLM_MAX_COMPLETION_TOKENS must be positive")
+        
         if cls.MAX_GRAPH_NODES <= 0:
             errors.append("MAX_GRAPH_NODES must be positive")
         
         if cls.MAX_GRAPH_EDGES <= 0:
             errors.append("MAX_GRAPH_EDGES must be positive")
         
+        if cls.EMBEDDING_BATCH_SIZE <= 0:
+            errors.append("EMBEDDING_BATCH_SIZE must be positive")
+        
+        if cls.EMBEDDING_CACHE_ENABLED and cls.EMBEDDING_CACHE_MAX_DISK_MB <= 0:
+            errors.append("EMBEDDING_CACHE_MAX_DISK_MB must be positive")
+        
+        if cls.DOCUMENT_EMBEDDING_STRATEGY not in ("mean", "weighted_mean", "max", "full_text"):
+            errors.append("DOCUMENT_EMBEDDING_STRATEGY must be one of mean, weighted_mean, max, full_text")
+        
+        if cls.EMBEDDING_FORMAT not in ("json", "float32", "float16", "int8"):
+            errors.append("EMBEDDING_FORMAT must be one of json, float32, float16, int8")
+        
+        if cls.VECTOR_INDEX_NPROBE <= 0:
+            errors.append("VECTOR_INDEX_NPROBE must be positive")
+        
+        if cls.EMBEDDING_CHUNK_TOKENS <= 0 or not 0 <= cls.EMBEDDING_CHUNK_OVERLAP < cls.EMBEDDING_CHUNK_TOKENS:
+            errors.append("EMBEDDING_CHUNK_TOKENS must be positive and EMBEDDING_CHUNK_OVERLAP smaller than it")
+        
+        if cls.COMPRESSION_METHOD not in ("smart", "extractive", "keyword", "textrank"):
+            errors.append("COMPRESSION_METHOD must be one of smart, extractive, keyword, textrank")
+        
+        if cls.SENTENCE_SEGMENTER not in ("punkt", "regex"):
+            errors.append("SENTENCE_SEGMENTER must be one of punkt, regex")
+        
+        if cls.COMPRESSION_WINDOW_SIZE <= 0 or cls.COMPRESSION_WORKERS <= 0:
+            errors.append("COMPRESSION_WINDOW_SIZE and COMPRESSION_WORKERS must be positive")
+        
+        if cls.EMBEDDING_BACKEND not in ("torch", "torch_int8", "onnx", "onnx_int8"):
+            errors.append("EMBEDDING_BACKEND must be one of torch, torch_int8, onnx, onnx_int8")
+        
+        if cls.SIMILARITY_GRAPH_TOP_K <= 0:
+            errors.append("SIMILARITY_GRAPH_TOP_K must be positive")
+        
+        if cls.PDF_ENGINE not in ("auto", "pdfium", "pdfplumber", "pypdf2"):
+            errors.append("PDF_ENGINE must be one of auto, pdfium, pdfplumber, pypdf2")
+        
+        if cls.PDF_WORKERS <= 0:
+            errors.append("PDF_WORKERS must be positive")
+        
+        if cls.PDF_PAGES_PER_SHARD <= 0:
+            errors.append("PDF_PAGES_PER_SHARD must be positive")
+        
+        if cls.PDF_SANDBOX_ENABLED and (cls.PDF_SANDBOX_WORKERS <= 0 or cls.PDF_SANDBOX_TIMEOUT <= 0
+                                        or cls.PDF_SANDBOX_PAGE_TIMEOUT <= 0 or cls.PDF_SANDBOX_MAX_RSS_MB <= 0
+                                        or cls.PDF_SANDBOX_QUEUE_TIMEOUT <= 0):
+            errors.append("PDF_SANDBOX_WORKERS, PDF_SANDBOX_TIMEOUT, PDF_SANDBOX_PAGE_TIMEOUT, PDF_SANDBOX_MAX_RSS_MB "
+                          "and PDF_SANDBOX_QUEUE_TIMEOUT must be positive")
+        
         if errors:
             print("Configuration validation errors:")
             for error in errors:
@@ -74,12 +184,25 @@ class Config:
         print("=" * 50)
         print(f"OpenRouter API Key: {'Set' if cls.OPENROUTER_API_KEY else 'Not set'}")
         print(f"Use OpenRouter: {cls.USE_OPENROUTER}")
+        print(f"LLM Token Budget: {f'{cls.LLM_MAX_PROMPT_TOKENS} prompt' if cls.LLM_MAX_PROMPT_TOKENS else 'Unbudgeted prompt'} / {cls.LLM_MAX_COMPLETION_TOKENS} completion")
         print(f"Compression Target: {cls.COMPRESSION_TARGET} characters")
         print(f"Compression Method: {cls.COMPRESSION_METHOD}")
+        print(f"Sentence Segmenter: {cls.SENTENCE_SEGMENTER}")
+        print(f"Compression Cache: {f'{cls.COMPRESSION_CACHE_ITEMS} sentences' if cls.COMPRESSION_CACHE_ITEMS > 0 else 'Disabled'}")
+        print(f"Compression Windows: {cls.COMPRESSION_WINDOW_SIZE} characters ({cls.COMPRESSION_WORKERS} workers)")
         print(f"Max Graph Nodes: {cls.MAX_GRAPH_NODES}")
         print(f"Max Graph Edges: {cls.MAX_GRAPH_EDGES}")
+        print(f"Embedding Batch Size: {cls.EMBEDDING_BATCH_SIZE} (wait {cls.EMBEDDING_BATCH_WAIT_MS} ms)")
+        print(f"Embedding Backend: {cls.EMBEDDING_BACKEND}")
+        print(f"Embedding Chunks: {cls.EMBEDDING_CHUNK_TOKENS} tokens ({cls.EMBEDDING_CHUNK_OVERLAP} overlap)")
+        print(f"Embedding Cache: {f'{cls.EMBEDDING_CACHE_MEMORY_ITEMS} in memory / {cls.EMBEDDING_CACHE_MAX_DISK_MB} MB on disk' if cls.EMBEDDING_CACHE_ENABLED else 'Disabled'}")
+        print(f"PDF Engine: {cls.PDF_ENGINE}")
+        print(f"PDF Workers: {cls.PDF_WORKERS}")
+        print(f"PDF Sandbox: {f'{cls.PDF_SANDBOX_TIMEOUT}s / {cls.PDF_SANDBOX_MAX_RSS_MB} MB' if cls.PDF_SANDBOX_ENABLED else 'Disabled'}")
         print(f"API Host: {cls.API_HOST}")
         print(f"API Port: {cls.API_PORT}")
+        print(f"Similarity Graph: top {cls.SIMILARITY_GRAPH_TOP_K} above {cls.SIMILARITY_GRAPH_THRESHOLD}")
+        print(f"Result Cache: {cls.RESULT_CACHE_DIR if cls.RESULT_CACHE_ENABLED else 'Disabled'}")
         print(f"Log Level: {cls.LOG_LEVEL}")
         print(f"Test Mode: {cls.TEST_MODE}")
         print("=" * 50)
@@ -90,7 +213,9 @@ class Config:
         return {
             "api_key": cls.OPENROUTER_API_KEY,
             "site_url": cls.OPENROUTER_SITE_URL,
-            "site_name": cls.OPENROUTER_SITE_NAME
+            "site_name": cls.OPENROUTER_SITE_NAME,
+            "max_prompt_tokens": cls.LLM_MAX_PROMPT_TOKENS,
+            "max_completion_tokens": cls.LLM_MAX_COMPLETION_TOKENS
         }
     
     @classmethod
@@ -101,6 +226,37 @@ class Config:
             "method": cls.COMPRESSION_METHOD
         }
     
+    @classmethod
+    def get_hierarchical_compression_config(cls) -> dict:
+        """Get map-reduce compression configuration for long texts"""
+        return {
+            "window_size": cls.COMPRESSION_WINDOW_SIZE,
+            "max_workers": cls.COMPRESSION_WORKERS
+        }
+    
+    @classmethod
+    def get_pdf_config(cls) -> dict:
+        """Get PDF extraction configuration"""
+        return {
+            "max_workers": cls.PDF_WORKERS,
+            "pages_per_shard": cls.PDF_PAGES_PER_SHARD,
+            "parallel_min_pages": cls.PDF_PARALLEL_MIN_PAGES,
+            "engine": cls.PDF_ENGINE,
+            "layout_path_threshold": cls.PDF_LAYOUT_PATH_THRESHOLD
+        }
+    
+    @classmethod
+    def get_pdf_sandbox_config(cls) -> dict:
+        """Get PDF sandbox limits"""
+        return {
+            "max_workers": cls.PDF_SANDBOX_WORKERS,
+            "timeout": cls.PDF_SANDBOX_TIMEOUT,
+            "page_timeout": cls.PDF_SANDBOX_PAGE_TIMEOUT,
+            "max_rss_mb": cls.PDF_SANDBOX_MAX_RSS_MB,
+            "max_tasks_per_worker": cls.PDF_SANDBOX_MAX_TASKS,
+            "queue_timeout": cls.PDF_SANDBOX_QUEUE_TIMEOUT
+        }
+    
     @classmethod
     def get_graph_config(cls) -> dict:
         """Get graph building configuration"""
@@ -108,4 +264,67 @@ class Config:
             "max_nodes": cls.MAX_GRAPH_NODES,
             "max_edges": cls.MAX_GRAPH_EDGES,
             "use_openrouter": cls.USE_OPENROUTER
-        } 
\ No newline at end of file
+        }
+    
+    @classmethod
+    def get_result_cache_config(cls) -> dict:
+        """Get result cache configuration"""
+        return {
+            "cache_dir": cls.RESULT_CACHE_DIR,
+            "max_memory_items": cls.RESULT_CACHE_MEMORY_ITEMS,
+            "max_disk_bytes": cls.RESULT_CACHE_MAX_DISK_MB * 1024 * 1024
+        }
+    
+    @classmethod
+    def get_embedding_cache_config(cls) -> dict:
+        """Get chunk embedding cache configuration"""
+        return {
+            "cache_dir": cls.EMBEDDING_CACHE_DIR,
+            "max_memory_items": cls.EMBEDDING_CACHE_MEMORY_ITEMS,
+            "max_disk_mb": cls.EMBEDDING_CACHE_MAX_DISK_MB
+        }
+    
+    @classmethod
+    def get_vector_index_config(cls) -> dict:
+        """Get chunk vector index configuration"""
+        return {
+            "index_dir": cls.VECTOR_INDEX_DIR,
+            "nprobe": cls.VECTOR_INDEX_NPROBE,
+            "train_threshold": cls.VECTOR_INDEX_TRAIN_THRESHOLD
+        }
+    
+    @classmethod
+    def get_similarity_graph_config(cls) -> dict:
+        """Get document similarity graph defaults"""
+        return {
+            "top_k": cls.SIMILARITY_GRAPH_TOP_K,
+            "threshold": cls.SIMILARITY_GRAPH_THRESHOLD
+        }
+    
+    @classmethod
+    def get_cache_fingerprint(cls, **model_names) -> str:
+        """
+        Fingerprint of every setting that changes processing output
+        
+        Args:
+            model_names: Names of the models involved, e.g. embedding_model and llm_model
+        """
+        settings = {
+            "compression_target": cls.COMPRESSION_TARGET,
+            "compression_method": cls.COMPRESSION_METHOD,
+            "compression_window_size": cls.COMPRESSION_WINDOW_SIZE,
+            "sentence_segmenter": cls.SENTENCE_SEGMENTER,
+            "max_text_length": cls.MAX_TEXT_LENGTH,
+            "llm_max_prompt_tokens": cls.LLM_MAX_PROMPT_TOKENS,
+            "llm_max_completion_tokens": cls.LLM_MAX_COMPLETION_TOKENS,
+            "max_graph_nodes": cls.MAX_GRAPH_NODES,
+            "max_graph_edges": cls.MAX_GRAPH_EDGES,
+            "use_openrouter": cls.USE_OPENROUTER,
+            "pdf_engine": cls.PDF_ENGINE,
+            "pdf_layout_path_threshold": cls.PDF_LAYOUT_PATH_THRESHOLD,
+            "document_embedding_strategy": cls.DOCUMENT_EMBEDDING_STRATEGY,
+            "embedding_chunk_tokens": cls.EMBEDDING_CHUNK_TOKENS,
+            "embedding_chunk_overlap": cls.EMBEDDING_CHUNK_OVERLAP,
+            "models": model_names
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
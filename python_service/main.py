@@ -1,17 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
+import asyncio
 import base64
 import io
-from typing import Optional, Dict, Any
+import json
+import mmap
+import os
+import time
+from typing import Optional, Dict, Any, List, Tuple, BinaryIO, Literal, Union
 import logging
 
 from config import Config
 from services.pdf_processor import PDFProcessor
+from services.pdf_sandbox import PDFSandbox, PDFSandboxBusy, PDFSandboxLimitExceeded
 from services.embedding_service import EmbeddingService
 from services.enhanced_graph_builder import EnhancedGraphBuilder
 from services.text_compressor import TextCompressor
 from services.openrouter_service import OpenRouterService
+from services.result_cache import ResultCache, hash_stream
+from services.embedding_cache import EmbeddingCache
+from services.embedding_codec import decode_vectors
+from services.vector_index import VectorIndex
+from services.similarity_graph import DocumentSimilarityGraph
+from services.similarity_search import top_k_similar
+from services.page_index import PageIndex
+from services.analyzed_document import AnalyzedDocument
+from services.hierarchical_compressor import HierarchicalCompressor
+from services.token_budget import TokenEstimator
 
 # Configure logging
 logging.basicConfig(
@@ -44,14 +61,47 @@ app.add_middleware(
 )
 
 # Initialize services
-pdf_processor = PDFProcessor()
-embedding_service = EmbeddingService()
-text_compressor = TextCompressor()
+pdf_sandbox = PDFSandbox(**Config.get_pdf_sandbox_config()) if Config.PDF_SANDBOX_ENABLED else None
+pdf_processor = PDFProcessor(**Config.get_pdf_config(), sandbox=pdf_sandbox)
+embedding_cache = EmbeddingCache(**Config.get_embedding_cache_config()) if Config.EMBEDDING_CACHE_ENABLED else None
+embedding_service = EmbeddingService(
+    batch_size=Config.EMBEDDING_BATCH_SIZE,
+    batch_wait_ms=Config.EMBEDDING_BATCH_WAIT_MS,
+    document_strategy=Config.DOCUMENT_EMBEDDING_STRATEGY,
+    cache=embedding_cache,
+    chunk_tokens=Config.EMBEDDING_CHUNK_TOKENS,
+    chunk_overlap=Config.EMBEDDING_CHUNK_OVERLAP,
+    backend=Config.EMBEDDING_BACKEND,
+    onnx_dir=Config.EMBEDDING_ONNX_DIR,
+    min_cosine=Config.EMBEDDING_BACKEND_MIN_COSINE
+)
+text_compressor = TextCompressor(cache_items=Config.COMPRESSION_CACHE_ITEMS, segmenter=Config.SENTENCE_SEGMENTER)
+hierarchical_compressor = HierarchicalCompressor(text_compressor, **Config.get_hierarchical_compression_config())
+
+# Initialize the chunk vector index behind /search, updated by every processed PDF
+vector_index = VectorIndex(**Config.get_vector_index_config()) if Config.VECTOR_INDEX_ENABLED else None
+
+# Initialize the document embedding store behind /similarity-graph
+similarity_graph = DocumentSimilarityGraph(store_path=Config.SIMILARITY_GRAPH_PATH)
+
+# Token estimator shared by every OpenRouter client, calibrated from the usage they report
+token_estimator = TokenEstimator()
 
 # Initialize enhanced graph builder with OpenRouter integration
 enhanced_graph_builder = EnhancedGraphBuilder(
     use_openrouter=Config.USE_OPENROUTER,
-    compression_target=Config.COMPRESSION_TARGET
+    compression_target=Config.COMPRESSION_TARGET,
+    max_prompt_tokens=Config.LLM_MAX_PROMPT_TOKENS,
+    max_completion_tokens=Config.LLM_MAX_COMPLETION_TOKENS,
+    token_estimator=token_estimator,
+    text_compressor=text_compressor
+)
+
+# Initialize content-addressed result cache, keyed by PDF bytes and output-relevant settings
+result_cache = ResultCache(**Config.get_result_cache_config()) if Config.RESULT_CACHE_ENABLED else None
+cache_fingerprint = Config.get_cache_fingerprint(
+    embedding_model=embedding_service.cache_model_name,
+    llm_model=OpenRouterService.DEFAULT_MODEL
 )
 
 # Initialize OpenRouter service for direct API calls
@@ -61,14 +111,45 @@ if Config.USE_OPENROUTER:
     openrouter_service = OpenRouterService(
         api_key=openrouter_config["api_key"],
         site_url=openrouter_config["site_url"],
-        site_name=openrouter_config["site_name"]
+        site_name=openrouter_config["site_name"],
+        max_prompt_tokens=openrouter_config["max_prompt_tokens"],
+        max_completion_tokens=openrouter_config["max_completion_tokens"],
+        token_estimator=token_estimator
     )
 
+EmbeddingFormat = Literal["json", "float32", "float16", "int8"]
+
 class ProcessRequest(BaseModel):
     file_id: str
     content: str  # base64 encoded content
     mime_type: str
     filename: str
+    first_page: Optional[int] = Field(None, ge=1)  # 1-based, inclusive
+    last_page: Optional[int] = Field(None, ge=1)
+    embedding_format: EmbeddingFormat = Config.EMBEDDING_FORMAT
+    
+    @model_validator(mode="after")
+    def check_page_range(self):
+        if self.first_page and self.last_page and self.last_page < self.first_page:
+            raise ValueError("last_page must not be before first_page")
+        return self
+    
+    def page_range(self) -> Optional[Tuple[int, int]]:
+        return make_page_range(self.first_page, self.last_page)
+
+def make_page_range(first_page: Optional[int], last_page: Optional[int]) -> Optional[Tuple[int, int]]:
+    """Build a (first_page, last_page) range from optional request bounds"""
+    if first_page is None and last_page is None:
+        return None
+    first_page = first_page or 1
+    last_page = last_page or 2 ** 31 - 1
+    if last_page < first_page:
+        raise HTTPException(status_code=422, detail="last_page must not be before first_page")
+    return first_page, last_page
+
+def page_range_namespace(namespace: str, page_range: Optional[Tuple[int, int]]) -> str:
+    """Cache namespace that keeps partial extractions apart from full ones"""
+    return namespace if page_range is None else f"{namespace}:{page_range[0]}-{page_range[1]}"
 
 class SummarizeRequest(BaseModel):
     text: str
@@ -76,9 +157,21 @@ class SummarizeRequest(BaseModel):
     filename: Optional[str] = None
     use_ai: bool = True
 
+class SearchRequest(BaseModel):
+    query: str
+    k: int = Field(10, ge=1, le=100)
+    nprobe: Optional[int] = Field(None, ge=1)
+
+class SimilarityRequest(BaseModel):
+    # Vectors as JSON lists or base64 payloads in any embedding_format; one query vector gives flat results
+    queries: Union[List[Any], Dict[str, Any]]
+    corpus: Union[List[Any], Dict[str, Any]]
+    k: int = Field(10, ge=1, le=1000)
+
 class CompressRequest(BaseModel):
     text: str
     target_length: int = Config.COMPRESSION_TARGET
+    target_tokens: Optional[int] = Field(None, ge=1)
     method: str = Config.COMPRESSION_METHOD
 
 class ProcessResponse(BaseModel):
@@ -90,6 +183,20 @@ class ProcessResponse(BaseModel):
     processing_time: float
     compression_info: Optional[Dict[str, Any]] = None
     ai_used: bool = False
+    cache_hit: bool = False
+
+async def lookup_cached_result(namespace: str, pdf_stream: BinaryIO) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Hash the PDF bytes and look up a previous result; returns (cache_key, cached_value)"""
+    if result_cache is None:
+        return None, None
+    content_hash = await asyncio.to_thread(hash_stream, pdf_stream)
+    cache_key = ResultCache.make_key(namespace, content_hash, cache_fingerprint)
+    return cache_key, await asyncio.to_thread(result_cache.get, cache_key)
+
+async def store_cached_result(cache_key: Optional[str], value: Dict[str, Any]):
+    """Store a result under a key from lookup_cached_result"""
+    if result_cache is not None and cache_key is not None:
+        await asyncio.to_thread(result_cache.set, cache_key, value)
 
 @app.on_event("startup")
 async def startup_event():
@@ -97,6 +204,18 @@ async def startup_event():
     logger.info("Starting Enhanced Document Processing Service")
     logger.info(f"OpenRouter integration: {'Enabled' if Config.USE_OPENROUTER else 'Disabled'}")
     logger.info(f"Text compression target: {Config.COMPRESSION_TARGET} characters")
+    logger.info(f"PDF extraction engine: {Config.PDF_ENGINE}, workers: {Config.PDF_WORKERS}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release worker processes on shutdown"""
+    pdf_processor.shutdown()
+    embedding_service.shutdown()
+    hierarchical_compressor.shutdown()
+    if vector_index is not None:
+        vector_index.shutdown()
+    if pdf_sandbox is not None:
+        pdf_sandbox.shutdown()
 
 @app.get("/")
 async def root():
@@ -113,7 +232,10 @@ async def root():
             "compression_target": Config.COMPRESSION_TARGET,
             "compression_method": Config.COMPRESSION_METHOD,
             "max_graph_nodes": Config.MAX_GRAPH_NODES,
-            "max_graph_edges": Config.MAX_GRAPH_EDGES
+            "max_graph_edges": Config.MAX_GRAPH_EDGES,
+            "pdf_workers": Config.PDF_WORKERS,
+            "pdf_engine": Config.PDF_ENGINE,
+            "vector_index": Config.VECTOR_INDEX_ENABLED
         }
     }
 
@@ -138,6 +260,13 @@ async def health_check():
     else:
         services_status["openrouter_service"] = "disabled"
     
+    services_status["result_cache"] = result_cache.get_stats() if result_cache else "disabled"
+    services_status["vector_index"] = vector_index.get_stats() if vector_index else "disabled"
+    services_status["similarity_graph"] = similarity_graph.get_stats()
+    services_status["compression_cache"] = (
+        text_compressor.score_cache.get_stats() if text_compressor.score_cache else "disabled"
+    )
+    
     return {"status": "healthy", "services": services_status}
 
 @app.get("/config")
@@ -149,6 +278,8 @@ async def get_config():
         "compression_method": Config.COMPRESSION_METHOD,
         "max_graph_nodes": Config.MAX_GRAPH_NODES,
         "max_graph_edges": Config.MAX_GRAPH_EDGES,
+        "pdf_workers": Config.PDF_WORKERS,
+        "pdf_engine": Config.PDF_ENGINE,
         "api_host": Config.API_HOST,
         "api_port": Config.API_PORT,
         "log_level": Config.LOG_LEVEL
@@ -159,19 +290,17 @@ async def compress_text(request: CompressRequest):
     """Compress text to reduce API usage"""
     try:
         # Validate text length
-        if len(request.text) > Config.MAX_TEXT_LENGTH:
+        if len(request.text) > Config.MAX_DOCUMENT_LENGTH:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Text too long. Maximum allowed: {Config.MAX_TEXT_LENGTH} characters"
+                detail=f"Text too long. Maximum allowed: {Config.MAX_DOCUMENT_LENGTH} characters"
             )
         
-        result = text_compressor.compress_text(
-            request.text,
-            target_length=request.target_length,
-            method=request.method
+        result = await compress_document(
+            request.text, request.target_length, request.method, target_tokens=request.target_tokens
         )
         
-        return {
+        response = {
             "compressed_text": result["compressed_text"],
             "original_length": result["original_length"],
             "compressed_length": result["compressed_length"],
@@ -179,6 +308,10 @@ async def compress_text(request: CompressRequest):
             "method": result["method"],
             "preserved_elements": result["preserved_elements"]
         }
+        for key in ("target_tokens", "estimated_tokens", "hierarchical"):
+            if key in result:
+                response[key] = result[key]
+        return response
         
     except Exception as e:
         logger.error(f"Text compression failed: {str(e)}")
@@ -189,19 +322,22 @@ async def summarize_text(request: SummarizeRequest):
     """Generate a summary of the provided text"""
     try:
         # Validate text length
-        if len(request.text) > Config.MAX_TEXT_LENGTH:
+        if len(request.text) > Config.MAX_DOCUMENT_LENGTH:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Text too long. Maximum allowed: {Config.MAX_TEXT_LENGTH} characters"
+                detail=f"Text too long. Maximum allowed: {Config.MAX_DOCUMENT_LENGTH} characters"
             )
         
         if request.use_ai and openrouter_service:
             try:
-                # Use AI-powered summarization
-                result = openrouter_service.generate_summary(request.text, request.max_length)
+                # Use AI-powered summarization, on a reduced text for long inputs
+                text = request.text
+                if len(text) > Config.MAX_TEXT_LENGTH:
+                    text = (await hierarchical_compressor.reduce(text, Config.COMPRESSION_TARGET))["reduced_text"]
+                result = openrouter_service.generate_summary(text, request.max_length)
                 return {
                     "summary": result["summary"],
-                    "original_length": result["original_length"],
+                    "original_length": len(request.text),
                     "summary_length": result["summary_length"],
                     "filename": request.filename,
                     "method": "ai",
@@ -240,14 +376,14 @@ async def extract_entities(request: SummarizeRequest):
             raise HTTPException(status_code=400, detail="OpenRouter service not available")
         
         # Validate text length
-        if len(request.text) > Config.MAX_TEXT_LENGTH:
+        if len(request.text) > Config.MAX_DOCUMENT_LENGTH:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Text too long. Maximum allowed: {Config.MAX_TEXT_LENGTH} characters"
+                detail=f"Text too long. Maximum allowed: {Config.MAX_DOCUMENT_LENGTH} characters"
             )
         
         # Compress text first to reduce API usage
-        compressed_result = text_compressor.compress_text(request.text, target_length=1500)
+        compressed_result = await compress_document(request.text, 1500, "smart")
         compressed_text = compressed_result["compressed_text"]
         
         # Extract entities using AI
@@ -266,11 +402,187 @@ async def extract_entities(request: SummarizeRequest):
         logger.error(f"Entity extraction failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Entity extraction failed: {str(e)}")
 
+async def textrank_vectors(method: str, target_length: int, document: AnalyzedDocument):
+    """Sentence embeddings for TextRank compression, or None when they would not be used"""
+    if method != "textrank" or len(document.text) <= target_length:
+        return None
+    return await embedding_service.embed_sentences(document.sentences)
+
+async def compress_document(text: str, target_length: int, method: str,
+                            document: Optional[AnalyzedDocument] = None,
+                            target_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Compress text of any accepted length
+    
+    Texts over MAX_TEXT_LENGTH are first reduced window by window; ``method`` then
+    runs on the reduced text and the result reports the reduction under "hierarchical".
+    With ``target_tokens`` the result fills that many tokens of the default LLM
+    instead of ``target_length`` characters.
+    """
+    reduction = None
+    if len(text) > Config.MAX_TEXT_LENGTH:
+        # About four characters per token, so the reduction keeps enough text to fill the budget
+        window_target = max(target_length, 4 * target_tokens) if target_tokens else target_length
+        reduction = await hierarchical_compressor.reduce(text, window_target)
+        reduced_text = reduction.pop("reduced_text")
+    else:
+        reduced_text = text
+    
+    document = text_compressor.analyze(reduced_text, document)
+    # A token budget is met with roughly as many characters as compress_to_tokens first aims for
+    character_target = (token_estimator.characters_for(reduced_text, target_tokens, OpenRouterService.DEFAULT_MODEL)
+                        if target_tokens is not None else target_length)
+    sentence_vectors = await textrank_vectors(method, character_target, document)
+    if target_tokens is not None:
+        result = text_compressor.compress_to_tokens(
+            reduced_text, target_tokens, token_estimator, OpenRouterService.DEFAULT_MODEL,
+            method=method, document=document, sentence_vectors=sentence_vectors
+        )
+    else:
+        result = text_compressor.compress_text(
+            reduced_text,
+            target_length=target_length,
+            method=method,
+            document=document,
+            sentence_vectors=sentence_vectors
+        )
+    if reduction is not None:
+        result["original_length"] = len(text)
+        result["compression_ratio"] = result["compressed_length"] / len(text)
+        result["hierarchical"] = reduction
+    return result
+
+async def graph_compression(text: str, document: Optional[AnalyzedDocument], metadata: Dict[str, Any],
+                            compression_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The smart compression the graph builder needs, reusing the request's when it matches
+    
+    Returns None for short texts the builder can compress itself; long texts are
+    compressed here so the builder never compresses them in one pass. With a prompt
+    token budget the text is fitted to that budget instead.
+    """
+    budget = enhanced_graph_builder.prompt_text_budget(metadata)
+    if budget is not None:
+        return await compress_document(text, Config.COMPRESSION_TARGET, "smart", document, target_tokens=budget)
+    if Config.COMPRESSION_METHOD == "smart" or compression_result["method"] == "none":
+        return compression_result
+    if len(text) > Config.MAX_TEXT_LENGTH:
+        return await compress_document(text, Config.COMPRESSION_TARGET, "smart")
+    return None
+
+def is_full_document(page_range: Optional[Tuple[int, int]], metadata: Dict[str, Any]) -> bool:
+    """Whether an extraction covers the whole document, so it may replace what is indexed under the file id"""
+    return page_range is None and not metadata.get('partial')
+
+async def index_document(file_id: str, embeddings: Optional[Dict[str, Any]], full_document: bool = True):
+    """
+    Add a document's embeddings to the vector index and similarity graph; failures only log
+    
+    Page ranges and partial extractions are not indexed, since they would replace
+    every chunk and the document embedding stored for the file.
+    """
+    if not embeddings or not full_document:
+        return
+    try:
+        document_vector = decode_vectors(embeddings["document_embedding"])
+        await asyncio.to_thread(similarity_graph.put, file_id, document_vector)
+    except Exception as e:
+        logger.warning(f"Failed to add {file_id} to the similarity graph: {str(e)}")
+    if vector_index is None:
+        return
+    try:
+        vectors = decode_vectors(embeddings["chunk_embeddings"])
+        await asyncio.to_thread(vector_index.add, file_id, vectors, embeddings["chunk_texts"])
+    except Exception as e:
+        logger.warning(f"Failed to index {file_id} for search: {str(e)}")
+
+async def run_pdf_pipeline(file_id: str, filename: str, pdf_stream: BinaryIO, start_time: float,
+                           page_range: Optional[Tuple[int, int]] = None,
+                           embedding_format: str = "json") -> ProcessResponse:
+    """Extract, compress, embed and graph a PDF stream, going through the result cache"""
+    # Serve byte-identical documents from the result cache
+    namespace = page_range_namespace(f"process-pdf:{embedding_format}", page_range)
+    cache_key, cached = await lookup_cached_result(namespace, pdf_stream)
+    if cached is not None:
+        logger.info(f"Result cache hit for {filename}")
+        await index_document(file_id, cached.get("embeddings"), is_full_document(page_range, cached.get("metadata", {})))
+        return ProcessResponse(
+            file_id=file_id,
+            processing_time=time.time() - start_time,
+            cache_hit=True,
+            **cached
+        )
+    
+    # Process PDF
+    text_content, metadata = await pdf_processor.process_pdf(pdf_stream, page_range)
+    page_index = PageIndex.from_dict(metadata.get('page_index'))
+    logger.info(f"PDF processed - Text length: {len(text_content)} characters")
+    
+    # Tokenise once for compression, chunking and graph building; long texts are compressed window by window instead
+    document = text_compressor.analyze(text_content) if len(text_content) <= Config.MAX_TEXT_LENGTH else None
+    
+    # Compress text for graph generation
+    compression_result = await compress_document(
+        text_content, Config.COMPRESSION_TARGET, Config.COMPRESSION_METHOD, document
+    )
+    compressed_text = compression_result["compressed_text"]
+    
+    logger.info(f"Text compressed - Ratio: {compression_result['compression_ratio']:.2f}")
+    
+    # Generate embeddings
+    embeddings = await embedding_service.generate_embeddings(text_content, page_index, embedding_format, document)
+    logger.info("Embeddings generated")
+    await index_document(file_id, embeddings, is_full_document(page_range, metadata))
+    
+    # Build enhanced knowledge graph
+    graph_data = await enhanced_graph_builder.build_graph(
+        text_content, metadata, page_index, document, await graph_compression(text_content, document, metadata, compression_result)
+    )
+    logger.info(f"Graph built - Nodes: {graph_data['total_nodes']}, Edges: {graph_data['total_edges']}")
+    
+    processing_time = time.time() - start_time
+    
+    response = ProcessResponse(
+        file_id=file_id,
+        text_content=text_content,
+        metadata=metadata,
+        embeddings=embeddings,
+        graph_data=graph_data,
+        processing_time=processing_time,
+        compression_info=compression_result,
+        ai_used=graph_data.get('ai_used', False)
+    )
+    
+    # Pages skipped on the per-page time limit make a result timing-dependent, and a graph built after
+    # an OpenRouter failure is degraded by a possibly transient error, so neither is cached
+    if not metadata.get('partial') and not graph_data.get('ai_fallback'):
+        await store_cached_result(cache_key, response.model_dump(exclude={"file_id", "processing_time", "cache_hit"}))
+    
+    return response
+
+async def open_upload_stream(upload: UploadFile) -> BinaryIO:
+    """
+    Turn a spooled multipart upload into a stream for PDFProcessor
+    
+    Small files are read into memory; files past UPLOAD_MMAP_THRESHOLD_MB are
+    memory-mapped from the spool file so the document is never copied.
+    """
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    
+    if size > 0 and size >= Config.UPLOAD_MMAP_THRESHOLD_MB * 1024 * 1024:
+        # Make sure the SpooledTemporaryFile is backed by a real file before mapping it
+        if hasattr(upload.file, "rollover"):
+            upload.file.rollover()
+        return mmap.mmap(upload.file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    return io.BytesIO(await upload.read())
+
 @app.post("/process-pdf", response_model=ProcessResponse)
 async def process_pdf(request: ProcessRequest):
     """Process a PDF file and extract text, metadata, embeddings, and enhanced graph data"""
     try:
-        import time
         start_time = time.time()
         
         logger.info(f"Processing PDF: {request.filename}")
@@ -279,43 +591,47 @@ async def process_pdf(request: ProcessRequest):
         pdf_content = base64.b64decode(request.content)
         pdf_stream = io.BytesIO(pdf_content)
         
-        # Process PDF
-        text_content, metadata = await pdf_processor.process_pdf(pdf_stream)
-        logger.info(f"PDF processed - Text length: {len(text_content)} characters")
-        
-        # Compress text for graph generation
-        compression_result = text_compressor.compress_text(
-            text_content, 
-            target_length=Config.COMPRESSION_TARGET,
-            method=Config.COMPRESSION_METHOD
-        )
-        compressed_text = compression_result["compressed_text"]
-        
-        logger.info(f"Text compressed - Ratio: {compression_result['compression_ratio']:.2f}")
+        return await run_pdf_pipeline(request.file_id, request.filename, pdf_stream, start_time,
+                                      request.page_range(), request.embedding_format)
         
-        # Generate embeddings
-        embeddings = await embedding_service.generate_embeddings(text_content)
-        logger.info("Embeddings generated")
-        
-        # Build enhanced knowledge graph
-        graph_data = await enhanced_graph_builder.build_graph(text_content, metadata)
-        logger.info(f"Graph built - Nodes: {graph_data['total_nodes']}, Edges: {graph_data['total_edges']}")
+    except PDFSandboxLimitExceeded as e:
+        logger.warning(f"PDF rejected by sandbox limits: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except PDFSandboxBusy as e:
+        logger.warning(f"PDF sandbox busy: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"PDF processing failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
+@app.post("/process-pdf/upload", response_model=ProcessResponse)
+async def process_pdf_upload(file: UploadFile = File(...), file_id: str = Form(...),
+                             first_page: Optional[int] = Form(None, ge=1),
+                             last_page: Optional[int] = Form(None, ge=1),
+                             embedding_format: EmbeddingFormat = Form(Config.EMBEDDING_FORMAT)):
+    """Process a PDF sent as raw multipart bytes instead of base64 inside JSON"""
+    page_range = make_page_range(first_page, last_page)
+    try:
+        start_time = time.time()
         
-        processing_time = time.time() - start_time
+        logger.info(f"Processing uploaded PDF: {file.filename}")
         
-        return ProcessResponse(
-            file_id=request.file_id,
-            text_content=text_content,
-            metadata=metadata,
-            embeddings=embeddings,
-            graph_data=graph_data,
-            processing_time=processing_time,
-            compression_info=compression_result,
-            ai_used=graph_data.get('ai_used', False)
-        )
+        pdf_stream = await open_upload_stream(file)
+        try:
+            return await run_pdf_pipeline(file_id, file.filename, pdf_stream, start_time, page_range,
+                                          embedding_format)
+        finally:
+            pdf_stream.close()
+            await file.close()
         
+    except PDFSandboxLimitExceeded as e:
+        logger.warning(f"PDF rejected by sandbox limits: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except PDFSandboxBusy as e:
+        logger.warning(f"PDF sandbox busy: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        logger.error(f"PDF processing failed: {str(e)}")
+        logger.error(f"PDF upload processing failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 @app.post("/extract-text")
@@ -326,8 +642,16 @@ async def extract_text(request: ProcessRequest):
         pdf_content = base64.b64decode(request.content)
         pdf_stream = io.BytesIO(pdf_content)
         
+        page_range = request.page_range()
+        cache_key, cached = await lookup_cached_result(page_range_namespace("extract-text", page_range), pdf_stream)
+        if cached is not None:
+            return {"file_id": request.file_id, **cached}
+        
         # Process PDF for text only
-        text_content, metadata = await pdf_processor.process_pdf(pdf_stream)
+        text_content, metadata = await pdf_processor.process_pdf(pdf_stream, page_range)
+        
+        if not metadata.get('partial'):
+            await store_cached_result(cache_key, {"text_content": text_content, "metadata": metadata})
         
         return {
             "file_id": request.file_id,
@@ -335,30 +659,130 @@ async def extract_text(request: ProcessRequest):
             "metadata": metadata
         }
         
+    except PDFSandboxLimitExceeded as e:
+        logger.warning(f"PDF rejected by sandbox limits: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except PDFSandboxBusy as e:
+        logger.warning(f"PDF sandbox busy: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Text extraction failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Text extraction failed: {str(e)}")
 
+@app.post("/extract-text/stream")
+async def extract_text_stream(request: ProcessRequest):
+    """Stream per-page text as NDJSON records ({page, text, char_offset}) as pages are extracted"""
+    try:
+        # Decode base64 content
+        pdf_content = base64.b64decode(request.content)
+        pdf_stream = io.BytesIO(pdf_content)
+        
+        # Pull the first page before responding so open failures still return an error status
+        pages = pdf_processor.iter_pages(pdf_stream, request.page_range())
+        first_page = await anext(pages, None)
+        
+    except PDFSandboxLimitExceeded as e:
+        logger.warning(f"PDF rejected by sandbox limits: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except PDFSandboxBusy as e:
+        logger.warning(f"PDF sandbox busy: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Streaming text extraction failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Text extraction failed: {str(e)}")
+    
+    async def ndjson_lines():
+        try:
+            if first_page is not None:
+                yield json.dumps(first_page) + "\n"
+            async for page in pages:
+                yield json.dumps(page) + "\n"
+        except Exception as e:
+            logger.error(f"Streaming text extraction failed for {request.filename}: {str(e)}")
+            raise
+        finally:
+            await pages.aclose()
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@app.post("/search")
+async def search_chunks(request: SearchRequest):
+    """Find the chunks across all processed documents that best match a query"""
+    if vector_index is None:
+        raise HTTPException(status_code=503, detail="Vector index is disabled")
+    try:
+        query_vector = await embedding_service.embed_query(request.query)
+        results = await asyncio.to_thread(vector_index.search, query_vector, request.k, request.nprobe)
+        
+        return {
+            "query": request.query,
+            "results": results,
+            "total_results": len(results)
+        }
+        
+    except Exception as e:
+        logger.error(f"Search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@app.post("/similarity")
+async def batch_similarity(request: SimilarityRequest):
+    """Top-k cosine matches of one or many query vectors against a corpus of vectors"""
+    try:
+        queries = decode_vectors(request.queries)
+        corpus = decode_vectors(request.corpus)
+        if queries.ndim not in (1, 2) or corpus.ndim != 2 or queries.shape[-1] != corpus.shape[1]:
+            raise HTTPException(status_code=400, detail="queries must be a vector or matrix and corpus a matrix of the same dimension")
+        
+        indices, scores = await asyncio.to_thread(top_k_similar, queries, corpus, request.k)
+        
+        return {
+            "indices": indices.tolist(),
+            "scores": scores.tolist(),
+            "num_queries": 1 if queries.ndim == 1 else len(queries),
+            "corpus_size": len(corpus)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Similarity search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Similarity search failed: {str(e)}")
+
+@app.get("/similarity-graph")
+async def get_similarity_graph(
+    top_k: int = Query(Config.SIMILARITY_GRAPH_TOP_K, ge=1, le=100),
+    threshold: float = Query(Config.SIMILARITY_GRAPH_THRESHOLD, ge=-1.0, le=1.0)
+):
+    """Cross-document similarity graph: each document's top-k most similar documents above a threshold"""
+    try:
+        return await asyncio.to_thread(similarity_graph.get_graph, top_k, threshold)
+        
+    except Exception as e:
+        logger.error(f"Similarity graph failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Similarity graph failed: {str(e)}")
+
 @app.post("/generate-graph")
 async def generate_graph(request: SummarizeRequest):
     """Generate a knowledge graph from text content"""
     try:
         # Validate text length
-        if len(request.text) > Config.MAX_TEXT_LENGTH:
+        if len(request.text) > Config.MAX_DOCUMENT_LENGTH:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Text too long. Maximum allowed: {Config.MAX_TEXT_LENGTH} characters"
+                detail=f"Text too long. Maximum allowed: {Config.MAX_DOCUMENT_LENGTH} characters"
             )
         
         # Compress text first
-        compression_result = text_compressor.compress_text(
-            request.text, 
-            target_length=Config.COMPRESSION_TARGET,
-            method=Config.COMPRESSION_METHOD
+        document = text_compressor.analyze(request.text) if len(request.text) <= Config.MAX_TEXT_LENGTH else None
+        compression_result = await compress_document(
+            request.text, Config.COMPRESSION_TARGET, Config.COMPRESSION_METHOD, document
         )
         
         # Generate graph
-        graph_data = await enhanced_graph_builder.build_graph(request.text, {})
+        graph_data = await enhanced_graph_builder.build_graph(
+            request.text, {}, document=document,
+            compression_result=await graph_compression(request.text, document, {}, compression_result)
+        )
         
         return {
             "graph_data": graph_data["graph_data"],
@@ -0,0 +1,118 @@
+from collections import Counter
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+
+import numpy as np
+from nltk.corpus import stopwords
+from nltk.tokenize import sent_tokenize, word_tokenize
+
+from .sentence_cache import SentenceCache, sentence_key
+from .sentence_segmenter import SENTENCE_SEGMENTERS, regex_sentences
+
+
+@lru_cache(maxsize=1)
+def english_stopwords() -> FrozenSet[str]:
+    """NLTK's English stopword list, loaded once per process"""
+    return frozenset(stopwords.words('english'))
+
+
+class AnalyzedDocument:
+    """
+    Sentences, tokens and term statistics of one text, computed in a single pass
+
+    Built once per request and shared by the compressor, the graph builders and
+    the embedding chunker instead of each re-tokenising the same text. Tokens are
+    stored flat, with ``sentence_bounds[i]:sentence_bounds[i + 1]`` giving the
+    token range of sentence ``i``.
+    """
+
+    def __init__(self, text: str, sentences: List[str], sentence_spans: List[Tuple[int, int]],
+                 tokens: List[str], sentence_bounds: np.ndarray,
+                 sentence_keys: Optional[List[bytes]] = None):
+        self.text = text
+        self.sentences = sentences
+        self.sentence_spans = sentence_spans
+        self.tokens = tokens
+        self.sentence_bounds = sentence_bounds
+        self._sentence_keys = sentence_keys
+
+        stop_words = english_stopwords()
+        self.stopword_mask = np.fromiter((token in stop_words for token in tokens), dtype=bool, count=len(tokens))
+        alnum = np.fromiter((token.isalnum() for token in tokens), dtype=bool, count=len(tokens))
+        # Alphanumeric non-stopwords, the "content words" of the sentence and keyword heuristics
+        self.content_mask = alnum & ~self.stopword_mask
+        self.term_counts = Counter(
+            token for token, content in zip(tokens, self.content_mask) if content and len(token) > 3
+        )
+
+    @classmethod
+    def analyze(cls, text: str, cache: Optional[SentenceCache] = None,
+                segmenter: str = "punkt") -> "AnalyzedDocument":
+        """
+        Split text into sentences and lowercase word tokens
+
+        Each sentence is tokenised on its own, exactly as
+        ``word_tokenize(sentence.lower())``, so per-sentence statistics match
+        code that tokenises sentences one at a time.
+
+        Args:
+            text: Text to analyse
+            cache: Token lists by sentence hash; only sentences missing from it
+                are tokenised, so re-analysing an edited text is cheap
+            segmenter: "punkt" (nltk's sent_tokenize) or "regex", a much faster
+                rule-based splitter that handles common abbreviations and decimals
+        """
+        if segmenter not in SENTENCE_SEGMENTERS:
+            raise ValueError(f"Unknown sentence segmenter: {segmenter}")
+        split = regex_sentences if segmenter == "regex" else sent_tokenize
+        sentences = split(text) if text else []
+        keys = [sentence_key(sentence) for sentence in sentences] if cache is not None else None
+        cached = cache.get_many(keys) if cache is not None else [None] * len(sentences)
+        sentence_spans = []
+        tokens: List[str] = []
+        bounds = [0]
+        cursor = 0
+        new_keys, new_tokens = [], []
+        for position, sentence in enumerate(sentences):
+            start = text.find(sentence, cursor)
+            if start == -1:
+                start = cursor
+            sentence_spans.append((start, start + len(sentence)))
+            cursor = start + len(sentence)
+            sentence_tokens = cached[position]
+            if sentence_tokens is None:
+                sentence_tokens = tuple(word_tokenize(sentence.lower()))
+                if keys is not None:
+                    new_keys.append(keys[position])
+                    new_tokens.append(sentence_tokens)
+            tokens.extend(sentence_tokens)
+            bounds.append(len(tokens))
+        if new_keys:
+            cache.put_many(new_keys, new_tokens)
+        return cls(text, sentences, sentence_spans, tokens, np.asarray(bounds, dtype=np.int64), keys)
+
+    @property
+    def sentence_keys(self) -> List[bytes]:
+        """Hash of every sentence, the key of per-sentence caches"""
+        if self._sentence_keys is None:
+            self._sentence_keys = [sentence_key(sentence) for sentence in self.sentences]
+        return self._sentence_keys
+
+    def __len__(self) -> int:
+        return len(self.sentences)
+
+    def sentence_tokens(self, index: int) -> List[str]:
+        """Lowercase tokens of one sentence"""
+        return self.tokens[self.sentence_bounds[index]:self.sentence_bounds[index + 1]]
+
+    def keywords(self, limit: int = 20) -> List[str]:
+        """Most frequent content words longer than three characters"""
+        return [word for word, _ in self.term_counts.most_common(limit)]
+
+    @classmethod
+    def for_text(cls, text: str, document: Optional["AnalyzedDocument"] = None,
+                 cache: Optional[SentenceCache] = None, segmenter: str = "punkt") -> "AnalyzedDocument":
+        """Reuse ``document`` if it was built from ``text``, otherwise analyse ``text``"""
+        if document is not None and (document.text is text or document.text == text):
+            return document
+        return cls.analyze(text, cache, segmenter)
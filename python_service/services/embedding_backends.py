@@ -0,0 +1,179 @@
+import logging
+import os
+from typing import Callable, Dict, Any, List, Sequence
+
+import numpy as np
+
+from .embedding_cache import FileLock
+
+EMBEDDING_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+# Short, varied texts for comparing a backend against the fp32 model
+EQUIVALENCE_SAMPLES = [
+    "The mitochondria is the powerhouse of the cell.",
+    "Gradient descent updates parameters in the direction of the negative gradient.",
+    "Quarterly revenue grew by 12% compared with the same period last year.",
+    "The defendant's motion to dismiss was denied by the court.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "Install the package with pip and run the test suite before opening a pull request.",
+    "Shakespeare wrote Hamlet around the year 1600.",
+    "A hash table offers constant expected time lookups.",
+    "Patients were randomised into treatment and placebo groups.",
+    "ok"
+]
+
+logger = logging.getLogger(__name__)
+
+
+def mean_pool_hidden_states(hidden_states: np.ndarray, attention_mask: np.ndarray,
+                            normalize: bool = True) -> np.ndarray:
+    """
+    Sentence vectors from token states, as sentence-transformers' mean pooling does
+
+    Args:
+        hidden_states: Array of shape (batch, sequence, dimension)
+        attention_mask: Array of shape (batch, sequence), 1 for real tokens
+        normalize: L2-normalise each vector
+
+    Returns:
+        float32 array of shape (batch, dimension)
+    """
+    mask = attention_mask.astype(np.float32)[:, :, None]
+    pooled = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    if normalize:
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    return pooled.astype(np.float32)
+
+
+def check_equivalence(reference: Callable[[List[str]], np.ndarray], candidate: Callable[[List[str]], np.ndarray],
+                      texts: Sequence[str] = EQUIVALENCE_SAMPLES, min_cosine: float = 0.99) -> Dict[str, Any]:
+    """
+    Compare a backend's embeddings with the reference model's, text by text
+
+    Returns:
+        Dictionary with min_cosine, mean_cosine and whether every text reached ``min_cosine``
+    """
+    texts = list(texts)
+    expected = np.asarray(reference(texts), dtype=np.float32)
+    actual = np.asarray(candidate(texts), dtype=np.float32)
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    cosines = (expected * actual).sum(axis=1) / np.clip(norms, 1e-12, None)
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "samples": len(texts),
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+
+
+def torch_encoder(model) -> Callable[[List[str]], np.ndarray]:
+    """Encode with a SentenceTransformer as-is"""
+    def encode(texts: List[str]) -> np.ndarray:
+        return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+    return encode
+
+
+def torch_int8_encoder(model) -> Callable[[List[str]], np.ndarray]:
+    """Encode with a copy of the model whose Linear layers use dynamic int8 quantisation"""
+    import torch
+
+    quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return torch_encoder(quantized)
+
+
+class OnnxEncoder:
+    """
+    Runs the model's transformer as an exported ONNX graph on ONNX Runtime
+
+    The graph is exported once per model into ``model_dir`` (optionally with
+    dynamic int8 weights) and reused by later processes; pooling and
+    normalisation are done in numpy, matching the SentenceTransformer modules.
+    """
+
+    def __init__(self, model, model_name: str, model_dir: str, quantize: bool = False):
+        import onnxruntime
+
+        self.tokenizer = model.tokenizer
+        self.max_length = model.max_seq_length
+        self.normalize = any(type(module).__name__ == "Normalize" for module in model)
+        pooling = model[1]
+        if not getattr(pooling, "pooling_mode_mean_tokens", False):
+            raise ValueError("ONNX backend supports mean-pooling models only")
+
+        os.makedirs(model_dir, exist_ok=True)
+        fp32_path = os.path.join(model_dir, f"{model_name}.onnx")
+        path = os.path.join(model_dir, f"{model_name}.int8.onnx") if quantize else fp32_path
+        with FileLock(os.path.join(model_dir, f"{model_name}.lock")):
+            if not os.path.exists(fp32_path):
+                self._export(model, fp32_path)
+            if quantize and not os.path.exists(path):
+                self._quantize(fp32_path, path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [graph_input.name for graph_input in self.session.get_inputs()]
+        self.path = path
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        hidden_states = self.session.run(None, feed)[0]
+        return mean_pool_hidden_states(hidden_states, encoded["attention_mask"], self.normalize)
+
+    def _export(self, model, path: str):
+        import torch
+
+        transformer = model[0].auto_model.eval()
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids")
+                       if name in model.tokenizer.model_input_names]
+
+        class HiddenStates(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.transformer = transformer
+
+            def forward(self, *inputs):
+                return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+        sample = model.tokenizer(["export sample"], return_tensors="pt")
+        tmp_path = f"{path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                HiddenStates(),
+                tuple(sample[name] for name in input_names),
+                tmp_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+                opset_version=14
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Exported embedding model to {path}")
+
+    def _quantize(self, source_path: str, path: str):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        tmp_path = f"{path}.tmp"
+        quantize_dynamic(source_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, path)
+        logger.info(f"Quantised embedding model to {path}")
+
+
+def load_encoder(model, model_name: str, backend: str, onnx_dir: str) -> Callable[[List[str]], np.ndarray]:
+    """
+    Build the batch encode function for a backend
+
+    Args:
+        model: Loaded fp32 SentenceTransformer
+        model_name: Name used for exported files
+        backend: One of EMBEDDING_BACKENDS
+        onnx_dir: Directory holding exported ONNX graphs
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend == "torch":
+        return torch_encoder(model)
+    if backend == "torch_int8":
+        return torch_int8_encoder(model)
+    return OnnxEncoder(model, model_name, onnx_dir, quantize=backend == "onnx_int8")
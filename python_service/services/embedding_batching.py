@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import numpy as np
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+
+def length_sorted_batches(texts: Sequence[str], batch_size: int) -> List[List[int]]:
+    """
+    Group text positions into batches of similar length
+
+    Sorting longest first keeps padding inside each batch small, and puts the
+    most expensive batch first so memory problems show up immediately.
+
+    Args:
+        texts: Texts to batch
+        batch_size: Maximum number of texts per batch
+
+    Returns:
+        List of batches, each a list of positions into ``texts``
+    """
+    batch_size = max(1, batch_size)
+    order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def encode_in_batches(encode: Callable[[List[str]], np.ndarray], texts: Sequence[str],
+                      batch_size: int = 32) -> np.ndarray:
+    """
+    Encode texts in length-sorted batches and return vectors in input order
+
+    Args:
+        encode: Function that turns a list of texts into a 2D array of vectors
+        texts: Texts to encode
+        batch_size: Maximum number of texts per encode call
+
+    Returns:
+        float32 array of shape (len(texts), dimension)
+    """
+    vectors = None
+    for batch in length_sorted_batches(texts, batch_size):
+        batch_vectors = np.asarray(encode([texts[i] for i in batch]), dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+        vectors[batch] = batch_vectors
+
+    if vectors is None:
+        return np.empty((0, 0), dtype=np.float32)
+    return vectors
+
+
+class _EncodeRequest:
+    """One caller's texts and the future its vectors are delivered to"""
+
+    def __init__(self, texts: List[str], future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.texts = texts
+        self.future = future
+        self.loop = loop
+
+    def deliver(self, result=None, error: Optional[BaseException] = None):
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future, result, error)
+        except RuntimeError:
+            pass  # the caller's event loop has closed; nobody is waiting
+
+
+def _resolve(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    """Complete a future from its own event loop, unless the caller gave up on it"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class EmbeddingBatcher:
+    """
+    Cross-request micro-batching in front of an encode function
+
+    Callers enqueue their texts and await a future. A single worker thread
+    takes the first waiting request, gathers more until ``max_batch_size``
+    texts are queued or ``max_wait_ms`` has passed, encodes them together in
+    length-sorted batches and hands each caller its own rows. Concurrent
+    requests therefore share forward passes instead of competing for the
+    model's threads.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0):
+        self.encode_batch = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.logger = logging.getLogger(__name__)
+
+        self._queue: "queue.Queue[Optional[_EncodeRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Encode texts together with whatever other requests are waiting
+
+        Args:
+            texts: Texts to encode
+
+        Returns:
+            float32 array of shape (len(texts), dimension), in input order
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding batcher is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._queue.put(_EncodeRequest(list(texts), future, loop))
+        return await future
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get request, batch and text counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["avg_texts_per_batch"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def close(self):
+        """Finish queued requests and stop the worker thread"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            requests = [request]
+            queued_texts = len(request.texts)
+            deadline = time.monotonic() + self.max_wait
+            while queued_texts < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                requests.append(request)
+                queued_texts += len(request.texts)
+
+            self._encode_requests(requests)
+
+    def _encode_requests(self, requests: List[_EncodeRequest]):
+        """Encode the texts of several requests in shared batches and deliver each caller's rows"""
+        requests = [request for request in requests if not request.future.done()]
+        if not requests:
+            return
+
+        texts = [text for request in requests for text in request.texts]
+        try:
+            vectors = encode_in_batches(self.encode_batch, texts, self.max_batch_size)
+        except Exception as e:
+            self.logger.error(f"Batched encoding failed: {e}")
+            for request in requests:
+                request.deliver(error=e)
+            return
+
+        with self._lock:
+            self.stats["requests"] += len(requests)
+            self.stats["batches"] += -(-len(texts) // self.max_batch_size)
+            self.stats["texts"] += len(texts)
+
+        offset = 0
+        for request in requests:
+            rows = vectors[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            request.deliver(rows)
@@ -0,0 +1,360 @@
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Fixed-size .npy header, rewritten in place as rows are appended
+NPY_HEADER_SIZE = 128
+
+
+def npy_header(rows: int, dimension: int) -> bytes:
+    """Version 1.0 .npy header for a C-ordered float32 (rows, dimension) array"""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dimension)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _segment_paths(cache_dir: str, dimension: int, generation: int) -> Tuple[str, str, str]:
+    """Vectors, index and lock paths of one segment generation"""
+    suffix = f"{dimension}" if generation == 0 else f"{dimension}-{generation}"
+    return (os.path.join(cache_dir, f"vectors-{suffix}.npy"),
+            os.path.join(cache_dir, f"index-{suffix}.txt"),
+            os.path.join(cache_dir, f"segment-{suffix}.lock"))
+
+
+class _VectorSegment:
+    """
+    Append-only on-disk store of vectors of one dimension
+
+    Vectors live in ``vectors-<dim>[-<generation>].npy`` (loadable with
+    ``np.load(mmap_mode='r')``) and their keys in ``index-<dim>[-<generation>].txt``,
+    one per row. Appends take an exclusive file lock, and other processes'
+    appends are picked up by re-reading the index tail.
+    """
+
+    def __init__(self, cache_dir: str, dimension: int, generation: int = 0):
+        self.dimension = dimension
+        self.generation = generation
+        self.row_bytes = dimension * 4
+        self.vectors_path, self.index_path, self.lock_path = _segment_paths(cache_dir, dimension, generation)
+
+        self.rows: Dict[str, int] = {}
+        self.row_count = 0
+        self._index_offset = 0
+        self._view: Optional[np.memmap] = None
+
+        with self._file_lock():
+            if not os.path.exists(self.vectors_path):
+                with open(self.vectors_path, "wb") as f:
+                    f.write(npy_header(0, dimension))
+                open(self.index_path, "a").close()
+            self._sync()
+
+    def _file_lock(self):
+        return FileLock(self.lock_path)
+
+    def _disk_rows(self) -> int:
+        return max(0, (os.path.getsize(self.vectors_path) - NPY_HEADER_SIZE) // self.row_bytes)
+
+    def _sync(self):
+        """Pick up index entries appended since the last sync (file lock held or read-only use)"""
+        if os.path.getsize(self.index_path) == self._index_offset:
+            return
+        disk_rows = self._disk_rows()
+        with open(self.index_path, "r", encoding="ascii") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith("\n") or self.row_count >= disk_rows:
+                    break  # a partial write from an interrupted append
+                self.rows.setdefault(line[:-1], self.row_count)
+                self.row_count += 1
+                self._index_offset += len(line)
+        self._view = None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            self._sync()
+            row = self.rows.get(key)
+            if row is None:
+                return None
+        if self._view is None or self._view.shape[0] <= row:
+            self._view = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                   offset=NPY_HEADER_SIZE, shape=(self.row_count, self.dimension))
+        return np.array(self._view[row])
+
+    def append(self, keys: Sequence[str], vectors: np.ndarray):
+        with self._file_lock():
+            self._sync()
+            unseen = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows:
+                    unseen.setdefault(key, vector)
+            new = list(unseen.items())
+            if not new:
+                return
+            rows = self.row_count
+            with open(self.vectors_path, "r+b") as f:
+                # Drop bytes past the last indexed row, left behind by an interrupted append
+                f.truncate(NPY_HEADER_SIZE + rows * self.row_bytes)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray([vector for _, vector in new], dtype=np.float32).tobytes())
+                f.seek(0)
+                f.write(npy_header(rows + len(new), self.dimension))
+            with open(self.index_path, "r+", encoding="ascii") as f:
+                f.truncate(self._index_offset)
+                f.seek(self._index_offset)
+                f.write("".join(f"{key}\n" for key, _ in new))
+            self._sync()
+
+    def size_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.vectors_path) + os.path.getsize(self.index_path)
+        except OSError:
+            return 0  # deleted by a rotation in another process
+
+    def delete(self):
+        """Remove the segment's files; processes still reading them see misses"""
+        for path in (self.vectors_path, self.index_path, self.lock_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class _RotatingSegments:
+    """
+    Disk tier of one dimension, bounded to ``max_rows`` rows by rotating two segments
+
+    New vectors go to the current segment. Once it holds half of ``max_rows``,
+    it becomes the previous segment, the old previous one is deleted and a new
+    current one is started. Hits in the previous segment are copied forward, so
+    vectors still in use survive rotation. The current generation number lives
+    in ``generation-<dim>.txt`` so every process follows rotations.
+    """
+
+    def __init__(self, cache_dir: str, dimension: int, max_rows: int):
+        self.cache_dir = cache_dir
+        self.dimension = dimension
+        self.segment_rows = max(1, max_rows // 2)
+        self.generation_path = os.path.join(cache_dir, f"generation-{dimension}.txt")
+        self.lock_path = os.path.join(cache_dir, f"rotation-{dimension}.lock")
+        self.current: Optional[_VectorSegment] = None
+        self.previous: Optional[_VectorSegment] = None
+        self.rotations = 0
+        self.refresh()
+
+    def _file_lock(self):
+        return FileLock(self.lock_path)
+
+    def _read_generation(self) -> int:
+        try:
+            with open(self.generation_path, "r", encoding="ascii") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def refresh(self):
+        """Follow a rotation made by another process"""
+        generation = self._read_generation()
+        if self.current is not None and self.current.generation == generation:
+            return
+        self.current = _VectorSegment(self.cache_dir, self.dimension, generation)
+        self.previous = None
+        if generation > 0 and os.path.exists(_segment_paths(self.cache_dir, self.dimension, generation - 1)[0]):
+            try:
+                self.previous = _VectorSegment(self.cache_dir, self.dimension, generation - 1)
+            except OSError:
+                self.previous = None
+
+    def get(self, key: str) -> Tuple[Optional[np.ndarray], bool]:
+        """Look a key up; returns (vector or None, whether it came from the previous segment)"""
+        for segment, from_previous in ((self.current, False), (self.previous, True)):
+            if segment is None:
+                continue
+            try:
+                vector = segment.get(key)
+            except OSError:
+                continue  # rotated away by another process
+            if vector is not None:
+                return vector, from_previous
+        return None, False
+
+    def append(self, keys: Sequence[str], vectors: np.ndarray):
+        with self._file_lock():
+            self.refresh()
+            if self.current.row_count + len(keys) > self.segment_rows and self.current.row_count:
+                self._rotate()
+            self.current.append(keys, vectors)
+
+    def _rotate(self):
+        """Start a new current segment and drop the previous one (rotation lock held)"""
+        generation = self.current.generation + 1
+        tmp_path = f"{self.generation_path}.tmp"
+        with open(tmp_path, "w", encoding="ascii") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self.generation_path)
+        if self.previous is not None:
+            self.previous.delete()
+        self.previous = self.current
+        self.current = _VectorSegment(self.cache_dir, self.dimension, generation)
+        self.rotations += 1
+
+    @property
+    def row_count(self) -> int:
+        return sum(segment.row_count for segment in (self.current, self.previous) if segment is not None)
+
+    def size_bytes(self) -> int:
+        return sum(segment.size_bytes() for segment in (self.current, self.previous) if segment is not None)
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, held for a with-block"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+class EmbeddingCache:
+    """
+    Chunk-level embedding cache keyed by hash of (model name, chunk text)
+
+    A bounded in-memory LRU tier sits in front of memory-mapped, append-only
+    float32 segments on disk (one pair per embedding dimension, rotated to stay
+    within ``max_disk_mb``), so unchanged chunks of a re-processed document
+    never reach the model.
+    """
+
+    # Bytes of one key line in a segment index
+    INDEX_LINE_BYTES = 65
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_items: int = 20000, max_disk_mb: float = 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.logger = logging.getLogger(__name__)
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._segments: Dict[int, _RotatingSegments] = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """Cache key for one chunk under one model"""
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str], dimension: int) -> Tuple[np.ndarray, List[int]]:
+        """
+        Look up vectors for several keys
+
+        Returns:
+            Tuple of (float32 array of shape (len(keys), dimension) with hits filled in,
+            positions of the keys that missed)
+        """
+        vectors = np.zeros((len(keys), dimension), dtype=np.float32)
+        missing = []
+        promoted = []
+        with self._lock:
+            segment = self._segment(dimension)
+            if segment is not None:
+                segment.refresh()
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None and vector.shape[0] == dimension:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                else:
+                    vector, from_previous = segment.get(key) if segment is not None else (None, False)
+                    if vector is None:
+                        self.stats["misses"] += 1
+                        missing.append(position)
+                        continue
+                    self.stats["disk_hits"] += 1
+                    self._remember(key, vector)
+                    if from_previous:
+                        promoted.append(position)
+                vectors[position] = vector
+            if promoted:
+                # Keep vectors in use on disk past the next rotation
+                self._append(segment, [keys[position] for position in promoted], vectors[promoted])
+        return vectors, missing
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray, persist: bool = True):
+        """
+        Store freshly computed vectors
+
+        Args:
+            keys: Cache keys from make_key
+            vectors: One vector per key
+            persist: Also append to the disk tier; short-lived vectors
+                (e.g. per-sentence ones) stay in the memory LRU only
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(keys):
+            return
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector.copy())
+            self.stats["writes"] += len(keys)
+            segment = self._segment(vectors.shape[1]) if persist else None
+            if segment is not None:
+                self._append(segment, keys, vectors)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit rates and tier sizes"""
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["memory_items"] = len(self._memory)
+            stats["memory_bytes"] = sum(vector.nbytes for vector in self._memory.values())
+            stats["disk_rows"] = sum(segment.row_count for segment in self._segments.values())
+            stats["disk_bytes"] = sum(segment.size_bytes() for segment in self._segments.values())
+            stats["disk_max_bytes"] = self.max_disk_bytes
+            stats["disk_rotations"] = sum(segment.rotations for segment in self._segments.values())
+            stats["disk_enabled"] = bool(self.cache_dir)
+        return stats
+
+    def _segment(self, dimension: int) -> Optional[_RotatingSegments]:
+        """Open the disk tier for a dimension (lock held)"""
+        if not self.cache_dir:
+            return None
+        if dimension not in self._segments:
+            max_rows = self.max_disk_bytes // (dimension * 4 + self.INDEX_LINE_BYTES)
+            self._segments[dimension] = _RotatingSegments(self.cache_dir, dimension, max_rows)
+        return self._segments[dimension]
+
+    def _append(self, segment: _RotatingSegments, keys: Sequence[str], vectors: np.ndarray):
+        """Append to the disk tier; failures only log (lock held)"""
+        try:
+            segment.append(keys, vectors)
+        except OSError as e:
+            self.logger.warning(f"Failed to append embeddings to disk cache: {e}")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert into the memory tier, evicting least recently used entries (lock held)"""
+        if self.max_memory_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
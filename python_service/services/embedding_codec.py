@@ -0,0 +1,59 @@
+import base64
+import numpy as np
+from typing import Dict, Any, List, Union
+
+EMBEDDING_FORMATS = ("json", "float32", "float16", "int8")
+FLOAT_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+
+def encode_vectors(vectors: np.ndarray, embedding_format: str = "json") -> Union[List, Dict[str, Any]]:
+    """
+    Serialise embedding vectors for a JSON response
+
+    Args:
+        vectors: Array of shape (n, dimension) or (dimension,)
+        embedding_format: "json" for nested float lists, or "float32", "float16" or
+            "int8" for a base64 buffer. int8 quantises each vector with its own
+            scale (max(|v|) / 127), sent as a float32 array alongside the data.
+
+    Returns:
+        Nested lists for "json"; otherwise a dictionary with dtype, shape and
+        base64 data (plus a base64 scale for int8) that ``decode_vectors`` reverses
+    """
+    if embedding_format not in EMBEDDING_FORMATS:
+        raise ValueError(f"Unknown embedding format: {embedding_format}")
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if embedding_format == "json":
+        return vectors.tolist()
+
+    payload = {"dtype": embedding_format, "shape": list(vectors.shape)}
+    if embedding_format == "int8":
+        rows = vectors.reshape(-1, vectors.shape[-1]) if vectors.size else vectors.reshape(0, 0)
+        scale = np.abs(rows).max(axis=1) / 127 if rows.size else np.zeros(len(rows), dtype=np.float32)
+        scale = np.where(scale > 0, scale, 1).astype(np.float32)
+        quantised = np.clip(np.rint(rows / scale[:, None]), -127, 127).astype(np.int8)
+        payload["data"] = base64.b64encode(quantised.tobytes()).decode("ascii")
+        payload["scale"] = base64.b64encode(scale.astype("<f4").tobytes()).decode("ascii")
+    else:
+        payload["data"] = base64.b64encode(vectors.astype(FLOAT_DTYPES[embedding_format]).tobytes()).decode("ascii")
+    return payload
+
+
+def decode_vectors(payload: Union[List, Dict[str, Any]]) -> np.ndarray:
+    """Rebuild a float32 array from ``encode_vectors`` output in any format"""
+    if isinstance(payload, list):
+        return np.asarray(payload, dtype=np.float32)
+
+    shape = tuple(payload["shape"])
+    data = base64.b64decode(payload["data"])
+    dtype = payload["dtype"]
+    if not data:
+        return np.zeros(shape, dtype=np.float32)
+    if dtype == "int8":
+        scale = np.frombuffer(base64.b64decode(payload["scale"]), dtype="<f4")
+        rows = np.frombuffer(data, dtype=np.int8).reshape(len(scale), -1).astype(np.float32) * scale[:, None]
+        return rows.reshape(shape)
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+    return np.frombuffer(data, dtype=FLOAT_DTYPES[dtype]).astype(np.float32).reshape(shape)
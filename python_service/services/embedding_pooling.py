@@ -0,0 +1,36 @@
+import numpy as np
+from typing import Optional, Sequence
+
+POOLING_STRATEGIES = ("mean", "weighted_mean", "max")
+
+
+def pool_embeddings(vectors: np.ndarray, strategy: str = "mean",
+                    lengths: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    Combine chunk vectors into a single document vector
+
+    Args:
+        vectors: Array of shape (num_chunks, dimension)
+        strategy: "mean", "weighted_mean" (weighted by ``lengths``) or "max"
+        lengths: Chunk lengths, required for "weighted_mean"
+
+    Returns:
+        L2-normalised float32 vector of shape (dimension,), comparable by
+        cosine similarity with the chunk vectors themselves
+    """
+    if strategy not in POOLING_STRATEGIES:
+        raise ValueError(f"Unknown pooling strategy: {strategy}")
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if strategy == "mean":
+        pooled = vectors.mean(axis=0)
+    elif strategy == "weighted_mean":
+        if lengths is None or len(lengths) != len(vectors):
+            raise ValueError("weighted_mean pooling needs one length per chunk")
+        weights = np.asarray(lengths, dtype=np.float32)
+        pooled = weights @ vectors / max(float(weights.sum()), 1.0)
+    else:
+        pooled = vectors.max(axis=0)
+
+    norm = np.linalg.norm(pooled)
+    return pooled / norm if norm > 0 else pooled
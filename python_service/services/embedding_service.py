@@ -1,88 +1,190 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import asyncio
+import logging
+
+from .page_index import PageIndex
+from .analyzed_document import AnalyzedDocument
+from .embedding_batching import EmbeddingBatcher
+from .embedding_pooling import pool_embeddings, POOLING_STRATEGIES
+from .embedding_cache import EmbeddingCache
+from .embedding_codec import encode_vectors
+from .token_chunker import TokenChunker
+from .similarity_search import normalize_rows
+from .embedding_backends import load_encoder, check_equivalence, torch_encoder
 
 class EmbeddingService: 
-    def __init__(self):
+    def __init__(self, batch_size: int = 32, batch_wait_ms: float = 5.0, document_strategy: str = "mean",
+                 cache: Optional[EmbeddingCache] = None, chunk_tokens: int = 256, chunk_overlap: int = 32,
+                 backend: str = "torch", onnx_dir: Optional[str] = None, min_cosine: float = 0.99):
         # Initialize the sentence transformer model
         # Using a lightweight model for faster processing
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self.model_name = 'all-MiniLM-L6-v2'
         self.embedding_dimension = 384  # Dimension for this model
+        self.batch_size = max(1, batch_size)
+        self.logger = logging.getLogger(__name__)
+        
+        # Faster inference backends are only used if they agree with the fp32 model
+        self.backend = backend
+        self.backend_check = None
+        self._encode = torch_encoder(self.model)
+        if backend != "torch":
+            self._load_backend(backend, onnx_dir, min_cosine)
+        
+        # Chunks are packed to the model's own token limit (less [CLS]/[SEP]) so none are truncated
+        self.chunk_tokens = min(chunk_tokens, self.model.max_seq_length - 2)
+        self.chunk_overlap = min(chunk_overlap, self.chunk_tokens - 1)
+        self.chunker = TokenChunker(self._token_offsets, self.chunk_tokens, self.chunk_overlap)
+        
+        # "full_text" re-encodes the whole document (truncated by the model); the rest pool chunk vectors
+        if document_strategy not in POOLING_STRATEGIES + ("full_text",):
+            raise ValueError(f"Unknown document embedding strategy: {document_strategy}")
+        self.document_strategy = document_strategy
+        self.cache = cache
+        
+        # All encoding goes through one scheduler so concurrent requests share forward passes
+        self.batcher = EmbeddingBatcher(self._encode_batch, max_batch_size=self.batch_size, max_wait_ms=batch_wait_ms)
     
-    async def generate_embeddings(self, text: str) -> Dict[str, Any]:
+    async def generate_embeddings(self, text: str, page_index: Optional[PageIndex] = None,
+                                  embedding_format: str = "json",
+                                  document: Optional[AnalyzedDocument] = None) -> Dict[str, Any]:
         """
         Generate embeddings for the given text
         
         Args:
             text: The text content to embed
+            page_index: Optional page index for the text; adds the source pages of each chunk
+            embedding_format: "json" for float lists, or "float32", "float16" or "int8"
+                for base64-packed arrays (see embedding_codec)
+            document: Shared analysis of ``text``; its sentence boundaries guide chunk cuts
             
         Returns:
             Dictionary containing embeddings and metadata
         """
         try:
-            # Split text into chunks for better embedding
-            chunks = self._split_text_into_chunks(text)
-            
-            # Generate embeddings for each chunk
-            embeddings = []
-            for chunk in chunks:
-                embedding = self.model.encode(chunk, convert_to_tensor=False)
-                embeddings.append(embedding.tolist())
+            # Split text into token-budgeted chunks, with their spans in the source text
+            sentence_starts = [start for start, _ in document.sentence_spans] if document is not None else None
+            chunks, spans = self.chunker.chunk(text, sentence_starts)
             
-            # Generate overall document embedding
-            full_text_embedding = self.model.encode(text, convert_to_tensor=False)
+            # Encode every chunk not already cached, batched with other waiting requests
+            chunk_vectors = await self._encode_chunks(chunks)
+            if self.document_strategy == "full_text":
+                document_vector = (await self.batcher.encode([text]))[0]
+            else:
+                document_vector = self._pool_document(chunk_vectors, chunks)
             
-            return {
+            result = {
                 'model_name': self.model_name,
                 'embedding_dimension': self.embedding_dimension,
-                'chunk_embeddings': embeddings,
-                'document_embedding': full_text_embedding.tolist(),
+                'chunk_embeddings': encode_vectors(chunk_vectors, embedding_format),
+                'document_embedding': encode_vectors(document_vector, embedding_format),
+                'embedding_format': embedding_format,
+                'document_embedding_strategy': self.document_strategy,
                 'num_chunks': len(chunks),
                 'chunk_texts': chunks,
                 'embedding_type': 'sentence_transformers'
             }
             
+            if page_index is not None and len(page_index):
+                result['chunk_pages'] = [
+                    page_index.pages_for_span(start, end)
+                    for start, end in spans
+                ]
+            
+            return result
+            
         except Exception as e:
             raise Exception(f"Embedding generation failed: {str(e)}")
     
-    def _split_text_into_chunks(self, text: str, max_chunk_size: int = 512) -> List[str]:
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode one batch of texts in a single forward pass"""
+        return self._encode(texts)
+    
+    def _load_backend(self, backend: str, onnx_dir: Optional[str], min_cosine: float):
+        """Switch to another inference backend, keeping fp32 torch if it fails or disagrees"""
+        try:
+            encode = load_encoder(self.model, self.model_name, backend, onnx_dir)
+            self.backend_check = check_equivalence(self._encode, encode, min_cosine=min_cosine)
+        except Exception as e:
+            self.logger.error(f"Embedding backend {backend} unavailable, using torch: {str(e)}")
+            self.backend = "torch"
+            return
+        
+        if not self.backend_check["passed"]:
+            self.logger.error(
+                f"Embedding backend {backend} min cosine {self.backend_check['min_cosine']:.4f} "
+                f"is below {min_cosine}, using torch"
+            )
+            self.backend = "torch"
+            return
+        self._encode = encode
+        self.logger.info(f"Using {backend} embedding backend (min cosine {self.backend_check['min_cosine']:.4f})")
+    
+    @property
+    def cache_model_name(self) -> str:
+        """Model name for chunk cache keys; quantised backends get their own entries"""
+        return self.model_name if self.backend == "torch" else f"{self.model_name}:{self.backend}"
+    
+    async def embed_query(self, query: str) -> np.ndarray:
         """
-        Split text into smaller chunks for better embedding
+        Encode a search query
         
         Args:
-            text: Text to split
-            max_chunk_size: Maximum number of characters per chunk
+            query: Query text
             
         Returns:
-            List of text chunks
+            Query embedding of shape (embedding_dimension,)
+        """
+        return (await self.batcher.encode([query]))[0]
+    
+    async def embed_sentences(self, sentences: List[str]) -> np.ndarray:
         """
-        if not text:
-            return []
+        Encode sentences, e.g. for TextRank compression
         
-        # Simple splitting by sentences and size
-        sentences = text.split('. ')
-        chunks = []
-        current_chunk = ""
+        Goes through the shared batcher and the memory tier of the chunk
+        embedding cache, so sentences seen recently (or identical to earlier
+        chunks) are not re-encoded. Sentence vectors are not written to the
+        disk tier, which would otherwise fill with one row per sentence.
         
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) < max_chunk_size:
-                current_chunk += sentence + ". "
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + ". "
-        
-        # Add the last chunk if it exists
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        Returns:
+            Array of shape (len(sentences), embedding_dimension)
+        """
+        if not sentences:
+            return np.zeros((0, self.embedding_dimension), dtype=np.float32)
+        return await self._encode_chunks(sentences, persist=False)
+    
+    async def _encode_chunks(self, chunks: List[str], persist: bool = True) -> np.ndarray:
+        """Encode chunks, serving unchanged ones from the chunk embedding cache"""
+        if self.cache is None or not chunks:
+            return await self.batcher.encode(chunks)
         
-        # If no chunks were created, create a single chunk
+        keys = [EmbeddingCache.make_key(self.cache_model_name, chunk) for chunk in chunks]
+        vectors, missing = await asyncio.to_thread(self.cache.get_many, keys, self.embedding_dimension)
+        if missing:
+            fresh = await self.batcher.encode([chunks[position] for position in missing])
+            vectors[missing] = fresh
+            await asyncio.to_thread(self.cache.put_many, [keys[position] for position in missing], fresh, persist)
+        return vectors
+    
+    def _pool_document(self, chunk_vectors: np.ndarray, chunks: List[str]) -> np.ndarray:
+        """Build the document embedding from chunk vectors at no extra model cost"""
         if not chunks:
-            chunks = [text[:max_chunk_size]]
-        
-        return chunks
+            return np.zeros(self.embedding_dimension, dtype=np.float32)
+        return pool_embeddings(chunk_vectors, self.document_strategy, [len(chunk) for chunk in chunks])
+    
+    def _token_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """Character span of every model token in the text, from one pass of the fast tokenizer"""
+        encoding = self.model.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False
+        )
+        return encoding['offset_mapping']
     
     async def calculate_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """
@@ -96,12 +198,9 @@ class EmbeddingService:
             Similarity score between 0 and 1
         """
         try:
-            vec1 = np.array(embedding1)
-            vec2 = np.array(embedding2)
-            
-            # Calculate cosine similarity
-            similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-            return float(similarity)
+            # Calculate cosine similarity; for many vectors use top_k_similar instead
+            vec1, vec2 = normalize_rows([embedding1, embedding2])
+            return float(vec1 @ vec2)
             
         except Exception as e:
             raise Exception(f"Similarity calculation failed: {str(e)}")
@@ -112,5 +211,17 @@ class EmbeddingService:
             'model_name': self.model_name,
             'embedding_dimension': self.embedding_dimension,
             'model_type': 'sentence_transformers',
+            'backend': self.backend,
+            'backend_check': self.backend_check,
+            'batch_size': self.batch_size,
+            'chunk_tokens': self.chunk_tokens,
+            'chunk_overlap': self.chunk_overlap,
+            'document_strategy': self.document_strategy,
+            'batching': self.batcher.get_stats(),
+            'cache': self.cache.get_stats() if self.cache is not None else None,
             'description': 'Lightweight sentence transformer for fast embedding generation'
-        } 
\ No newline at end of file
+        }
+    
+    def shutdown(self):
+        """Stop the batching worker after queued requests finish"""
+        self.batcher.close() 
\ No newline at end of file
@@ -3,29 +3,42 @@ import re
 from typing import Dict, Any, List, Tuple, Optional
 from collections import Counter
 import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize, sent_tokenize
 import logging
 import time
+from itertools import islice
 
+from .page_index import PageIndex
+from .graph_context import GraphContext
+from .analyzed_document import AnalyzedDocument
 from .text_compressor import TextCompressor
 from .openrouter_service import OpenRouterService
+from .token_budget import TokenEstimator
 
 class EnhancedGraphBuilder:
     """
     Enhanced graph builder that uses text compression and OpenRouter API for AI-powered graph generation
+    
+    The builder only holds configuration and shared services; each build_graph
+    call works on its own GraphContext, so one instance can serve concurrent
+    requests, from coroutines or threads.
     """
     
-    def __init__(self, use_openrouter: bool = True, compression_target: int = 2000):
-        self.graph = nx.Graph()
-        self.node_id_counter = 0
+    def __init__(self, use_openrouter: bool = True, compression_target: int = 2000,
+                 max_prompt_tokens: int = 0, max_completion_tokens: int = 2000,
+                 token_estimator: Optional[TokenEstimator] = None,
+                 text_compressor: Optional[TextCompressor] = None):
         self.use_openrouter = use_openrouter
         self.compression_target = compression_target
+        self.max_prompt_tokens = max_prompt_tokens
         self.logger = logging.getLogger(__name__)
         
         # Initialize services
-        self.text_compressor = TextCompressor()
-        self.openrouter_service = OpenRouterService() if use_openrouter else None
+        self.text_compressor = text_compressor or TextCompressor()
+        self.openrouter_service = OpenRouterService(
+            max_prompt_tokens=max_prompt_tokens,
+            max_completion_tokens=max_completion_tokens,
+            token_estimator=token_estimator
+        ) if use_openrouter else None
         
         # Download required NLTK data
         self._ensure_nltk_data()
@@ -41,53 +54,68 @@ class EnhancedGraphBuilder:
         except LookupError:
             nltk.download('stopwords')
     
-    async def build_graph(self, text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    async def build_graph(self, text: str, metadata: Dict[str, Any],
+                          page_index: Optional[PageIndex] = None,
+                          document: Optional[AnalyzedDocument] = None,
+                          compression_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Build a knowledge graph from text content using enhanced methods
         
         Args:
             text: The text content to analyze
             metadata: Document metadata
+            page_index: Optional page index for the text; entity nodes get the pages they appear on
+            document: Shared analysis of ``text``, reused for compression
+            compression_result: Smart compression of ``text`` at this builder's target
+                (prompt_text_budget tokens when set), if the caller already has it
             
         Returns:
-            Dictionary containing graph data and analysis
+            Dictionary containing graph data and analysis; ``ai_used`` tells whether
+            the graph came from the AI, and ``ai_fallback`` whether the AI was enabled
+            but failed, so traditional methods built it instead
         """
         try:
             start_time = time.time()
             self.logger.info(f"Starting enhanced graph building process")
             self.logger.info(f"Text length: {len(text)} characters")
             
-            # Reset graph for new document
-            self.graph = nx.Graph()
-            self.node_id_counter = 0
+            # Fresh graph state for this request; the builder itself is never mutated
+            context = GraphContext()
             
             # Step 1: Compress text to reduce API usage
-            compression_result = self._compress_text(text)
+            if compression_result is None:
+                compression_result = self._compress_text(text, document, metadata)
             compressed_text = compression_result["compressed_text"]
             
             self.logger.info(f"Text compressed from {len(text)} to {len(compressed_text)} characters "
                            f"(ratio: {compression_result['compression_ratio']:.2f})")
             
             # Step 2: Generate graph using AI or fallback to traditional methods
+            ai_used = False
             if self.use_openrouter and self.openrouter_service:
                 try:
-                    graph_result = await self._generate_ai_graph(compressed_text, metadata)
+                    graph_result = await self._generate_ai_graph(context, compressed_text, metadata)
+                    # An unparseable AI response is replaced by heuristic extraction from its text
+                    ai_used = not graph_result.get("ai_metadata", {}).get("fallback_used", False)
                     self.logger.info("AI-powered graph generation successful")
                 except Exception as e:
                     self.logger.warning(f"AI graph generation failed: {str(e)}, falling back to traditional methods")
-                    graph_result = await self._generate_traditional_graph(compressed_text, metadata)
+                    graph_result = await self._generate_traditional_graph(context, compressed_text, metadata, document)
             else:
-                graph_result = await self._generate_traditional_graph(compressed_text, metadata)
+                graph_result = await self._generate_traditional_graph(context, compressed_text, metadata, document)
             
             # Step 3: Add document node and connect to main entities
-            doc_node_id = self._add_document_node(metadata)
-            self._connect_document_to_entities(doc_node_id, graph_result.get("entities", []))
+            doc_node_id = self._add_document_node(context, metadata)
+            self._connect_document_to_entities(context, doc_node_id, graph_result.get("entities", []))
+            
+            if page_index is not None and len(page_index):
+                self._annotate_source_pages(context, text, page_index)
             
             # Step 4: Analyze graph structure
-            graph_analysis = self._analyze_graph()
+            graph_analysis = self._analyze_graph(context)
             
             # Step 5: Convert to serializable format
-            graph_data = self._serialize_graph()
+            graph_data = self._serialize_graph(context)
             
             processing_time = time.time() - start_time
             
@@ -98,25 +126,41 @@ class EnhancedGraphBuilder:
                 'graph_data': graph_data,
                 'analysis': graph_analysis,
                 'compression_info': compression_result,
-                'ai_used': self.use_openrouter and self.openrouter_service is not None,
+                'ai_used': ai_used,
+                # OpenRouter is enabled but this graph did not come from it (a degraded result)
+                'ai_fallback': bool(self.use_openrouter and self.openrouter_service) and not ai_used,
                 'processing_time': processing_time,
-                'total_nodes': self.graph.number_of_nodes(),
-                'total_edges': self.graph.number_of_edges()
+                'total_nodes': context.graph.number_of_nodes(),
+                'total_edges': context.graph.number_of_edges()
             }
             
         except Exception as e:
             self.logger.error(f"Error in build_graph: {str(e)}")
             raise Exception(f"Enhanced graph building failed: {str(e)}")
     
-    def _compress_text(self, text: str) -> Dict[str, Any]:
-        """Compress text to reduce API usage"""
+    def prompt_text_budget(self, metadata: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Tokens of document text the AI graph prompt holds, or None when compressing to characters"""
+        if self.max_prompt_tokens <= 0 or not self.use_openrouter or self.openrouter_service is None:
+            return None
+        return self.openrouter_service.graph_text_budget(metadata)
+    
+    def _compress_text(self, text: str, document: Optional[AnalyzedDocument] = None,
+                       metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Compress text to reduce API usage, filling the prompt's token budget when there is one"""
+        budget = self.prompt_text_budget(metadata)
+        if budget is not None:
+            return self.text_compressor.compress_to_tokens(
+                text, budget, self.openrouter_service.token_estimator, OpenRouterService.DEFAULT_MODEL,
+                method="smart", document=document
+            )
         return self.text_compressor.compress_text(
             text, 
             target_length=self.compression_target,
-            method="smart"
+            method="smart",
+            document=document
         )
     
-    async def _generate_ai_graph(self, compressed_text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    async def _generate_ai_graph(self, context: GraphContext, compressed_text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Generate graph using OpenRouter API"""
         try:
             # Generate graph using AI
@@ -149,10 +193,10 @@ class EnhancedGraphBuilder:
                     })
             
             # Add AI-generated nodes to graph
-            entity_nodes = self._add_ai_entity_nodes(ai_nodes)
+            entity_nodes = self._add_ai_entity_nodes(context, ai_nodes)
             
             # Add AI-generated edges to graph
-            self._add_ai_relationship_edges(ai_edges, entity_nodes)
+            self._add_ai_relationship_edges(context, ai_edges, entity_nodes)
             
             return {
                 "entities": entities,
@@ -165,26 +209,31 @@ class EnhancedGraphBuilder:
             self.logger.error(f"AI graph generation failed: {str(e)}")
             raise e
     
-    async def _generate_traditional_graph(self, compressed_text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    async def _generate_traditional_graph(self, context: GraphContext, compressed_text: str, metadata: Dict[str, Any],
+                                          document: Optional[AnalyzedDocument] = None) -> Dict[str, Any]:
         """Generate graph using traditional NLP methods"""
+        # Tokenise the compressed text once for both steps (short texts are not compressed,
+        # so the caller's analysis of the full text still applies)
+        document = self.text_compressor.analyze(compressed_text, document)
+        
         # Extract entities using traditional methods
-        entities = self._extract_entities_traditional(compressed_text)
+        entities = self._extract_entities_traditional(compressed_text, document)
         
         # Extract relationships using traditional methods
-        relationships = self._extract_relationships_traditional(compressed_text)
+        relationships = self._extract_relationships_traditional(compressed_text, document)
         
         # Add entity nodes
-        entity_nodes = self._add_entity_nodes(entities)
+        entity_nodes = self._add_entity_nodes(context, entities)
         
         # Add relationship edges
-        self._add_relationship_edges(relationships, entity_nodes)
+        self._add_relationship_edges(context, relationships, entity_nodes)
         
         return {
             "entities": entities,
             "relationships": relationships
         }
     
-    def _add_ai_entity_nodes(self, ai_nodes: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    def _add_ai_entity_nodes(self, context: GraphContext, ai_nodes: List[Dict[str, Any]]) -> Dict[str, List[str]]:
         """Add AI-generated entity nodes to the graph"""
         entity_nodes = {"concepts": [], "keywords": [], "entities": []}
         
@@ -192,11 +241,11 @@ class EnhancedGraphBuilder:
             if node.get("type") == "document":
                 continue
                 
-            node_id = node.get("id", f"ai_node_{self.node_id_counter}")
-            self.node_id_counter += 1
+            fallback_id = context.next_id("ai_node")
+            node_id = node.get("id", fallback_id)
             
             # Add node to graph
-            self.graph.add_node(node_id,
+            context.graph.add_node(node_id,
                                type=node.get("type", "concept"),
                                label=node.get("label", ""),
                                importance=node.get("importance", "medium"),
@@ -214,7 +263,7 @@ class EnhancedGraphBuilder:
         
         return entity_nodes
     
-    def _add_ai_relationship_edges(self, ai_edges: List[Dict[str, Any]], entity_nodes: Dict[str, List[str]]):
+    def _add_ai_relationship_edges(self, context: GraphContext, ai_edges: List[Dict[str, Any]], entity_nodes: Dict[str, List[str]]):
         """Add AI-generated relationship edges to the graph"""
         for edge in ai_edges:
             source = edge.get("source")
@@ -222,13 +271,14 @@ class EnhancedGraphBuilder:
             
             if source and target and source != "document" and target != "document":
                 # Check if both nodes exist in our graph
-                if self.graph.has_node(source) and self.graph.has_node(target):
-                    self.graph.add_edge(source, target,
+                if context.graph.has_node(source) and context.graph.has_node(target):
+                    context.graph.add_edge(source, target,
                                       label=edge.get("label", ""),
                                       weight=edge.get("weight", "medium"),
                                       source="ai")
     
-    def _extract_entities_traditional(self, text: str) -> Dict[str, List[str]]:
+    def _extract_entities_traditional(self, text: str,
+                                      document: Optional[AnalyzedDocument] = None) -> Dict[str, List[str]]:
         """Extract entities using traditional NLP methods"""
         entities = {
             'concepts': [],
@@ -260,16 +310,7 @@ class EnhancedGraphBuilder:
         
         # Extract keywords using NLTK
         try:
-            tokens = word_tokenize(text.lower())
-            stop_words = set(stopwords.words('english'))
-            
-            filtered_tokens = [word for word in tokens 
-                             if word.isalnum() and 
-                             word not in stop_words and 
-                             len(word) > 3]
-            
-            word_freq = Counter(filtered_tokens)
-            keywords = [word for word, freq in word_freq.most_common(20)]
+            keywords = self.text_compressor.analyze(text, document).keywords(20)
             entities['keywords'] = keywords[:10]
             
         except Exception as e:
@@ -300,12 +341,13 @@ class EnhancedGraphBuilder:
         
         return entities
     
-    def _extract_relationships_traditional(self, text: str) -> List[Tuple[str, str, str]]:
+    def _extract_relationships_traditional(self, text: str,
+                                           document: Optional[AnalyzedDocument] = None) -> List[Tuple[str, str, str]]:
         """Extract relationships using traditional NLP methods"""
         relationships = []
         
         # Simple relationship extraction based on proximity
-        sentences = sent_tokenize(text)
+        sentences = self.text_compressor.analyze(text, document).sentences
         
         for sentence in sentences:
             # Extract entities in the sentence
@@ -319,12 +361,11 @@ class EnhancedGraphBuilder:
         
         return relationships[:50]  # Limit relationships
     
-    def _add_document_node(self, metadata: Dict[str, Any]) -> str:
+    def _add_document_node(self, context: GraphContext, metadata: Dict[str, Any]) -> str:
         """Add document as a central node"""
-        node_id = f"doc_{self.node_id_counter}"
-        self.node_id_counter += 1
+        node_id = context.next_id("doc")
         
-        self.graph.add_node(node_id, 
+        context.graph.add_node(node_id, 
                            type='document',
                            title=metadata.get('title', 'Unknown'),
                            author=metadata.get('author', 'Unknown'),
@@ -334,33 +375,31 @@ class EnhancedGraphBuilder:
         
         return node_id
     
-    def _add_entity_nodes(self, entities: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    def _add_entity_nodes(self, context: GraphContext, entities: Dict[str, List[str]]) -> Dict[str, List[str]]:
         """Add entity nodes to the graph"""
         entity_nodes = {"concepts": [], "keywords": [], "entities": []}
         
         # Add concept nodes
         for concept in entities.get('concepts', []):
-            node_id = f"concept_{self.node_id_counter}"
-            self.node_id_counter += 1
-            self.graph.add_node(node_id, type='concept', label=concept, source="traditional")
+            node_id = context.next_id("concept")
+            context.graph.add_node(node_id, type='concept', label=concept, source="traditional")
             entity_nodes["concepts"].append(node_id)
         
         # Add keyword nodes
         for keyword in entities.get('keywords', []):
-            node_id = f"keyword_{self.node_id_counter}"
-            self.node_id_counter += 1
-            self.graph.add_node(node_id, type='keyword', label=keyword, source="traditional")
+            node_id = context.next_id("keyword")
+            context.graph.add_node(node_id, type='keyword', label=keyword, source="traditional")
             entity_nodes["keywords"].append(node_id)
         
         return entity_nodes
     
-    def _add_relationship_edges(self, relationships: List[Tuple[str, str, str]], entity_nodes: Dict[str, List[str]]):
+    def _add_relationship_edges(self, context: GraphContext, relationships: List[Tuple[str, str, str]], entity_nodes: Dict[str, List[str]]):
         """Add relationship edges to the graph"""
         # Create mapping from entity names to node IDs
         name_to_id = {}
-        for node_id in self.graph.nodes():
-            if self.graph.nodes[node_id].get('label'):
-                name_to_id[self.graph.nodes[node_id]['label']] = node_id
+        for node_id in context.graph.nodes():
+            if context.graph.nodes[node_id].get('label'):
+                name_to_id[context.graph.nodes[node_id]['label']] = node_id
         
         # Add edges based on relationships
         for source_name, target_name, relationship in relationships:
@@ -368,12 +407,12 @@ class EnhancedGraphBuilder:
             target_id = name_to_id.get(target_name)
             
             if source_id and target_id and source_id != target_id:
-                self.graph.add_edge(source_id, target_id, 
+                context.graph.add_edge(source_id, target_id, 
                                   label=relationship, 
                                   weight="medium",
                                   source="traditional")
     
-    def _connect_document_to_entities(self, doc_node_id: str, entities):
+    def _connect_document_to_entities(self, context: GraphContext, doc_node_id: str, entities):
         """Connect document node to main entities"""
         # Handle both AI format (list of dicts) and traditional format (dict of lists)
         if isinstance(entities, dict):
@@ -400,10 +439,10 @@ class EnhancedGraphBuilder:
         for entity in high_importance[:5]:
             entity_name = entity.get("name", "")
             # Find corresponding node
-            for node_id in self.graph.nodes():
-                if (self.graph.nodes[node_id].get('label') == entity_name and 
-                    self.graph.nodes[node_id].get('type') != 'document'):
-                    self.graph.add_edge(doc_node_id, node_id, 
+            for node_id in context.graph.nodes():
+                if (context.graph.nodes[node_id].get('label') == entity_name and 
+                    context.graph.nodes[node_id].get('type') != 'document'):
+                    context.graph.add_edge(doc_node_id, node_id, 
                                       label="contains", 
                                       weight="high",
                                       source="document_connection")
@@ -412,50 +451,68 @@ class EnhancedGraphBuilder:
         # Connect to medium importance entities if space allows
         for entity in medium_importance[:3]:
             entity_name = entity.get("name", "")
-            for node_id in self.graph.nodes():
-                if (self.graph.nodes[node_id].get('label') == entity_name and 
-                    self.graph.nodes[node_id].get('type') != 'document'):
-                    self.graph.add_edge(doc_node_id, node_id, 
+            for node_id in context.graph.nodes():
+                if (context.graph.nodes[node_id].get('label') == entity_name and 
+                    context.graph.nodes[node_id].get('type') != 'document'):
+                    context.graph.add_edge(doc_node_id, node_id, 
                                       label="contains", 
                                       weight="medium",
                                       source="document_connection")
                     break
     
-    def _analyze_graph(self) -> Dict[str, Any]:
+    def _annotate_source_pages(self, context: GraphContext, text: str, page_index: PageIndex, max_occurrences: int = 20):
+        """Attach the source pages where each entity label occurs in the original text"""
+        for node_id in context.graph.nodes():
+            node = context.graph.nodes[node_id]
+            label = node.get('label')
+            if not label or node.get('type') == 'document':
+                continue
+            
+            pages = set()
+            matches = re.finditer(re.escape(label), text, re.IGNORECASE)
+            for match in islice(matches, max_occurrences):
+                page = page_index.page_for_offset(match.start())
+                if page is not None:
+                    pages.add(page)
+            
+            if pages:
+                node['pages'] = sorted(pages)
+    
+    def _analyze_graph(self, context: GraphContext) -> Dict[str, Any]:
         """Analyze the graph structure"""
-        if self.graph.number_of_nodes() == 0:
+        if context.graph.number_of_nodes() == 0:
             return {"error": "Empty graph"}
         
         try:
             # Basic metrics
             analysis = {
-                "total_nodes": self.graph.number_of_nodes(),
-                "total_edges": self.graph.number_of_edges(),
-                "density": nx.density(self.graph),
-                "average_degree": sum(dict(self.graph.degree()).values()) / self.graph.number_of_nodes() if self.graph.number_of_nodes() > 0 else 0
+                "total_nodes": context.graph.number_of_nodes(),
+                "total_edges": context.graph.number_of_edges(),
+                "density": nx.density(context.graph),
+                "average_degree": sum(dict(context.graph.degree()).values()) / context.graph.number_of_nodes() if context.graph.number_of_nodes() > 0 else 0
             }
             
             # Node type distribution
             node_types = {}
-            for node in self.graph.nodes():
-                node_type = self.graph.nodes[node].get('type', 'unknown')
+            for node in context.graph.nodes():
+                node_type = context.graph.nodes[node].get('type', 'unknown')
                 node_types[node_type] = node_types.get(node_type, 0) + 1
             analysis["node_types"] = node_types
             
             # Source distribution
             sources = {}
-            for node in self.graph.nodes():
-                source = self.graph.nodes[node].get('source', 'unknown')
+            for node in context.graph.nodes():
+                source = context.graph.nodes[node].get('source', 'unknown')
                 sources[source] = sources.get(source, 0) + 1
             analysis["sources"] = sources
             
             # Centrality measures
-            if self.graph.number_of_nodes() > 1:
+            if context.graph.number_of_nodes() > 1:
                 try:
                     analysis["centrality"] = {
-                        "degree": dict(nx.degree_centrality(self.graph)),
-                        "betweenness": dict(nx.betweenness_centrality(self.graph)),
-                        "closeness": dict(nx.closeness_centrality(self.graph))
+                        "degree": dict(nx.degree_centrality(context.graph)),
+                        "betweenness": dict(nx.betweenness_centrality(context.graph)),
+                        "closeness": dict(nx.closeness_centrality(context.graph))
                     }
                 except Exception as e:
                     self.logger.warning(f"Centrality calculation failed: {e}")
@@ -466,20 +523,20 @@ class EnhancedGraphBuilder:
             self.logger.error(f"Graph analysis failed: {e}")
             return {"error": f"Analysis failed: {str(e)}"}
     
-    def _serialize_graph(self) -> Dict[str, Any]:
+    def _serialize_graph(self, context: GraphContext) -> Dict[str, Any]:
         """Convert graph to serializable format"""
         nodes = []
         edges = []
         
         # Serialize nodes
-        for node_id in self.graph.nodes():
-            node_data = self.graph.nodes[node_id].copy()
+        for node_id in context.graph.nodes():
+            node_data = context.graph.nodes[node_id].copy()
             node_data['id'] = node_id
             nodes.append(node_data)
         
         # Serialize edges
-        for source, target in self.graph.edges():
-            edge_data = self.graph.edges[source, target].copy()
+        for source, target in context.graph.edges():
+            edge_data = context.graph.edges[source, target].copy()
             edge_data['source'] = source
             edge_data['target'] = target
             edges.append(edge_data)
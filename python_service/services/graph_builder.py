@@ -1,32 +1,33 @@
 import networkx as nx
 import re
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from collections import Counter
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize, sent_tokenize
+
+from .analyzed_document import AnalyzedDocument
+from .graph_context import GraphContext
+from .text_compressor import TextCompressor
 
 class GraphBuilder:
-    def __init__(self):
-        self.graph = nx.Graph()
-        self.node_id_counter = 0
-        # Download required NLTK data
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt')
-        try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords')
+    """
+    Builds knowledge graphs from text content with heuristic NLP
+
+    Stateless between calls: each build_graph call works on its own GraphContext.
+    """
     
-    async def build_graph(self, text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    def __init__(self, text_compressor: Optional[TextCompressor] = None):
+        # Analyses text with the compressor's sentence segmenter and token cache;
+        # creating one also downloads the required NLTK data
+        self.text_compressor = text_compressor or TextCompressor()
+    
+    async def build_graph(self, text: str, metadata: Dict[str, Any],
+                          document: Optional[AnalyzedDocument] = None) -> Dict[str, Any]:
         """
         Build a knowledge graph from text content and metadata
         
         Args:
             text: The text content to analyze
             metadata: Document metadata
+            document: Shared analysis of ``text``; built lazily if omitted
             
         Returns:
             Dictionary containing graph data and analysis
@@ -36,42 +37,49 @@ class GraphBuilder:
             print(f"📄 Text length: {len(text)} characters")
             print(f"📄 Text preview: {text[:200]}...")
             
-            # Reset graph for new document
-            self.graph = nx.Graph()
-            self.node_id_counter = 0
+            # Fresh graph state for this request; the builder itself is never mutated
+            context = GraphContext()
             
             # Add document node
-            doc_node_id = self._add_document_node(metadata)
+            doc_node_id = self._add_document_node(context, metadata)
             print(f"📄 Added document node: {doc_node_id}")
             
+            # Tokenise once for entity and relationship extraction; without NLTK data
+            # each step falls back to its own handling
+            try:
+                document = self.text_compressor.analyze(text, document)
+            except LookupError as e:
+                print(f"🔍 DEBUG: NLTK analysis unavailable: {e}")
+                document = None
+            
             # Extract entities and relationships
             print(f"\n🔍 DEBUG: Extracting entities...")
-            entities = self._extract_entities(text)
+            entities = self._extract_entities(text, document)
             print(f"📊 Extracted entities: {entities}")
             
             print(f"\n🔍 DEBUG: Extracting relationships...")
-            relationships = self._extract_relationships(text)
+            relationships = self._extract_relationships(text, document)
             print(f"🔗 Extracted relationships: {relationships}")
             
             # Add entity nodes
             print(f"\n🔍 DEBUG: Adding entity nodes...")
-            entity_nodes = self._add_entity_nodes(entities)
+            entity_nodes = self._add_entity_nodes(context, entities)
             print(f"📊 Entity nodes created: {entity_nodes}")
             
             # Add relationship edges
             print(f"\n🔍 DEBUG: Adding relationship edges...")
-            self._add_relationship_edges(relationships, entity_nodes)
+            self._add_relationship_edges(context, relationships, entity_nodes)
             
             # Connect entities to document
             print(f"\n🔍 DEBUG: Connecting entities to document...")
-            self._connect_entities_to_document(entity_nodes, doc_node_id)
+            self._connect_entities_to_document(context, entity_nodes, doc_node_id)
             
             # Analyze graph structure
-            graph_analysis = self._analyze_graph()
+            graph_analysis = self._analyze_graph(context)
             print(f"\n📊 Graph analysis: {graph_analysis}")
             
             # Convert to serializable format
-            graph_data = self._serialize_graph()
+            graph_data = self._serialize_graph(context)
             print(f"\n📊 Final graph data - Nodes: {len(graph_data['nodes'])}, Edges: {len(graph_data['edges'])}")
             
             return {
@@ -79,20 +87,19 @@ class GraphBuilder:
                 'analysis': graph_analysis,
                 'entities': entities,
                 'relationships': relationships,
-                'total_nodes': self.graph.number_of_nodes(),
-                'total_edges': self.graph.number_of_edges()
+                'total_nodes': context.graph.number_of_nodes(),
+                'total_edges': context.graph.number_of_edges()
             }
             
         except Exception as e:
             print(f"❌ ERROR in build_graph: {str(e)}")
             raise Exception(f"Graph building failed: {str(e)}")
     
-    def _add_document_node(self, metadata: Dict[str, Any]) -> str:
+    def _add_document_node(self, context: GraphContext, metadata: Dict[str, Any]) -> str:
         """Add document as a central node"""
-        node_id = f"doc_{self.node_id_counter}"
-        self.node_id_counter += 1
+        node_id = context.next_id("doc")
         
-        self.graph.add_node(node_id, 
+        context.graph.add_node(node_id, 
                            type='document',
                            title=metadata.get('title', 'Unknown'),
                            author=metadata.get('author', 'Unknown'),
@@ -101,7 +108,7 @@ class GraphBuilder:
         
         return node_id
     
-    def _extract_entities(self, text: str) -> Dict[str, List[str]]:
+    def _extract_entities(self, text: str, document: Optional[AnalyzedDocument] = None) -> Dict[str, List[str]]:
         """Extract entities from text using improved and loosened heuristics"""
         print(f"🔍 DEBUG: _extract_entities called with text length: {len(text)}")
         
@@ -147,21 +154,12 @@ class GraphBuilder:
         # Extract keywords using NLTK
         try:
             print(f"🔍 DEBUG: Extracting keywords with NLTK...")
-            # Tokenize and get word frequencies
-            tokens = word_tokenize(text.lower())
-            stop_words = set(stopwords.words('english'))
-            
-            # Filter out stopwords, punctuation, and short words
-            filtered_tokens = [word for word in tokens 
-                             if word.isalnum() and 
-                             word not in stop_words and 
-                             len(word) > 3]
-            
-            print(f"🔍 DEBUG: Filtered tokens count: {len(filtered_tokens)}")
+            # Content words (no stopwords, punctuation or short words) from the shared analysis
+            document = self.text_compressor.analyze(text, document)
+            print(f"🔍 DEBUG: Filtered tokens count: {sum(document.term_counts.values())}")
             
             # Get most frequent words
-            word_freq = Counter(filtered_tokens)
-            keywords = [word for word, freq in word_freq.most_common(20)]
+            keywords = document.keywords(20)
             entities['keywords'] = keywords[:10]  # Top 10 keywords
             print(f"🔍 DEBUG: NLTK keywords: {entities['keywords']}")
             
@@ -201,14 +199,14 @@ class GraphBuilder:
         
         return entities
     
-    def _extract_relationships(self, text: str) -> List[Tuple[str, str, str]]:
+    def _extract_relationships(self, text: str, document: Optional[AnalyzedDocument] = None) -> List[Tuple[str, str, str]]:
         """Extract relationships between entities using improved patterns"""
         print(f"🔍 DEBUG: _extract_relationships called with text length: {len(text)}")
         
         relationships = []
         
         # Split into sentences
-        sentences = sent_tokenize(text) if len(text) > 100 else text.split('. ')
+        sentences = self.text_compressor.analyze(text, document).sentences if len(text) > 100 else text.split('. ')
         print(f"🔍 DEBUG: Split into {len(sentences)} sentences")
         print(f"🔍 DEBUG: Sample sentences: {sentences[:3]}")
         
@@ -262,22 +260,20 @@ class GraphBuilder:
         """Normalize entity names for matching (lowercase, strip, collapse spaces)"""
         return re.sub(r'\s+', ' ', name.strip().lower())
 
-    def _add_entity_nodes(self, entities: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    def _add_entity_nodes(self, context: GraphContext, entities: Dict[str, List[str]]) -> Dict[str, List[str]]:
         """Add entity nodes to the graph and build a lookup for normalized names"""
         print(f"🔍 DEBUG: _add_entity_nodes called with entities: {entities}")
         
         entity_nodes = {}
-        self.entity_name_to_node_id = {}  # NEW: normalized name -> node_id
         
         for entity_type, entity_list in entities.items():
             entity_nodes[entity_type] = []
             print(f"🔍 DEBUG: Processing entity type: {entity_type} with {len(entity_list)} items")
             
             for entity in entity_list:
-                node_id = f"{entity_type}_{self.node_id_counter}"
-                self.node_id_counter += 1
+                node_id = context.next_id(entity_type)
                 
-                self.graph.add_node(node_id,
+                context.graph.add_node(node_id,
                                    type=entity_type,
                                    name=entity,
                                    value=entity)
@@ -285,14 +281,14 @@ class GraphBuilder:
                 entity_nodes[entity_type].append(node_id)
                 # Add to lookup table
                 norm = self._normalize_name(entity)
-                self.entity_name_to_node_id[norm] = node_id
+                context.entity_name_to_node_id[norm] = node_id
                 print(f"🔍 DEBUG: Added node {node_id} for entity '{entity}' of type '{entity_type}' (normalized: '{norm}')")
         
         print(f"🔍 DEBUG: Final entity_nodes: {entity_nodes}")
-        print(f"🔍 DEBUG: entity_name_to_node_id: {self.entity_name_to_node_id}")
+        print(f"🔍 DEBUG: entity_name_to_node_id: {context.entity_name_to_node_id}")
         return entity_nodes
     
-    def _add_relationship_edges(self, relationships: List[Tuple[str, str, str]], entity_nodes: Dict[str, List[str]]):
+    def _add_relationship_edges(self, context: GraphContext, relationships: List[Tuple[str, str, str]], entity_nodes: Dict[str, List[str]]):
         """Add relationship edges to the graph using normalized name lookup, creating nodes if needed"""
         print(f"🔍 DEBUG: _add_relationship_edges called with {len(relationships)} relationships")
         print(f"🔍 DEBUG: Available entity_nodes: {entity_nodes}")
@@ -305,26 +301,24 @@ class GraphBuilder:
             # Use normalized name lookup
             norm1 = self._normalize_name(entity1)
             norm2 = self._normalize_name(entity2)
-            node1 = self.entity_name_to_node_id.get(norm1)
-            node2 = self.entity_name_to_node_id.get(norm2)
+            node1 = context.entity_name_to_node_id.get(norm1)
+            node2 = context.entity_name_to_node_id.get(norm2)
             
             # If node1 does not exist, create it as a concept
             if not node1:
-                node1 = f"concepts_{self.node_id_counter}"
-                self.node_id_counter += 1
-                self.graph.add_node(node1, type='concepts', name=entity1, value=entity1)
-                self.entity_name_to_node_id[norm1] = node1
+                node1 = context.next_id("concepts")
+                context.graph.add_node(node1, type='concepts', name=entity1, value=entity1)
+                context.entity_name_to_node_id[norm1] = node1
                 print(f"🔍 DEBUG: Created missing node1: {node1} for entity1: {entity1} (normalized: {norm1})")
             # If node2 does not exist, create it as a concept
             if not node2:
-                node2 = f"concepts_{self.node_id_counter}"
-                self.node_id_counter += 1
-                self.graph.add_node(node2, type='concepts', name=entity2, value=entity2)
-                self.entity_name_to_node_id[norm2] = node2
+                node2 = context.next_id("concepts")
+                context.graph.add_node(node2, type='concepts', name=entity2, value=entity2)
+                context.entity_name_to_node_id[norm2] = node2
                 print(f"🔍 DEBUG: Created missing node2: {node2} for entity2: {entity2} (normalized: {norm2})")
             
             if node1 and node2:
-                self.graph.add_edge(node1, node2, 
+                context.graph.add_edge(node1, node2, 
                                    relation=relation,
                                    weight=1.0)
                 edges_added += 1
@@ -335,7 +329,7 @@ class GraphBuilder:
         
         print(f"🔍 DEBUG: Total edges added: {edges_added}")
     
-    def _connect_entities_to_document(self, entity_nodes: Dict[str, List[str]], doc_node_id: str):
+    def _connect_entities_to_document(self, context: GraphContext, entity_nodes: Dict[str, List[str]], doc_node_id: str):
         """Connect all entities to the document node"""
         print(f"🔍 DEBUG: _connect_entities_to_document called with doc_node_id: {doc_node_id}")
         print(f"🔍 DEBUG: entity_nodes: {entity_nodes}")
@@ -343,7 +337,7 @@ class GraphBuilder:
         connections_added = 0
         for entity_type, nodes in entity_nodes.items():
             for node_id in nodes:
-                self.graph.add_edge(doc_node_id, node_id,
+                context.graph.add_edge(doc_node_id, node_id,
                                    relation=f'contains_{entity_type}',
                                    weight=0.5)
                 connections_added += 1
@@ -351,38 +345,38 @@ class GraphBuilder:
         
         print(f"🔍 DEBUG: Total document connections added: {connections_added}")
     
-    def _analyze_graph(self) -> Dict[str, Any]:
+    def _analyze_graph(self, context: GraphContext) -> Dict[str, Any]:
         """Analyze the graph structure"""
         analysis = {
-            'num_nodes': self.graph.number_of_nodes(),
-            'num_edges': self.graph.number_of_edges(),
-            'density': nx.density(self.graph),
-            'connected_components': nx.number_connected_components(self.graph),
+            'num_nodes': context.graph.number_of_nodes(),
+            'num_edges': context.graph.number_of_edges(),
+            'density': nx.density(context.graph),
+            'connected_components': nx.number_connected_components(context.graph),
             'node_types': {},
             'centrality': {}
         }
         
         # Count node types
-        for node in self.graph.nodes():
-            node_type = self.graph.nodes[node]['type']
+        for node in context.graph.nodes():
+            node_type = context.graph.nodes[node]['type']
             analysis['node_types'][node_type] = analysis['node_types'].get(node_type, 0) + 1
         
         # Calculate centrality for important nodes
-        if self.graph.number_of_nodes() > 1:
-            centrality = nx.degree_centrality(self.graph)
+        if context.graph.number_of_nodes() > 1:
+            centrality = nx.degree_centrality(context.graph)
             analysis['centrality'] = {node: centrality[node] for node in centrality}
         
         return analysis
     
-    def _serialize_graph(self) -> Dict[str, Any]:
+    def _serialize_graph(self, context: GraphContext) -> Dict[str, Any]:
         """Convert graph to serializable format"""
         nodes = []
         edges = []
         
-        print(f"🔍 DEBUG: _serialize_graph - Graph has {self.graph.number_of_nodes()} nodes and {self.graph.number_of_edges()} edges")
+        print(f"🔍 DEBUG: _serialize_graph - Graph has {context.graph.number_of_nodes()} nodes and {context.graph.number_of_edges()} edges")
         
-        for node in self.graph.nodes():
-            node_data = self.graph.nodes[node].copy()
+        for node in context.graph.nodes():
+            node_data = context.graph.nodes[node].copy()
             node_data['id'] = node
             
             # Ensure we have the required fields for visualization
@@ -400,7 +394,7 @@ class GraphBuilder:
             nodes.append(node_data)
             print(f"🔍 DEBUG: Serialized node {node}: {node_data}")
         
-        for edge in self.graph.edges(data=True):
+        for edge in context.graph.edges(data=True):
             edge_data = {
                 'source': edge[0],
                 'target': edge[1],
@@ -0,0 +1,26 @@
+import networkx as nx
+from typing import Dict
+
+
+class GraphContext:
+    """
+    State of one graph being built
+
+    Graph builders hold only configuration and shared services; every
+    build_graph call creates its own context and threads it through the
+    helpers that add nodes and edges, so concurrent builds on one builder
+    (interleaved coroutines or separate threads) never share a graph or a
+    node id counter.
+    """
+
+    def __init__(self):
+        self.graph = nx.Graph()
+        self.node_id_counter = 0
+        # Normalized entity name -> node id, for builders that match entities by name
+        self.entity_name_to_node_id: Dict[str, str] = {}
+
+    def next_id(self, prefix: str) -> str:
+        """Allocate the next node id of this graph, e.g. ``concept_3``"""
+        node_id = f"{prefix}_{self.node_id_counter}"
+        self.node_id_counter += 1
+        return node_id
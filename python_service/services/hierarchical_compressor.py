@@ -0,0 +1,179 @@
+import asyncio
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .text_compressor import TextCompressor
+
+# Preferred window cut points, strongest first
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_BREAK = re.compile(r'[.!?]["\')\]]*\s+')
+_WHITESPACE = re.compile(r'\s+')
+
+_worker_compressor: Optional[TextCompressor] = None
+
+
+def _compress_window(text: str, target_length: int, method: str, segmenter: str = "punkt") -> str:
+    """
+    Compress one window of text.
+
+    Runs inside a worker process, which keeps its own TextCompressor between tasks.
+    """
+    global _worker_compressor
+    if _worker_compressor is None or _worker_compressor.segmenter != segmenter:
+        _worker_compressor = TextCompressor(segmenter=segmenter)
+    return _worker_compressor.compress_text(text, target_length=target_length, method=method)["compressed_text"]
+
+
+def iter_windows(pieces: Iterable[str], window_size: int) -> Iterator[str]:
+    """
+    Regroup a stream of text pieces (pages, or one whole text) into windows of at most ``window_size`` characters
+
+    Windows end at the last paragraph break, sentence end or whitespace in their
+    second half, in that order of preference, so sentences are rarely split. Only
+    the unconsumed tail of the stream read so far is held in memory.
+    """
+    buffer = ""
+    position = 0
+    for piece in pieces:
+        buffer = f"{buffer[position:]}\n\n{piece}" if buffer[position:] else piece
+        position = 0
+        while len(buffer) - position > window_size:
+            cut = _window_cut(buffer, position, window_size)
+            window = buffer[position:cut].strip()
+            position = cut
+            if window:
+                yield window
+    if buffer[position:].strip():
+        yield buffer[position:].strip()
+
+
+def _window_cut(text: str, start: int, window_size: int) -> int:
+    """End offset of the window of ``text`` starting at ``start``"""
+    for pattern in (_PARAGRAPH_BREAK, _SENTENCE_BREAK, _WHITESPACE):
+        last = None
+        for last in pattern.finditer(text, start + window_size // 2, start + window_size):
+            pass
+        if last is not None:
+            return last.end()
+    return start + window_size
+
+
+class HierarchicalCompressor:
+    """
+    Map-reduce compression for texts too long to compress in one pass
+
+    The text is cut into fixed-size windows, each window is compressed to the
+    target length (in worker processes when ``max_workers`` > 1), and the joined
+    outputs are windowed and compressed again until they fit in one window. The
+    caller then runs its usual compression on that reduced text.
+
+    Given a stream of pieces (e.g. pages), the compressor itself holds only the
+    window size times the number of windows in flight, plus the much shorter
+    outputs of the first level. Given one whole string, the caller already holds
+    the full text, so memory is bounded by that text instead.
+    """
+
+    def __init__(self, compressor: Optional[TextCompressor] = None, window_size: int = 50000,
+                 max_workers: int = 1, method: str = "textrank"):
+        """
+        Args:
+            compressor: Compressor for the in-process path (max_workers == 1)
+            window_size: Characters per window
+            max_workers: Worker processes compressing windows in parallel
+            method: Compression method for the map steps; "textrank" keeps
+                document order, which later levels and the final pass rely on
+        """
+        self.compressor = compressor or TextCompressor()
+        self.window_size = window_size
+        self.max_workers = max(1, max_workers)
+        self.method = method
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def reduce(self, pieces: Iterable[str], target_length: int) -> Dict[str, Any]:
+        """
+        Shrink text until it fits in one window
+
+        Args:
+            pieces: The text, whole or as a stream of pieces such as pages
+            target_length: Length each window is compressed to
+
+        Returns:
+            Dictionary with the reduced text, the original length, the number of
+            levels and the windows compressed at each level
+        """
+        if isinstance(pieces, str):
+            pieces = [pieces]
+        # Each level must shrink its input at least fourfold to terminate quickly
+        window_size = max(self.window_size, 4 * target_length)
+        original_length = 0
+
+        def counted(stream: Iterable[str]) -> Iterator[str]:
+            nonlocal original_length
+            for piece in stream:
+                original_length += len(piece)
+                yield piece
+
+        windows = iter_windows(counted(pieces), window_size)
+        level_windows = []
+        while True:
+            outputs = await self._map(windows, target_length)
+            level_windows.append(len(outputs))
+            reduced = "\n\n".join(outputs)
+            if len(outputs) <= 1 or len(reduced) <= window_size:
+                break
+            windows = iter_windows([reduced], window_size)
+
+        return {
+            "reduced_text": reduced,
+            "original_length": original_length,
+            "levels": len(level_windows),
+            "windows": level_windows
+        }
+
+    async def _map(self, windows: Iterator[str], target_length: int) -> List[str]:
+        """Compress every window, keeping at most two per worker in flight, and return outputs in order"""
+        if self.max_workers == 1:
+            return await asyncio.to_thread(self._map_sequential, windows, target_length)
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        outputs = []
+        pending = []
+        try:
+            for window in windows:
+                pending.append(loop.run_in_executor(executor, _compress_window, window, target_length,
+                                                    self.method, self.compressor.segmenter))
+                if len(pending) >= 2 * self.max_workers:
+                    outputs.append(await pending.pop(0))
+            for task in pending:
+                outputs.append(await task)
+        finally:
+            for task in pending:
+                task.cancel()
+        return outputs
+
+    def _map_sequential(self, windows: Iterator[str], target_length: int) -> List[str]:
+        return [
+            self.compressor.compress_text(window, target_length=target_length, method=self.method)["compressed_text"]
+            for window in windows
+        ]
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Lazily create the compression process pool
+
+        Workers are spawned rather than forked: the service process holds
+        threads (batcher, event loop executors) and model state that must not
+        be copied mid-operation into a child.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def shutdown(self):
+        """Shut down the compression process pool, if one was started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
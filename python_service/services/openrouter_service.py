@@ -6,15 +6,33 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime
 import time
 
+from .token_budget import TokenEstimator
+
 class OpenRouterService:
     """
     Service for interacting with OpenRouter API for AI-powered graph generation
     """
     
-    def __init__(self, api_key: Optional[str] = None, site_url: str = "http://localhost:3000", site_name: str = "Assist2"):
+    DEFAULT_MODEL = "google/gemma-3n-e4b-it:free"
+    
+    def __init__(self, api_key: Optional[str] = None, site_url: str = "http://localhost:3000", site_name: str = "Assist2",
+                 max_prompt_tokens: int = 0, max_completion_tokens: int = 2000,
+                 token_estimator: Optional[TokenEstimator] = None):
+        """
+        Args:
+            api_key: OpenRouter API key; read from OPENROUTER_API_KEY if omitted
+            site_url: Referer sent with requests
+            site_name: Title sent with requests
+            max_prompt_tokens: Token budget of the graph prompt; 0 leaves prompts unbudgeted
+            max_completion_tokens: Tokens the model may generate per call
+            token_estimator: Estimator calibrated from each call's reported usage
+        """
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         self.site_url = site_url
         self.site_name = site_name
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.token_estimator = token_estimator or TokenEstimator()
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
         self.logger = logging.getLogger(__name__)
         
@@ -136,6 +154,23 @@ Please respond in JSON format:
             self.logger.error(f"Error extracting entities: {str(e)}")
             raise Exception(f"Entity extraction failed: {str(e)}")
     
+    def graph_text_budget(self, metadata: Dict[str, Any] = None, model: str = DEFAULT_MODEL) -> Optional[int]:
+        """
+        Tokens left for document text in the graph prompt
+        
+        Args:
+            metadata: Document metadata that will go into the prompt
+            model: Model whose tokens are counted
+            
+        Returns:
+            max_prompt_tokens minus the estimated prompt template, or None when
+            prompts are unbudgeted
+        """
+        if self.max_prompt_tokens <= 0:
+            return None
+        template_tokens = self.token_estimator.estimate(self._create_graph_prompt("", metadata), model)
+        return max(0, self.max_prompt_tokens - template_tokens)
+    
     def _create_graph_prompt(self, text: str, metadata: Dict[str, Any] = None) -> str:
         """Create a prompt for graph generation"""
         metadata_info = ""
@@ -188,7 +223,7 @@ Focus on creating meaningful connections and identifying the most important elem
         
         return prompt
     
-    def _make_api_call(self, prompt: str, model: str = "google/gemma-3n-e4b-it:free") -> str:
+    def _make_api_call(self, prompt: str, model: str = DEFAULT_MODEL) -> str:
         """Make API call to OpenRouter"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -206,7 +241,7 @@ Focus on creating meaningful connections and identifying the most important elem
                 }
             ],
             "temperature": 0.3,  # Lower temperature for more consistent results
-            "max_tokens": 2000
+            "max_tokens": self.max_completion_tokens
         }
         
         try:
@@ -221,6 +256,11 @@ Focus on creating meaningful connections and identifying the most important elem
             
             result = response.json()
             
+            # Calibrate the token estimator against the model's own count
+            usage = result.get("usage")
+            if isinstance(usage, dict) and usage.get("prompt_tokens"):
+                self.token_estimator.observe(model, prompt, usage["prompt_tokens"])
+            
             if "choices" in result and len(result["choices"]) > 0:
                 return result["choices"][0]["message"]["content"]
             else:
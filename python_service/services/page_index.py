@@ -0,0 +1,68 @@
+from array import array
+from bisect import bisect_right
+from typing import Dict, Any, List, Optional
+
+
+class PageIndex:
+    """
+    Maps character offsets in extracted text back to 1-based PDF page numbers
+
+    Spans are stored column-wise in typed arrays (three machine integers per
+    page with text), ordered by offset, so lookups are a binary search.
+    """
+
+    def __init__(self):
+        self.pages = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def add(self, page: int, start: int, end: int):
+        """Record that text[start:end] came from ``page``; spans must be added in order"""
+        self.pages.append(page)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def page_for_offset(self, offset: int) -> Optional[int]:
+        """Page containing the character at ``offset``, or None if it falls between pages"""
+        position = bisect_right(self.starts, offset) - 1
+        if position < 0 or offset >= self.ends[position]:
+            return None
+        return self.pages[position]
+
+    def pages_for_span(self, start: int, end: int) -> List[int]:
+        """Every page overlapping text[start:end]"""
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        last = bisect_right(self.starts, max(start, end - 1))
+        return [
+            self.pages[position]
+            for position in range(first, last)
+            if self.ends[position] > start and self.starts[position] < end
+        ]
+
+    def page_span(self, page: int) -> Optional[tuple]:
+        """(start, end) of a page's text, or None if the page had no text"""
+        for position, indexed_page in enumerate(self.pages):
+            if indexed_page == page:
+                return self.starts[position], self.ends[position]
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialise as parallel lists for JSON responses"""
+        return {
+            "pages": self.pages.tolist(),
+            "starts": self.starts.tolist(),
+            "ends": self.ends.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "PageIndex":
+        """Rebuild an index from ``to_dict`` output (an empty index for None)"""
+        index = cls()
+        if data:
+            index.pages.extend(data.get("pages", []))
+            index.starts.extend(data.get("starts", []))
+            index.ends.extend(data.get("ends", []))
+        return index
@@ -0,0 +1,340 @@
+import abc
+import io
+import mmap
+import threading
+from collections import Counter
+from typing import Dict, Any, Tuple, Optional
+
+import PyPDF2
+import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+# PDFium is not thread-safe; every call into it goes through this lock
+_PDFIUM_LOCK = threading.RLock()
+
+METADATA_FIELDS = {
+    'title': 'Title',
+    'author': 'Author',
+    'subject': 'Subject',
+    'creator': 'Creator',
+    'producer': 'Producer',
+    'creation_date': 'CreationDate',
+    'modification_date': 'ModDate'
+}
+
+
+def _standard_metadata(raw: Optional[Dict[str, Any]], key_prefix: str = "") -> Dict[str, Any]:
+    """Map an engine's raw document info dictionary onto our metadata fields"""
+    if not raw:
+        return {}
+    return {field: raw.get(f"{key_prefix}{key}", '') for field, key in METADATA_FIELDS.items()}
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file object over a buffer (bytes, mmap) with its own position
+
+    Lets several engines read one memory-mapped upload without copying it.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        end = min(self._pos + len(b), len(self._view))
+        size = end - self._pos
+        b[:size] = self._view[self._pos:end]
+        self._pos = end
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def fork_stream(pdf_stream):
+    """
+    Give an engine its own read position over the document bytes.
+
+    BytesIO objects built from ``bytes`` share the underlying buffer and mmaps
+    are wrapped in a BufferReader, so neither case copies the document.
+    """
+    if isinstance(pdf_stream, mmap.mmap):
+        return BufferReader(pdf_stream)
+    if hasattr(pdf_stream, 'getvalue'):
+        return io.BytesIO(pdf_stream.getvalue())
+    pdf_stream.seek(0)
+    return io.BytesIO(pdf_stream.read())
+
+
+def read_all(pdf_stream) -> bytes:
+    """Return the full document as bytes, without copying in-memory streams"""
+    if hasattr(pdf_stream, 'getvalue'):
+        return pdf_stream.getvalue()
+    pdf_stream.seek(0)
+    return pdf_stream.read()
+
+
+class EngineDocument(abc.ABC):
+    """An open document that can extract text one page at a time"""
+
+    engine_name = "base"
+
+    def __init__(self):
+        self.page_count = 0
+        self.page_engines = Counter()
+        self._reader = None
+
+    def metadata(self) -> Dict[str, Any]:
+        """Return the standard metadata fields for the document"""
+        return {}
+
+    @abc.abstractmethod
+    def extract_page(self, page_num: int) -> Tuple[str, str]:
+        """
+        Extract raw text for a zero-based page number
+
+        Returns:
+            Tuple of (page_text, name of the engine that produced it)
+        """
+
+    def close(self):
+        # Release our view of the document so the caller can close its mmap
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PdfiumDocument(EngineDocument):
+    """Text-layer extraction through PDFium, much faster than layout analysis"""
+
+    engine_name = "pdfium"
+
+    def __init__(self, pdf_stream):
+        super().__init__()
+        with _PDFIUM_LOCK:
+            self._reader = fork_stream(pdf_stream)
+            self.pdf = pdfium.PdfDocument(self._reader)
+            self.page_count = len(self.pdf)
+
+    def metadata(self) -> Dict[str, Any]:
+        with _PDFIUM_LOCK:
+            raw = self.pdf.get_metadata_dict()
+        return _standard_metadata(raw)
+
+    def extract_page(self, page_num: int) -> Tuple[str, str]:
+        with _PDFIUM_LOCK:
+            page = self.pdf[page_num]
+            try:
+                text = self._page_text(page)
+            finally:
+                page.close()
+        self.page_engines[self.engine_name] += 1
+        return text, self.engine_name
+
+    def probe_page(self, page_num: int, path_limit: int) -> Tuple[str, int, int]:
+        """
+        Extract a page's text and count its text and path objects in the same pass
+
+        Path counting stops at ``path_limit`` so ruled tables do not cost a full walk.
+        """
+        with _PDFIUM_LOCK:
+            page = self.pdf[page_num]
+            try:
+                text_objects = 0
+                path_objects = 0
+                for obj in page.get_objects():
+                    if obj.type == pdfium_c.FPDF_PAGEOBJ_TEXT:
+                        text_objects += 1
+                    elif obj.type == pdfium_c.FPDF_PAGEOBJ_PATH:
+                        path_objects += 1
+                        if path_objects >= path_limit:
+                            break
+                text = self._page_text(page)
+            finally:
+                page.close()
+        return text, text_objects, path_objects
+
+    def _page_text(self, page) -> str:
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_bounded()
+        finally:
+            textpage.close()
+        # PDFium marks hyphens at line breaks with \x02; restore the pdfplumber layout
+        return text.replace('\r\n', '\n').replace('\x02', '-\n').replace('\x00', '')
+
+    def close(self):
+        with _PDFIUM_LOCK:
+            self.pdf.close()
+        super().close()
+
+
+class PdfplumberDocument(EngineDocument):
+    """Layout-aware extraction through pdfplumber, best for tables and columns"""
+
+    engine_name = "pdfplumber"
+
+    def __init__(self, pdf_stream):
+        super().__init__()
+        self._reader = fork_stream(pdf_stream)
+        self.pdf = pdfplumber.open(self._reader)
+        self.page_count = len(self.pdf.pages)
+
+    def metadata(self) -> Dict[str, Any]:
+        return _standard_metadata(self.pdf.metadata)
+
+    def extract_page(self, page_num: int) -> Tuple[str, str]:
+        page = self.pdf.pages[page_num]
+        text = page.extract_text() or ""
+        page.flush_cache()
+        self.page_engines[self.engine_name] += 1
+        return text, self.engine_name
+
+    def close(self):
+        self.pdf.close()
+        super().close()
+
+
+class PyPDF2Document(EngineDocument):
+    """Pure-Python extraction through PyPDF2, tolerant of some malformed files"""
+
+    engine_name = "pypdf2"
+
+    def __init__(self, pdf_stream):
+        super().__init__()
+        self._reader = fork_stream(pdf_stream)
+        self.reader = PyPDF2.PdfReader(self._reader)
+        self.page_count = len(self.reader.pages)
+
+    def metadata(self) -> Dict[str, Any]:
+        return _standard_metadata(self.reader.metadata, key_prefix="/")
+
+    def extract_page(self, page_num: int) -> Tuple[str, str]:
+        text = self.reader.pages[page_num].extract_text() or ""
+        self.page_engines[self.engine_name] += 1
+        return text, self.engine_name
+
+
+class AutoDocument(EngineDocument):
+    """
+    Picks an engine per page using cheap PDFium probes
+
+    Plain text-layer pages go through PDFium. Pages drawn with many vector paths
+    (ruled tables, forms, diagrams) go to pdfplumber for its layout analysis, and
+    pages where PDFium finds text objects but no text fall back to PyPDF2.
+    If PDFium cannot open the document at all, pdfplumber handles every page.
+    """
+
+    engine_name = "auto"
+
+    def __init__(self, pdf_stream, layout_path_threshold: int = 50):
+        super().__init__()
+        self.pdf_stream = pdf_stream
+        self.layout_path_threshold = layout_path_threshold
+        self._pdfplumber: Optional[PdfplumberDocument] = None
+        self._pypdf2: Optional[PyPDF2Document] = None
+
+        try:
+            self._pdfium: Optional[PdfiumDocument] = PdfiumDocument(pdf_stream)
+            self.page_count = self._pdfium.page_count
+        except Exception:
+            self._pdfium = None
+            self.page_count = self._get_pdfplumber().page_count
+
+    def metadata(self) -> Dict[str, Any]:
+        if self._pdfium is not None:
+            return self._pdfium.metadata()
+        return self._get_pdfplumber().metadata()
+
+    def extract_page(self, page_num: int) -> Tuple[str, str]:
+        text, engine = self._select_and_extract(page_num)
+        self.page_engines[engine] += 1
+        return text, engine
+
+    def _select_and_extract(self, page_num: int) -> Tuple[str, str]:
+        if self._pdfium is None:
+            return self._get_pdfplumber().extract_page(page_num)
+
+        try:
+            text, text_objects, path_objects = self._pdfium.probe_page(page_num, self.layout_path_threshold)
+        except Exception:
+            return self._get_pypdf2().extract_page(page_num)
+
+        if path_objects >= self.layout_path_threshold:
+            return self._get_pdfplumber().extract_page(page_num)
+
+        if text_objects > 0 and not text.strip():
+            return self._get_pypdf2().extract_page(page_num)
+
+        return text, PdfiumDocument.engine_name
+
+    def _get_pdfplumber(self) -> PdfplumberDocument:
+        if self._pdfplumber is None:
+            self._pdfplumber = PdfplumberDocument(self.pdf_stream)
+        return self._pdfplumber
+
+    def _get_pypdf2(self) -> PyPDF2Document:
+        if self._pypdf2 is None:
+            self._pypdf2 = PyPDF2Document(self.pdf_stream)
+        return self._pypdf2
+
+    def close(self):
+        for document in (self._pdfium, self._pdfplumber, self._pypdf2):
+            if document is not None:
+                document.close()
+        super().close()
+
+
+ENGINES = {
+    "pdfium": PdfiumDocument,
+    "pdfplumber": PdfplumberDocument,
+    "pypdf2": PyPDF2Document,
+    "auto": AutoDocument
+}
+
+
+def open_document(engine: str, pdf_stream, layout_path_threshold: int = 50) -> EngineDocument:
+    """
+    Open a PDF with the named extraction engine
+
+    Args:
+        engine: One of "auto", "pdfium", "pdfplumber" or "pypdf2"
+        pdf_stream: Seekable binary stream containing PDF data
+        layout_path_threshold: Path objects per page above which auto mode uses pdfplumber
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown PDF engine: {engine}")
+    if engine == "auto":
+        return AutoDocument(pdf_stream, layout_path_threshold=layout_path_threshold)
+    return ENGINES[engine](pdf_stream)
@@ -1,82 +1,399 @@
 import PyPDF2
-import pdfplumber
+import asyncio
 import io
-from typing import Tuple, Dict, Any
+import multiprocessing
+from collections import Counter
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Tuple, Dict, Any, List, Optional, BinaryIO, AsyncIterator
 import re
 
+from .page_index import PageIndex
+from .pdf_engines import open_document, read_all
+from .pdf_sandbox import PDFSandbox, PDFSandboxBusy, PDFSandboxLimitExceeded
+
+
+def _extract_page_range(engine: str, pdf_bytes: bytes, start: int, end: int,
+                        layout_path_threshold: int) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Extract raw text for pages [start, end) with the given engine.
+
+    Runs inside a worker process, so it opens its own copy of the document.
+    Empty pages are returned as empty strings to keep page positions stable.
+    """
+    page_texts = []
+    with open_document(engine, io.BytesIO(pdf_bytes), layout_path_threshold) as document:
+        for page_num in range(start, end):
+            page_text, _ = document.extract_page(page_num)
+            page_texts.append(page_text)
+        return page_texts, dict(document.page_engines)
+
+
+class PageTextAssembler:
+    """
+    Incrementally joins and cleans page text, one page at a time
+    
+    Produces exactly what ``PDFProcessor._clean_text`` does for the
+    marker-joined document, but knows where each page lands in the cleaned
+    text as soon as the page is added, without the rest of the document.
+    Spans of numbered pages are recorded in ``page_index``.
+    """
+    
+    MARKER_PATTERN = re.compile(r'--- Page \d+ ---')
+    WHITESPACE_PATTERN = re.compile(r'\s+')
+    
+    def __init__(self, keep_text: bool = True):
+        self.keep_text = keep_text
+        self._segments = [' '] if keep_text else []
+        self._raw_length = 1  # the cleaned document starts from a single separator
+        self._lead: Optional[int] = None  # leading whitespace stripped from the document
+        self.text_end = 0
+        self.page_index = PageIndex()
+    
+    def add_page(self, page_text: Optional[str], page_number: Optional[int] = None) -> Tuple[int, str]:
+        """
+        Add the next page's raw text
+        
+        Args:
+            page_text: Raw text extracted from the page
+            page_number: 1-based page number to record in the page index
+        
+        Returns:
+            Tuple of (char_offset, cleaned_page_text) in the cleaned document
+        """
+        if not page_text:
+            return self.text_end, ""
+        
+        core = page_text.strip()
+        cleaned = self.MARKER_PATTERN.sub('', self.WHITESPACE_PATTERN.sub(' ', core)) if core else ''
+        segment = f" {cleaned} " if core else " "
+        
+        content_start = self._raw_length + 1 + (len(cleaned) - len(cleaned.lstrip()))
+        self._raw_length += len(segment)
+        if self.keep_text:
+            self._segments.append(segment)
+        
+        page_clean = cleaned.strip()
+        if not page_clean:
+            return self.text_end, ""
+        
+        if self._lead is None:
+            self._lead = content_start
+        offset = content_start - self._lead
+        self.text_end = offset + len(page_clean)
+        if page_number is not None:
+            self.page_index.add(page_number, offset, self.text_end)
+        return offset, page_clean
+    
+    def get_text(self) -> str:
+        """Return the cleaned document assembled so far"""
+        return "".join(self._segments).strip()
+
+
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, max_workers: int = 1, pages_per_shard: int = 25, parallel_min_pages: int = 50,
+                 engine: str = "pdfplumber", layout_path_threshold: int = 50,
+                 sandbox: Optional[PDFSandbox] = None):
         self.supported_mime_types = ['application/pdf']
+        self.max_workers = max(1, max_workers)
+        self.pages_per_shard = max(1, pages_per_shard)
+        self.parallel_min_pages = parallel_min_pages
+        self.engine = engine
+        self.layout_path_threshold = layout_path_threshold
+        self.sandbox = sandbox
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._sandbox_executor: Optional[ThreadPoolExecutor] = None
     
-    async def process_pdf(self, pdf_stream: io.BytesIO) -> Tuple[str, Dict[str, Any]]:
+    async def process_pdf(self, pdf_stream: BinaryIO,
+                          page_range: Optional[Tuple[int, int]] = None) -> Tuple[str, Dict[str, Any]]:
         """
         Process a PDF file and extract text content and metadata
         
         Args:
-            pdf_stream: BytesIO stream containing PDF data
+            pdf_stream: Seekable binary stream containing PDF data (BytesIO, file or mmap)
+            page_range: Optional 1-based inclusive (first_page, last_page); other pages are not parsed
             
         Returns:
-            Tuple of (text_content, metadata)
+            Tuple of (text_content, metadata); metadata['page_index'] maps text offsets to pages
+            
+        Raises:
+            PDFSandboxLimitExceeded: If sandboxed parsing broke the time or memory limit
+            PDFSandboxBusy: If no sandbox worker became free within the queue timeout
         """
+        self._check_page_range(page_range)
+        
+        if self.sandbox is not None:
+            return await self._process_pdf_sandboxed(pdf_stream, page_range)
+        
         try:
             # Reset stream position
             pdf_stream.seek(0)
             
-            # Extract text using pdfplumber (more reliable for complex PDFs)
-            text_content = ""
+            # Extract text with the configured engine ("auto" picks one per page)
+            loop = asyncio.get_running_loop()
             metadata = {}
             
-            with pdfplumber.open(pdf_stream) as pdf:
+            with open_document(self.engine, pdf_stream, self.layout_path_threshold) as document:
                 # Extract metadata
-                metadata = self._extract_metadata(pdf)
+                metadata = document.metadata()
+                total_pages = document.page_count
+                start, end = self._resolve_page_range(page_range, total_pages)
                 
-                # Extract text from all pages
-                for page_num, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content += f"\n--- Page {page_num + 1} ---\n"
-                        text_content += page_text
-                        text_content += "\n"
+                # Extract text from the requested pages, sharded across worker processes for large documents
+                if self._should_parallelize(end - start):
+                    page_texts, page_engines = await self._extract_pages_parallel(pdf_stream, start, end)
+                else:
+                    page_texts, page_engines = await loop.run_in_executor(None, self._extract_pages, document, start, end)
             
-            # Clean up text
-            text_content = self._clean_text(text_content)
+            # Join pages and clean up text
+            text_content, page_index = self._assemble_text(page_texts, first_page=start + 1)
             
             # Add processing metadata
             metadata.update({
-                'total_pages': len(pdf.pages) if 'pdf' in locals() else 0,
+                'total_pages': total_pages,
                 'text_length': len(text_content),
                 'word_count': len(text_content.split()),
-                'processing_method': 'pdfplumber'
+                'processing_method': self.engine,
+                'page_engines': page_engines,
+                'page_index': page_index.to_dict()
             })
+            if page_range is not None:
+                metadata['page_range'] = [start + 1, end]
             
             return text_content, metadata
             
         except Exception as e:
-            # Fallback to PyPDF2 if pdfplumber fails
+            # Fallback to PyPDF2 if the configured engine fails
             try:
-                return await self._fallback_pypdf2(pdf_stream)
+                return await self._fallback_pypdf2(pdf_stream, page_range)
             except Exception as fallback_error:
                 raise Exception(f"PDF processing failed with both methods: {str(e)}, fallback: {str(fallback_error)}")
     
-    def _extract_metadata(self, pdf) -> Dict[str, Any]:
-        """Extract metadata from PDF"""
-        metadata = {}
+    async def iter_pages(self, pdf_stream: BinaryIO,
+                         page_range: Optional[Tuple[int, int]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Extract a PDF page by page, yielding each page as soon as it is ready
         
+        Args:
+            pdf_stream: Seekable binary stream containing PDF data
+            page_range: Optional 1-based inclusive (first_page, last_page)
+            
+        Yields:
+            Dictionaries with the 1-based page number, the page's cleaned text and
+            its char_offset in the text that process_pdf would return
+        """
+        self._check_page_range(page_range)
+        pdf_stream.seek(0)
+        loop = asyncio.get_running_loop()
+        assembler = PageTextAssembler(keep_text=False)
+        
+        if self.sandbox is not None:
+            async for page_num, page_text in self._iter_pages_sandboxed(pdf_stream, page_range):
+                char_offset, text = assembler.add_page(page_text)
+                yield {"page": page_num + 1, "text": text, "char_offset": char_offset}
+            return
+        
+        with open_document(self.engine, pdf_stream, self.layout_path_threshold) as document:
+            start, end = self._resolve_page_range(page_range, document.page_count)
+            
+            if self._should_parallelize(end - start):
+                page_num = start
+                async for shard_texts, _ in self._iter_shards(pdf_stream, start, end):
+                    for page_text in shard_texts:
+                        page_num += 1
+                        char_offset, text = assembler.add_page(page_text)
+                        yield {"page": page_num, "text": text, "char_offset": char_offset}
+            else:
+                for page_num in range(start, end):
+                    page_text, _ = await loop.run_in_executor(None, document.extract_page, page_num)
+                    char_offset, text = assembler.add_page(page_text)
+                    yield {"page": page_num + 1, "text": text, "char_offset": char_offset}
+    
+    async def _process_pdf_sandboxed(self, pdf_stream: BinaryIO,
+                                     page_range: Optional[Tuple[int, int]]) -> Tuple[str, Dict[str, Any]]:
+        """Process a PDF inside the sandbox, retrying there with PyPDF2 if the engine fails"""
+        pdf_bytes = read_all(pdf_stream)
         try:
-            if pdf.metadata:
-                metadata.update({
-                    'title': pdf.metadata.get('Title', ''),
-                    'author': pdf.metadata.get('Author', ''),
-                    'subject': pdf.metadata.get('Subject', ''),
-                    'creator': pdf.metadata.get('Creator', ''),
-                    'producer': pdf.metadata.get('Producer', ''),
-                    'creation_date': pdf.metadata.get('CreationDate', ''),
-                    'modification_date': pdf.metadata.get('ModDate', '')
-                })
-        except Exception:
-            pass
+            return await self._extract_sandboxed(self.engine, pdf_bytes, page_range)
+        except (PDFSandboxLimitExceeded, PDFSandboxBusy):
+            raise
+        except Exception as e:
+            try:
+                text_content, metadata = await self._extract_sandboxed("pypdf2", pdf_bytes, page_range)
+                metadata['processing_method'] = 'PyPDF2_fallback'
+                return text_content, metadata
+            except (PDFSandboxLimitExceeded, PDFSandboxBusy):
+                raise
+            except Exception as fallback_error:
+                raise Exception(f"PDF processing failed with both methods: {str(e)}, fallback: {str(fallback_error)}")
+    
+    async def _extract_sandboxed(self, engine: str, pdf_bytes: bytes,
+                                 page_range: Optional[Tuple[int, int]]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Extract text and metadata in sandbox workers, sharding large documents
+        
+        Pages that ran past the per-page time limit are left empty and listed
+        in metadata['skipped_pages'], with metadata['partial'] set.
+        """
+        job = self.sandbox.job(engine, pdf_bytes, self.layout_path_threshold)
+        
+        total_pages, metadata = await self._run_sandboxed(job.describe)
+        start, end = self._resolve_page_range(page_range, total_pages)
+        
+        shard_size = self.pages_per_shard if self._should_parallelize(end - start) else max(end - start, 1)
+        shards = await asyncio.gather(*[
+            self._run_sandboxed(job.extract, shard_start, min(shard_start + shard_size, end))
+            for shard_start in range(start, end, shard_size)
+        ])
+        
+        page_texts = []
+        skipped_pages = []
+        page_engines = Counter()
+        for shard_texts, shard_skipped, shard_engines in shards:
+            page_texts.extend(shard_texts)
+            skipped_pages.extend(shard_skipped)
+            page_engines.update(shard_engines)
         
-        return metadata
+        text_content, page_index = self._assemble_text(page_texts, first_page=start + 1)
+        
+        metadata.update({
+            'total_pages': total_pages,
+            'text_length': len(text_content),
+            'word_count': len(text_content.split()),
+            'processing_method': engine,
+            'page_engines': dict(page_engines),
+            'page_index': page_index.to_dict(),
+            'skipped_pages': skipped_pages,
+            'partial': bool(skipped_pages)
+        })
+        if page_range is not None:
+            metadata['page_range'] = [start + 1, end]
+        
+        return text_content, metadata
+    
+    async def _iter_pages_sandboxed(self, pdf_stream: BinaryIO,
+                                    page_range: Optional[Tuple[int, int]]) -> AsyncIterator[Tuple[int, str]]:
+        """Yield (zero-based page number, raw text) from one sandbox worker as pages finish"""
+        loop = asyncio.get_running_loop()
+        job = self.sandbox.job(self.engine, read_all(pdf_stream), self.layout_path_threshold)
+        total_pages, _ = await self._run_sandboxed(job.describe)
+        start, end = self._resolve_page_range(page_range, total_pages)
+        
+        pages: asyncio.Queue = asyncio.Queue()
+        
+        def on_page(page_num: int, page_text: str):
+            loop.call_soon_threadsafe(pages.put_nowait, (page_num, page_text))
+        
+        extraction = asyncio.ensure_future(self._run_sandboxed(job.extract, start, end, on_page))
+        
+        for _ in range(start, end):
+            page_getter = asyncio.ensure_future(pages.get())
+            await asyncio.wait({page_getter, extraction}, return_when=asyncio.FIRST_COMPLETED)
+            if not page_getter.done() and extraction.exception() is not None:
+                # The worker failed or broke a limit before producing this page
+                page_getter.cancel()
+                raise extraction.exception()
+            yield await page_getter
+        await extraction
+    
+    def _run_sandboxed(self, call, *args) -> "asyncio.Future":
+        """
+        Run a blocking sandbox job call on the sandbox's own thread pool
+        
+        Those threads wait for sandbox workers, so they are kept off the default
+        executor used by asyncio.to_thread. Time spent queued in the pool counts
+        towards the sandbox's queue timeout.
+        """
+        queued_since = time.monotonic()
+        return asyncio.get_running_loop().run_in_executor(
+            self._get_sandbox_executor(), lambda: call(*args, queued_since=queued_since)
+        )
+    
+    def _get_sandbox_executor(self) -> ThreadPoolExecutor:
+        """Lazily create the thread pool driving sandbox workers, one thread per worker"""
+        if self._sandbox_executor is None:
+            self._sandbox_executor = ThreadPoolExecutor(max_workers=self.sandbox.max_workers,
+                                                        thread_name_prefix="pdf-sandbox")
+        return self._sandbox_executor
+    
+    def _check_page_range(self, page_range: Optional[Tuple[int, int]]):
+        """Reject page ranges that are not 1-based and ordered"""
+        if page_range is not None and (page_range[0] < 1 or page_range[1] < page_range[0]):
+            raise ValueError(f"Invalid page range: {page_range[0]}-{page_range[1]}")
+    
+    def _resolve_page_range(self, page_range: Optional[Tuple[int, int]], total_pages: int) -> Tuple[int, int]:
+        """Convert an optional 1-based inclusive page range into clamped zero-based [start, end)"""
+        if page_range is None:
+            return 0, total_pages
+        first_page, last_page = page_range
+        return min(first_page - 1, total_pages), min(last_page, total_pages)
+    
+    def _should_parallelize(self, page_count: int) -> bool:
+        """Check whether a document is large enough to shard across worker processes"""
+        return self.max_workers > 1 and page_count >= max(self.parallel_min_pages, 2)
+    
+    def _extract_pages(self, document, start: int, end: int) -> Tuple[List[str], Dict[str, int]]:
+        """Extract raw text from pages [start, end) of an open engine document"""
+        page_texts = []
+        for page_num in range(start, end):
+            page_text, _ = document.extract_page(page_num)
+            page_texts.append(page_text)
+        return page_texts, dict(document.page_engines)
+    
+    async def _extract_pages_parallel(self, pdf_stream: BinaryIO, start: int, end: int) -> Tuple[List[str], Dict[str, int]]:
+        """
+        Extract page text on the process pool, one shard of consecutive pages per task
+        
+        Shards are gathered in submission order, so the page order matches the sequential path.
+        """
+        page_texts = []
+        page_engines = Counter()
+        async for shard_texts, shard_engines in self._iter_shards(pdf_stream, start, end):
+            page_texts.extend(shard_texts)
+            page_engines.update(shard_engines)
+        return page_texts, dict(page_engines)
+    
+    async def _iter_shards(self, pdf_stream: BinaryIO, start: int, end: int):
+        """Submit every shard of pages [start, end) to the process pool and yield results in page order"""
+        pdf_bytes = read_all(pdf_stream)
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        
+        shards = [
+            loop.run_in_executor(executor, _extract_page_range, self.engine, pdf_bytes, shard_start,
+                                 min(shard_start + self.pages_per_shard, end), self.layout_path_threshold)
+            for shard_start in range(start, end, self.pages_per_shard)
+        ]
+        
+        try:
+            for shard in shards:
+                yield await shard
+        finally:
+            for shard in shards:
+                shard.cancel()
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Lazily create the extraction process pool, spawned so no lock held by a service thread is forked"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+    
+    def shutdown(self):
+        """Shut down the extraction process pool and sandbox thread pool, if started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._sandbox_executor is not None:
+            self._sandbox_executor.shutdown(wait=True)
+            self._sandbox_executor = None
+    
+    def _assemble_text(self, page_texts: List[str], first_page: int = 1) -> Tuple[str, PageIndex]:
+        """Join per-page text, clean the result and index where each page landed"""
+        assembler = PageTextAssembler()
+        for page_number, page_text in enumerate(page_texts, start=first_page):
+            assembler.add_page(page_text, page_number)
+        return assembler.get_text(), assembler.page_index
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize extracted text"""
@@ -97,11 +414,11 @@ class PDFProcessor:
         
         return text
     
-    async def _fallback_pypdf2(self, pdf_stream: io.BytesIO) -> Tuple[str, Dict[str, Any]]:
+    async def _fallback_pypdf2(self, pdf_stream: BinaryIO,
+                               page_range: Optional[Tuple[int, int]] = None) -> Tuple[str, Dict[str, Any]]:
         """Fallback method using PyPDF2"""
         pdf_stream.seek(0)
         
-        text_content = ""
         metadata = {}
         
         try:
@@ -119,24 +436,23 @@ class PDFProcessor:
                     'modification_date': pdf_reader.metadata.get('/ModDate', '')
                 })
             
-            # Extract text from all pages
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text_content += f"\n--- Page {page_num + 1} ---\n"
-                    text_content += page_text
-                    text_content += "\n"
+            # Extract text from the requested pages
+            start, end = self._resolve_page_range(page_range, len(pdf_reader.pages))
+            page_texts = [pdf_reader.pages[page_num].extract_text() or "" for page_num in range(start, end)]
             
-            # Clean up text
-            text_content = self._clean_text(text_content)
+            # Join pages and clean up text
+            text_content, page_index = self._assemble_text(page_texts, first_page=start + 1)
             
             # Add processing metadata
             metadata.update({
                 'total_pages': len(pdf_reader.pages),
                 'text_length': len(text_content),
                 'word_count': len(text_content.split()),
-                'processing_method': 'PyPDF2_fallback'
+                'processing_method': 'PyPDF2_fallback',
+                'page_index': page_index.to_dict()
             })
+            if page_range is not None:
+                metadata['page_range'] = [start + 1, end]
             
             return text_content, metadata
             
@@ -0,0 +1,336 @@
+import io
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+import psutil
+
+from .pdf_engines import open_document
+
+
+class PDFSandboxLimitExceeded(Exception):
+    """A document broke the sandbox's time or memory limit and its worker was killed"""
+
+
+class PDFSandboxBusy(Exception):
+    """No sandbox worker became free within the queue timeout"""
+
+
+class _PageTimeout(Exception):
+    """A single page ran past the per-page time limit"""
+
+
+def _worker_main(conn):
+    """
+    Worker process loop: parse documents on request and report page by page
+
+    The most recent document is kept between requests so a restart after a
+    slow page does not resend the bytes.
+    """
+    loaded_token = None
+    loaded_source = None
+    conn.send(("ready",))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        kind = message[0]
+        if kind == "stop":
+            break
+
+        try:
+            _, token, source, engine, layout_path_threshold = message[:5]
+            if source is not None:
+                loaded_token, loaded_source = token, source
+            if token != loaded_token:
+                raise RuntimeError("Worker does not hold the requested document")
+
+            with open_document(engine, io.BytesIO(loaded_source), layout_path_threshold) as document:
+                if kind == "describe":
+                    conn.send(("described", document.page_count, document.metadata()))
+                elif kind == "extract":
+                    start, end = message[5:7]
+                    for page_num in range(start, end):
+                        page_text, page_engine = document.extract_page(page_num)
+                        conn.send(("page", page_num, page_text, page_engine))
+                    conn.send(("done",))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """Handle on one sandbox process"""
+
+    def __init__(self, context, startup_timeout: float = 60):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ps_process = psutil.Process(self.process.pid)
+        self.tasks = 0
+        self.loaded_token: Optional[str] = None
+
+        # Wait until the worker has imported the PDF engines, so no document pays for the startup
+        try:
+            ready = self.conn.poll(startup_timeout) and self.conn.recv() == ("ready",)
+        except EOFError:
+            ready = False
+        if not ready:
+            self.kill()
+            raise RuntimeError(f"PDF worker failed to start (exit code {self.process.exitcode})")
+
+    def rss(self) -> int:
+        try:
+            return self.ps_process.memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+            self.process.join(timeout=5)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class SandboxJob:
+    """
+    One document's extraction inside the sandbox
+
+    All calls for a job share one wall-clock time budget, charged only while at
+    least one of them holds a worker: time queued for a worker, spent starting
+    one, or between calls does not count against the document.
+    """
+
+    def __init__(self, sandbox: "PDFSandbox", engine: str, pdf_bytes: bytes, layout_path_threshold: int):
+        self.sandbox = sandbox
+        self.engine = engine
+        self.pdf_bytes = pdf_bytes
+        self.layout_path_threshold = layout_path_threshold
+        self.token = uuid.uuid4().hex
+        self._used = 0.0
+        self._active = 0
+        self._busy_since = 0.0
+        self._lock = threading.Lock()
+
+    def _begin(self) -> float:
+        """Start charging a call that now holds a worker; returns its deadline"""
+        with self._lock:
+            if self._active == 0:
+                self._busy_since = time.monotonic()
+            self._active += 1
+            return self._busy_since + self.sandbox.timeout - self._used
+
+    def _end(self):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._used += time.monotonic() - self._busy_since
+
+    def describe(self, queued_since: Optional[float] = None) -> Tuple[int, Dict[str, Any]]:
+        """
+        Return (page_count, metadata) for the document
+
+        Args:
+            queued_since: When the caller queued this call (monotonic), if earlier
+                than now; the wait counts towards the sandbox's queue timeout
+        """
+        worker = self.sandbox._acquire(queued_since)
+        deadline = self._begin()
+        healthy = False
+        try:
+            self._send(worker, ("describe",))
+            message = self.sandbox._wait_for_message(worker, deadline)
+            if message[0] == "error":
+                healthy = True
+                raise RuntimeError(message[1])
+            healthy = True
+            return message[1], message[2]
+        finally:
+            self._end()
+            self.sandbox._release(worker, healthy)
+
+    def extract(self, start: int, end: int,
+                on_page: Optional[Callable[[int, str], None]] = None,
+                queued_since: Optional[float] = None) -> Tuple[List[str], List[int], Dict[str, int]]:
+        """
+        Extract pages [start, end)
+
+        A page that runs past the per-page limit is skipped: its worker is killed
+        and a fresh one resumes at the next page.
+
+        Args:
+            start: First zero-based page
+            end: Page after the last one
+            on_page: Called with (page_num, page_text) as each page finishes
+            queued_since: When the caller queued this call (monotonic), if earlier than now
+
+        Returns:
+            Tuple of (page_texts, skipped 1-based page numbers, per-engine page counts)
+        """
+        page_texts: List[str] = []
+        skipped_pages: List[int] = []
+        page_engines = Counter()
+        page_num = start
+
+        while page_num < end:
+            worker = self.sandbox._acquire(queued_since)
+            queued_since = None
+            deadline = self._begin()
+            healthy = False
+            try:
+                self._send(worker, ("extract", page_num, end))
+                while page_num < end:
+                    page_deadline = time.monotonic() + self.sandbox.page_timeout
+                    message = self.sandbox._wait_for_message(worker, deadline, page_deadline)
+                    if message[0] == "error":
+                        healthy = True
+                        raise RuntimeError(message[1])
+                    _, _, page_text, page_engine = message
+                    page_texts.append(page_text)
+                    page_engines[page_engine] += 1
+                    if on_page is not None:
+                        on_page(page_num, page_text)
+                    page_num += 1
+                message = self.sandbox._wait_for_message(worker, deadline)
+                healthy = message[0] == "done"
+            except _PageTimeout:
+                self.sandbox.logger.warning(f"Page {page_num + 1} exceeded {self.sandbox.page_timeout}s, skipping it")
+                skipped_pages.append(page_num + 1)
+                page_texts.append("")
+                if on_page is not None:
+                    on_page(page_num, "")
+                page_num += 1
+            finally:
+                self._end()
+                self.sandbox._release(worker, healthy)
+
+        return page_texts, skipped_pages, dict(page_engines)
+
+    def _send(self, worker: _Worker, request: tuple):
+        kind = request[0]
+        source = None if worker.loaded_token == self.token else self.pdf_bytes
+        worker.conn.send((kind, self.token, source, self.engine, self.layout_path_threshold) + request[1:])
+        worker.loaded_token = self.token
+        worker.tasks += 1
+
+
+class PDFSandbox:
+    """
+    Pool of isolated PDF parsing processes with per-document limits
+
+    Each document gets a wall-clock time budget, charged while it holds a
+    worker, and every worker an RSS ceiling; breaking either kills the worker
+    and raises PDFSandboxLimitExceeded. A page that runs past the per-page
+    limit only costs that page. Waiting longer than ``queue_timeout`` for a
+    free worker raises PDFSandboxBusy without touching any worker. Killed
+    workers are replaced on demand, and healthy ones are recycled after
+    ``max_tasks_per_worker`` requests to bound slow leaks.
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 120, page_timeout: float = 20,
+                 max_rss_mb: int = 1024, max_tasks_per_worker: int = 50, poll_interval: float = 0.05,
+                 queue_timeout: float = 30):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.page_timeout = page_timeout
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+
+        # Spawned, not forked: the parent runs threads (executors, torch) that fork would not copy safely
+        self._context = multiprocessing.get_context("spawn")
+        self._slots = threading.Semaphore(self.max_workers)
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+
+    def job(self, engine: str, pdf_bytes: bytes, layout_path_threshold: int = 50) -> SandboxJob:
+        """Start a document job; its time budget is charged only while it holds a worker"""
+        return SandboxJob(self, engine, pdf_bytes, layout_path_threshold)
+
+    def _acquire(self, queued_since: Optional[float] = None) -> _Worker:
+        """
+        Take a worker slot, waiting at most ``queue_timeout`` since ``queued_since`` (default now)
+
+        Raises:
+            PDFSandboxBusy: If no worker became free in time
+        """
+        waited = 0.0 if queued_since is None else time.monotonic() - queued_since
+        if not self._slots.acquire(timeout=max(0.0, self.queue_timeout - waited)):
+            raise PDFSandboxBusy(f"No PDF worker became free within {self.queue_timeout}s, try again later")
+        try:
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+            return _Worker(self._context)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, worker: _Worker, healthy: bool):
+        try:
+            if not healthy:
+                worker.kill()
+            elif worker.tasks >= self.max_tasks_per_worker:
+                worker.stop()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+        finally:
+            self._slots.release()
+
+    def _wait_for_message(self, worker: _Worker, deadline: float, page_deadline: Optional[float] = None):
+        """
+        Wait for the worker's next message while enforcing the time and memory limits
+
+        A page that arrives after its page deadline counts as timed out, so the
+        per-page limit does not depend on the polling interval.
+        """
+        while True:
+            message = None
+            if worker.conn.poll(self.poll_interval):
+                try:
+                    message = worker.conn.recv()
+                except EOFError:
+                    raise RuntimeError(f"PDF worker exited unexpectedly (exit code {worker.process.exitcode})")
+
+            now = time.monotonic()
+            if now >= deadline:
+                raise PDFSandboxLimitExceeded(f"PDF extraction exceeded the {self.timeout}s time limit")
+            if worker.rss() > self.max_rss_bytes:
+                raise PDFSandboxLimitExceeded(
+                    f"PDF extraction exceeded the {self.max_rss_bytes // (1024 * 1024)} MB memory limit"
+                )
+            if page_deadline is not None and now >= page_deadline:
+                raise _PageTimeout()
+            if message is not None:
+                return message
+            if not worker.process.is_alive() and not worker.conn.poll():
+                raise RuntimeError(f"PDF worker exited unexpectedly (exit code {worker.process.exitcode})")
+
+    def shutdown(self):
+        """Stop all idle workers"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+def hash_stream(stream, chunk_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a binary stream's full contents, read in chunks
+
+    The stream position is restored to the start afterwards.
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache for processing results
+
+    Entries live in a bounded in-memory LRU tier backed by a directory of JSON
+    files. Disk writes go through a temporary file and an atomic rename, so
+    several uvicorn workers can share the same directory safely.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_items: int = 64,
+                 max_disk_bytes: int = 0, prune_interval: int = 64):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_interval = prune_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(namespace: str, content_hash: str, fingerprint: str) -> str:
+        """Combine a result namespace, content hash and configuration fingerprint"""
+        return hashlib.sha256(f"{namespace}:{content_hash}:{fingerprint}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a result, promoting disk hits into the memory tier"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+
+        with self._lock:
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a JSON-serialisable result in both tiers"""
+        with self._lock:
+            self._remember(key, value)
+            self.stats["writes"] += 1
+
+        self._write_disk(key, value)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and tier sizes"""
+        with self._lock:
+            return {
+                **self.stats,
+                "memory_items": len(self._memory),
+                "max_memory_items": self.max_memory_items,
+                "disk_enabled": bool(self.cache_dir)
+            }
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        """Insert into the memory tier, evicting least recently used entries (lock held)"""
+        if self.max_memory_items <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache_dir:
+            return None
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # Touch the entry so pruning evicts the least recently used files first
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Discarding unreadable cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, value: Dict[str, Any]):
+        if not self.cache_dir:
+            return
+        path = self._path_for(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.warning(f"Failed to write cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._writes_since_prune += 1
+            should_prune = self.max_disk_bytes > 0 and self._writes_since_prune >= self.prune_interval
+            if should_prune:
+                self._writes_since_prune = 0
+        if should_prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Delete least recently used files until the disk tier fits max_disk_bytes"""
+        if not self.cache_dir or self.max_disk_bytes <= 0:
+            return
+
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                total_bytes -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+
+def sentence_key(sentence: str) -> bytes:
+    """16-byte BLAKE2b digest identifying a sentence's exact text"""
+    return hashlib.blake2b(sentence.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class SentenceCache:
+    """
+    Bounded LRU of per-sentence results keyed by sentence hash
+
+    Lets repeated requests for an edited document reuse the work done for every
+    sentence that did not change. Safe to share between threads.
+    """
+
+    def __init__(self, max_items: int = 20000):
+        self.max_items = max_items
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_many(self, keys: Sequence[Hashable]) -> List[Optional[Any]]:
+        """Look up several keys at once; misses come back as None"""
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._items.get(key)
+                if value is None:
+                    self.stats["misses"] += 1
+                else:
+                    self._items.move_to_end(key)
+                    self.stats["hits"] += 1
+                values.append(value)
+        return values
+
+    def put_many(self, keys: Sequence[Hashable], values: Sequence[Any]):
+        """Store several results, evicting least recently used entries"""
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._items[key] = value
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and size"""
+        with self._lock:
+            return {**self.stats, "items": len(self._items), "max_items": self.max_items}
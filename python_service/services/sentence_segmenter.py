@@ -0,0 +1,111 @@
+import re
+from typing import Dict, List, Sequence
+
+SENTENCE_SEGMENTERS = ("punkt", "regex")
+
+# Lowercased words that end with a period without ending the sentence
+ABBREVIATIONS = frozenset("""
+    mr mrs ms dr prof sr jr st mt rev capt lt sgt hon gov pres sen
+    vs etc al approx dept eds inc ltd corp bros assn univ
+    jan feb apr jun jul aug sep sept oct nov dec tues thurs
+    e.g i.e cf viz a.m p.m u.s u.k u.n ph.d
+""".split())
+# Abbreviations that are also ordinary words, only taken as such before a number
+NUMBER_ABBREVIATIONS = frozenset("no nos vol vols pp p fig figs eq eqs ch sec art".split())
+
+# Closing quotes or brackets that stay with the sentence they end
+_CLOSERS = '["\'”’)\\]]*'
+
+
+def _boundary_pattern() -> "re.Pattern":
+    """
+    One regex matching every sentence end, so splitting is a single C-level scan
+
+    Abbreviations are excluded with fixed-width negative lookbehinds, one per
+    abbreviation length, so the rules stay inside the regex engine and only run
+    at terminal punctuation.
+    """
+    def lookbehind(words, suffix=""):
+        # Python lookbehinds must be fixed-width, so there is one per word length
+        by_length = {}
+        for word in sorted(words):
+            by_length.setdefault(len(word), []).append(re.escape(word))
+        return [rf"\b(?:{'|'.join(group)}){suffix}" for _, group in sorted(by_length.items())]
+    
+    not_abbreviation = "".join(f"(?<!{body})" for body in lookbehind(ABBREVIATIONS - {"etc"}, r"\."))
+    before_number = "|".join(f"(?<={body})" for body in lookbehind(NUMBER_ABBREVIATIONS, r"\."))
+    return re.compile(
+        # A run of terminal punctuation, starting with a plain character class so
+        # the regex engine can skip ahead to candidates
+        r"[.!?…]++(?:"
+        # ending a sentence if it contains "!" or "?"
+        r"(?<=[!?])|(?<=[!?][.…])"
+        # an ellipsis, unless the sentence carries on in lowercase
+        rf"|(?:(?<=\.\.)|(?<=…))(?!{_CLOSERS}\s+[a-z])"
+        # a lone period, except after an abbreviation or a single-letter initial ("J.")
+        rf"|(?<![.!?…]\.)(?<=\.)(?i:{not_abbreviation})(?<!\b[A-Z]\.)"
+        rf"(?!(?i:{before_number})\s+\d)(?!(?i:(?<=\betc\.))\s+[^\sA-Z])"
+        rf"){_CLOSERS}(?=\s)"
+    )
+
+
+_BOUNDARY = _boundary_pattern()
+
+
+def regex_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences with a compiled regex and a few punkt-like rules
+
+    A sentence ends at ".", "!", "?" or an ellipsis, plus any closing quotes or
+    brackets, when whitespace follows. A period does not end a sentence after a
+    known abbreviation (except "etc." before a capitalised word), a numbering
+    abbreviation such as "Fig." before a number, or a single-letter initial; an
+    ellipsis followed by a lowercase word does not end one either. Decimals and
+    dotted names never match because no whitespace follows their periods.
+
+    Returns sentences stripped of surrounding whitespace, like nltk's sent_tokenize.
+    """
+    ends = [match.end() for match in _BOUNDARY.finditer(text)]
+    starts = [0] + ends
+    ends.append(len(text))
+    return [sentence for sentence in (text[start:end].strip() for start, end in zip(starts, ends)) if sentence]
+
+
+def sentence_ends(text: str, sentences: Sequence[str]) -> List[int]:
+    """Character offset in ``text`` where each sentence ends"""
+    ends = []
+    cursor = 0
+    for sentence in sentences:
+        start = text.find(sentence, cursor)
+        if start == -1:
+            start = cursor
+        cursor = start + len(sentence)
+        ends.append(cursor)
+    return ends
+
+
+def boundary_agreement(text: str, reference: Sequence[str], candidate: Sequence[str]) -> Dict[str, float]:
+    """
+    Agreement of a candidate segmentation with a reference one
+
+    Compares the sentence boundaries (end offsets, excluding the end of the
+    text) of both segmentations of ``text``.
+
+    Returns:
+        Dictionary with boundary precision, recall and F1 of ``candidate``, and
+        the matched, reference and candidate boundary counts
+    """
+    reference_ends = set(sentence_ends(text, reference)[:-1])
+    candidate_ends = set(sentence_ends(text, candidate)[:-1])
+    matched = len(reference_ends & candidate_ends)
+    precision = matched / len(candidate_ends) if candidate_ends else 1.0
+    recall = matched / len(reference_ends) if reference_ends else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "matched": matched,
+        "reference": len(reference_ends),
+        "candidate": len(candidate_ends)
+    }
@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_cache import NPY_HEADER_SIZE, FileLock, npy_header
+from .similarity_search import top_k_similar
+
+
+def top_k_similarity_edges(matrix: np.ndarray, top_k: int = 10, threshold: float = 0.5,
+                           block_size: int = 1024) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sparse cosine-similarity graph: each row's top-k neighbours above a threshold
+
+    Neighbours come from top_k_similar with self-matches excluded, so memory
+    stays at block_size x n rather than n x n.
+
+    Args:
+        matrix: Embeddings of shape (n, dimension)
+        top_k: Neighbours kept per row
+        threshold: Minimum cosine similarity for an edge
+        block_size: Rows per matrix multiplication
+
+    Returns:
+        Tuple of (sources, targets, weights) with sources < targets; an edge is
+        kept if either endpoint has the other among its top-k
+    """
+    count = len(matrix)
+    if min(top_k, count - 1) <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    columns, values = top_k_similar(matrix, matrix, k=top_k, block_size=block_size, exclude_self=True)
+    rows, positions = np.nonzero(values >= threshold)
+    sources = rows
+    targets = columns[rows, positions]
+    weights = values[rows, positions]
+
+    # Each undirected edge once, oriented low -> high
+    low, high = np.minimum(sources, targets), np.maximum(sources, targets)
+    _, unique = np.unique(low * count + high, return_index=True)
+    return low[unique], high[unique], weights[unique]
+
+
+class DocumentSimilarityGraph:
+    """
+    Stored document embeddings and the cross-document similarity graph built from them
+
+    Embeddings persist append-only: vectors in ``<store_path>.npy`` and one line
+    per put or remove in ``<store_path>.log``, so storing a document costs O(1)
+    I/O however many are stored. Once replaced and removed rows outnumber the
+    live ones, both files are rewritten with only the live rows. Changes take a
+    file lock; other processes replay the log tail, or reload after a rewrite.
+    Graphs are cached per (top_k, threshold) until the document set changes.
+    """
+
+    REWRITE_MIN_ROWS = 64
+
+    def __init__(self, store_path: Optional[str] = None, block_size: int = 1024):
+        """
+        Args:
+            store_path: Path prefix of the store files; None keeps embeddings in memory only
+            block_size: Rows per matrix multiplication when building graphs
+        """
+        self.store_path = store_path
+        self.block_size = block_size
+        self.logger = logging.getLogger(__name__)
+
+        self._graphs: Dict[Tuple[int, float], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+        if self.store_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.store_path)), exist_ok=True)
+            with self._lock, self._file_lock():
+                self._sync()
+
+    def _reset(self):
+        """Forget all in-memory state, before replaying the log from the start"""
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._row_count = 0
+        self._version = 0
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+        self._graphs.clear()
+
+    def put(self, doc_id: str, vector: np.ndarray):
+        """Store or replace a document's embedding"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock, self._file_lock():
+            self._sync()
+            row = self._rows.get(doc_id)
+            if row is not None and np.array_equal(self._vectors[row], vector):
+                return
+            if self._row_count and vector.shape[0] != self._vectors.shape[1]:
+                raise ValueError(f"Expected a {self._vectors.shape[1]}-dimensional embedding, got {vector.shape[0]}")
+            self._append_vector(vector)
+            self._write({"op": "put", "doc_id": doc_id, "row": self._row_count - 1})
+
+    def remove(self, doc_id: str):
+        """Forget a document"""
+        with self._lock, self._file_lock():
+            self._sync()
+            if doc_id in self._rows:
+                self._write({"op": "remove", "doc_id": doc_id})
+
+    def get_graph(self, top_k: int = 10, threshold: float = 0.5) -> Dict[str, Any]:
+        """
+        Build (or reuse) the similarity graph over every stored document
+
+        Returns:
+            Dictionary with nodes, edges (source, target, weight) and counts;
+            ``cached`` tells whether the graph was reused
+        """
+        with self._lock:
+            with self._file_lock():
+                self._sync()
+            key = (top_k, threshold)
+            graph = self._graphs.get(key)
+            if graph is not None:
+                return {**graph, "cached": True}
+
+            sources, targets, weights = top_k_similarity_edges(self._matrix(), top_k, threshold, self.block_size)
+            graph = {
+                "nodes": [{"id": doc_id} for doc_id in self._ids],
+                "edges": [
+                    {"source": self._ids[source], "target": self._ids[target], "weight": round(float(weight), 4)}
+                    for source, target, weight in zip(sources.tolist(), targets.tolist(), weights.tolist())
+                ],
+                "total_documents": len(self._ids),
+                "total_edges": len(weights),
+                "version": self._version
+            }
+            self._graphs[key] = graph
+            return {**graph, "cached": False}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the number of stored documents and rows, and cached graphs"""
+        with self._lock:
+            with self._file_lock():
+                self._sync()
+            return {
+                "documents": len(self._ids),
+                "rows": self._row_count,
+                "version": self._version,
+                "cached_graphs": len(self._graphs),
+                "persistent": bool(self.store_path)
+            }
+
+    def _matrix(self) -> np.ndarray:
+        """Embeddings of the stored documents, in node order"""
+        rows = np.fromiter((self._rows[doc_id] for doc_id in self._ids), dtype=np.int64, count=len(self._ids))
+        return self._vectors[rows]
+
+    # Storage
+
+    def _append_vector(self, vector: np.ndarray):
+        """Append one row to the vectors, in memory and on disk (locks held)"""
+        row = self._row_count
+        if self.store_path:
+            with open(self._vectors_path(), "r+b") as f:
+                f.truncate(NPY_HEADER_SIZE + row * vector.shape[0] * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(vector, dtype="<f4").tobytes())
+                f.seek(0)
+                f.write(npy_header(row + 1, vector.shape[0]))
+        self._grow(vector.reshape(1, -1))
+
+    def _grow(self, vectors: np.ndarray):
+        """Add rows to the in-memory vectors, doubling capacity so appends stay amortised O(1)"""
+        needed = self._row_count + len(vectors)
+        if needed > len(self._vectors) or self._vectors.shape[1] != vectors.shape[1]:
+            grown = np.empty((max(needed, 2 * len(self._vectors)), vectors.shape[1]), dtype=np.float32)
+            if self._row_count:
+                grown[:self._row_count] = self._vectors[:self._row_count]
+            self._vectors = grown
+        self._vectors[self._row_count:needed] = vectors
+        self._row_count = needed
+
+    def _write(self, entry: Dict[str, Any]):
+        """Append an entry to the log (if persistent), apply it, and rewrite the store if mostly dead (locks held)"""
+        if self.store_path:
+            line = json.dumps(entry) + "\n"
+            with open(self._log_path(), "r+", encoding="utf-8") as f:
+                f.truncate(self._log_offset)  # drop a partial line from an interrupted write
+                f.seek(self._log_offset)
+                f.write(line)
+            self._log_offset += len(line.encode("utf-8"))
+        self._apply(entry)
+        if self._row_count >= self.REWRITE_MIN_ROWS and self._row_count > 2 * len(self._ids):
+            self._rewrite()
+
+    def _apply(self, entry: Dict[str, Any]):
+        op = entry["op"]
+        if op == "version":
+            self._version = entry["version"]
+            return
+        doc_id = entry["doc_id"]
+        if op == "put":
+            if doc_id not in self._rows:
+                self._positions[doc_id] = len(self._ids)
+                self._ids.append(doc_id)
+            self._rows[doc_id] = entry["row"]
+        elif op == "remove" and doc_id in self._rows:
+            del self._rows[doc_id]
+            del self._ids[self._positions.pop(doc_id)]
+            self._positions = {doc_id: position for position, doc_id in enumerate(self._ids)}
+        self._version += 1
+        self._graphs.clear()
+
+    def _sync(self):
+        """Replay log entries written since the last sync, reloading after a rewrite (locks held)"""
+        if not self.store_path:
+            return
+        log_path = self._log_path()
+        if not os.path.exists(log_path):
+            with open(self._vectors_path(), "wb"):
+                pass
+            open(log_path, "ab").close()
+        stat = os.stat(log_path)
+        if stat.st_ino != self._log_inode:
+            self._reset()
+            self._log_inode = stat.st_ino
+        if stat.st_size == self._log_offset:
+            return
+
+        entries = []
+        with open(log_path, "rb") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append(json.loads(line))
+                self._log_offset += len(line)
+        rows = max((entry["row"] + 1 for entry in entries if entry["op"] == "put"), default=0)
+        if rows > self._row_count:
+            stored = np.load(self._vectors_path(), mmap_mode="r")
+            self._grow(np.asarray(stored[self._row_count:rows], dtype=np.float32))
+        for entry in entries:
+            self._apply(entry)
+
+    def _rewrite(self):
+        """Replace the store with one holding only the live rows (locks held)"""
+        vectors = self._matrix()
+        version = self._version
+        ids = list(self._ids)
+        if self.store_path:
+            with open(f"{self._vectors_path()}.tmp", "wb") as f:
+                f.write(npy_header(len(vectors), vectors.shape[1]))
+                f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+            with open(f"{self._log_path()}.tmp", "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"op": "put", "doc_id": doc_id, "row": row}) + "\n"
+                                for row, doc_id in enumerate(ids)))
+                # Last, so replaying the rewritten log ends at the same version
+                f.write(json.dumps({"op": "version", "version": version}) + "\n")
+            os.replace(f"{self._vectors_path()}.tmp", self._vectors_path())
+            os.replace(f"{self._log_path()}.tmp", self._log_path())
+            self._sync()
+        else:
+            self._reset()
+            self._grow(vectors)
+            for row, doc_id in enumerate(ids):
+                self._apply({"op": "put", "doc_id": doc_id, "row": row})
+            self._apply({"op": "version", "version": version})
+        self.logger.info(f"Rewrote document embedding store with {len(ids)} live rows")
+
+    def _vectors_path(self) -> str:
+        return f"{self.store_path}.npy"
+
+    def _log_path(self) -> str:
+        return f"{self.store_path}.log"
+
+    def _file_lock(self):
+        if not self.store_path:
+            return _NullLock()
+        return FileLock(f"{self.store_path}.lock")
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
@@ -0,0 +1,62 @@
+import numpy as np
+from typing import Tuple
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise each row as a contiguous float32 array; zero rows stay zero"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2, order="C")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1)
+    return vectors
+
+
+def top_k_similar(queries: np.ndarray, corpus: np.ndarray, k: int = 10, normalized: bool = False,
+                  block_size: int = 1024, exclude_self: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cosine top-k of every query against a corpus
+
+    Each block of queries is scored against the whole corpus with one matrix
+    product, so memory stays at block_size x len(corpus).
+
+    Args:
+        queries: Array of shape (dimension,) for one query or (m, dimension)
+        corpus: Array of shape (n, dimension)
+        k: Matches returned per query (capped at n)
+        normalized: Skip normalisation when both inputs are already unit float32 rows
+        block_size: Queries scored per matrix product
+        exclude_self: The queries are the corpus itself; query i never matches
+            corpus row i, and k is capped at n - 1
+
+    Returns:
+        Tuple of (indices, scores), best first, of shape (k,) for a single query
+        or (m, k) otherwise
+    """
+    single = np.ndim(queries) == 1
+    if not normalized:
+        queries, corpus = normalize_rows(queries), normalize_rows(corpus)
+    else:
+        queries, corpus = np.atleast_2d(queries), np.atleast_2d(corpus)
+    if queries.shape[1] != corpus.shape[1]:
+        raise ValueError(f"Queries have dimension {queries.shape[1]} but the corpus has {corpus.shape[1]}")
+
+    if exclude_self and len(queries) != len(corpus):
+        raise ValueError("exclude_self requires the queries to be the corpus")
+    k = min(k, len(corpus) - 1 if exclude_self else len(corpus))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), block_size):
+        block = queries[start:start + block_size] @ corpus.T
+        if exclude_self:
+            block[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+        if k < block.shape[1]:
+            candidates = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+        candidate_scores = np.take_along_axis(block, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        indices[start:start + len(block)] = np.take_along_axis(candidates, order, axis=1)
+        scores[start:start + len(block)] = np.take_along_axis(candidate_scores, order, axis=1)
+
+    if single:
+        return indices[0], scores[0]
+    return indices, scores
@@ -1,18 +1,33 @@
 import re
 import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-from collections import Counter
-from typing import Dict, List, Tuple
+from nltk.tokenize import word_tokenize
+from typing import Dict, List, Optional, Tuple
 import logging
+import numpy as np
+
+from .analyzed_document import AnalyzedDocument, english_stopwords
+from .textrank import sentence_centrality, lexical_vectors
+from .token_budget import TokenEstimator
+from .sentence_cache import SentenceCache
 
 class TextCompressor:
     """
     Service for compressing text content to reduce API usage while preserving key information
     """
     
-    def __init__(self):
+    def __init__(self, cache_items: int = 0, segmenter: str = "punkt"):
+        """
+        Args:
+            cache_items: Sentences whose tokens and scores are kept between calls,
+                so recompressing an edited document only re-scores changed
+                sentences (0 disables the caches)
+            segmenter: Sentence segmenter for the documents this compressor
+                analyses, "punkt" or "regex"
+        """
         self.logger = logging.getLogger(__name__)
+        self.segmenter = segmenter
+        self.token_cache = SentenceCache(cache_items) if cache_items > 0 else None
+        self.score_cache = SentenceCache(cache_items) if cache_items > 0 else None
         self._ensure_nltk_data()
         
     def _ensure_nltk_data(self):
@@ -26,14 +41,23 @@ class TextCompressor:
         except LookupError:
             nltk.download('stopwords')
     
-    def compress_text(self, text: str, target_length: int = 2000, method: str = "smart") -> Dict[str, any]:
+    def analyze(self, text: str, document: Optional[AnalyzedDocument] = None) -> AnalyzedDocument:
+        """Analysis of ``text``, reusing ``document`` or cached sentence tokens where possible"""
+        return AnalyzedDocument.for_text(text, document, self.token_cache, self.segmenter)
+    
+    def compress_text(self, text: str, target_length: int = 2000, method: str = "smart",
+                      document: Optional[AnalyzedDocument] = None,
+                      sentence_vectors: Optional[np.ndarray] = None) -> Dict[str, any]:
         """
         Compress text to target length using specified method
         
         Args:
             text: Original text content
             target_length: Target length in characters
-            method: Compression method ("smart", "extractive", "keyword")
+            method: Compression method ("smart", "extractive", "keyword", "textrank")
+            document: Analysis of ``text`` shared with other services; built here if omitted
+            sentence_vectors: Embeddings of ``document.sentences`` for "textrank"; TF-IDF
+                vectors are used if omitted
             
         Returns:
             Dictionary with compressed text and metadata
@@ -48,25 +72,86 @@ class TextCompressor:
                 "preserved_elements": "full_text"
             }
         
+        if method not in ("smart", "extractive", "keyword", "textrank"):
+            raise ValueError(f"Unknown compression method: {method}")
+        
+        document = self.analyze(text, document)
         if method == "smart":
-            return self._smart_compression(text, target_length)
+            return self._smart_compression(text, target_length, document)
         elif method == "extractive":
-            return self._extractive_compression(text, target_length)
-        elif method == "keyword":
-            return self._keyword_compression(text, target_length)
+            return self._extractive_compression(text, target_length, document)
+        elif method == "textrank":
+            return self._textrank_compression(text, target_length, document, sentence_vectors)
         else:
-            raise ValueError(f"Unknown compression method: {method}")
+            return self._keyword_compression(text, target_length, document)
     
-    def _smart_compression(self, text: str, target_length: int) -> Dict[str, any]:
+    def compress_to_tokens(self, text: str, max_tokens: int, estimator: TokenEstimator, model: str,
+                           method: str = "smart", document: Optional[AnalyzedDocument] = None,
+                           sentence_vectors: Optional[np.ndarray] = None, max_attempts: int = 4) -> Dict[str, any]:
+        """
+        Compress text to fill, but not exceed, a model token budget
+        
+        The character target starts at the text's own characters-per-token density
+        and is rescaled by the estimated tokens of each attempt; the fullest attempt
+        within budget wins, and the last one is truncated if none fits.
+        
+        Args:
+            text: Original text content
+            max_tokens: Token budget for the compressed text
+            estimator: Token estimator calibrated for ``model``
+            model: Model whose tokens are counted
+            method: Compression method, as for compress_text
+            document: Analysis of ``text``; built once here if omitted
+            sentence_vectors: Sentence embeddings for "textrank"
+            max_attempts: Upper bound on compression passes
+            
+        Returns:
+            compress_text's dictionary plus target_tokens and estimated_tokens
+        """
+        target_length = estimator.characters_for(text, max_tokens, model)
+        if target_length < len(text):
+            # Analyse once for every attempt
+            document = self.analyze(text, document)
+        best, best_tokens = None, 0
+        for _ in range(max_attempts):
+            result = self.compress_text(text, target_length, method, document, sentence_vectors)
+            tokens = estimator.estimate(result["compressed_text"], model)
+            if tokens <= max_tokens and (best is None or tokens > best_tokens):
+                best, best_tokens = result, tokens
+            if result["method"] == "none" or 0.9 * max_tokens <= tokens <= max_tokens:
+                break
+            rescaled = int(target_length * max_tokens / max(tokens, 1))
+            if tokens > max_tokens:
+                rescaled = min(rescaled, target_length - 1)
+            rescaled = max(1, min(rescaled, len(text)))
+            if rescaled == target_length:
+                break
+            target_length = rescaled
+        
+        if best is None:
+            compressed_text = estimator.truncate(result["compressed_text"], max_tokens, model)
+            best = dict(result, compressed_text=compressed_text, compressed_length=len(compressed_text),
+                        compression_ratio=len(compressed_text) / len(text))
+            best_tokens = estimator.estimate(compressed_text, model)
+        
+        best["target_tokens"] = max_tokens
+        best["estimated_tokens"] = best_tokens
+        return best
+    
+    def _smart_compression(self, text: str, target_length: int,
+                           document: Optional[AnalyzedDocument] = None) -> Dict[str, any]:
         """
         Smart compression that combines multiple techniques
         """
+        document = self.analyze(text, document)
+        
         # Step 1: Extract key sentences
-        sentences = sent_tokenize(text)
-        key_sentences = self._extract_key_sentences(sentences, target_length // 2)
+        key_sentences = self._extract_key_sentences(
+            document.sentences, target_length // 2, self._score_sentences(document)
+        )
         
         # Step 2: Extract important keywords and entities
-        keywords = self._extract_keywords(text)
+        keywords = document.keywords()
         entities = self._extract_entities(text)
         
         # Step 3: Combine into compressed text
@@ -107,17 +192,15 @@ class TextCompressor:
             }
         }
     
-    def _extractive_compression(self, text: str, target_length: int) -> Dict[str, any]:
+    def _extractive_compression(self, text: str, target_length: int,
+                                document: Optional[AnalyzedDocument] = None) -> Dict[str, any]:
         """
         Extractive compression using sentence importance scoring
         """
-        sentences = sent_tokenize(text)
+        document = self.analyze(text, document)
         
         # Score sentences based on multiple factors
-        sentence_scores = []
-        for sentence in sentences:
-            score = self._calculate_sentence_score(sentence)
-            sentence_scores.append((sentence, score))
+        sentence_scores = list(zip(document.sentences, self._score_sentences(document)))
         
         # Sort by score and select top sentences
         sentence_scores.sort(key=lambda x: x[1], reverse=True)
@@ -143,11 +226,56 @@ class TextCompressor:
             "preserved_elements": f"{len(selected_sentences)}_key_sentences"
         }
     
-    def _keyword_compression(self, text: str, target_length: int) -> Dict[str, any]:
+    def _textrank_compression(self, text: str, target_length: int,
+                              document: Optional[AnalyzedDocument] = None,
+                              sentence_vectors: Optional[np.ndarray] = None) -> Dict[str, any]:
+        """
+        Extractive compression keeping the most central sentences, in document order
+        
+        Centrality is PageRank over a sentence-similarity graph built from
+        ``sentence_vectors`` (embeddings), or from TF-IDF vectors if none are given.
+        """
+        document = self.analyze(text, document)
+        sentences = document.sentences
+        if sentence_vectors is not None and len(sentence_vectors) != len(sentences):
+            raise ValueError("sentence_vectors must have one row per sentence")
+        vectors = sentence_vectors if sentence_vectors is not None else lexical_vectors(document)
+        
+        scores = sentence_centrality(vectors) if sentences else np.zeros(0)
+        ranked = sorted(range(len(sentences)), key=lambda index: (-scores[index], index))
+        
+        # Fill the budget with the highest-ranked sentences that still fit, counting joining spaces
+        selected = []
+        current_length = -1
+        for index in ranked:
+            if current_length + 1 + len(sentences[index]) <= target_length:
+                selected.append(index)
+                current_length += 1 + len(sentences[index])
+        
+        if selected:
+            compressed_text = " ".join(sentences[index] for index in sorted(selected))
+        else:
+            # Even the best sentence is over budget: keep its beginning
+            compressed_text = (sentences[ranked[0]] if sentences else text)[:target_length - 3] + "..."
+        
+        return {
+            "compressed_text": compressed_text,
+            "original_length": len(text),
+            "compressed_length": len(compressed_text),
+            "compression_ratio": len(compressed_text) / len(text),
+            "method": "textrank",
+            "preserved_elements": {
+                "key_sentences": len(selected),
+                "vectors": "embeddings" if sentence_vectors is not None else "tfidf"
+            }
+        }
+    
+    def _keyword_compression(self, text: str, target_length: int,
+                             document: Optional[AnalyzedDocument] = None) -> Dict[str, any]:
         """
         Keyword-based compression focusing on important terms and concepts
         """
-        keywords = self._extract_keywords(text)
+        keywords = self.analyze(text, document).keywords()
         entities = self._extract_entities(text)
         
         # Create keyword summary
@@ -173,16 +301,16 @@ class TextCompressor:
             "preserved_elements": f"{len(keywords)}_keywords_{len(entities)}_entities"
         }
     
-    def _extract_key_sentences(self, sentences: List[str], target_length: int) -> List[str]:
-        """Extract the most important sentences"""
+    def _extract_key_sentences(self, sentences: List[str], target_length: int,
+                               scores: Optional[List[float]] = None) -> List[str]:
+        """Extract the most important sentences, scoring them unless ``scores`` are given"""
         if not sentences:
             return []
         
         # Score sentences
-        sentence_scores = []
-        for sentence in sentences:
-            score = self._calculate_sentence_score(sentence)
-            sentence_scores.append((sentence, score))
+        if scores is None:
+            scores = [self._calculate_sentence_score(sentence) for sentence in sentences]
+        sentence_scores = list(zip(sentences, scores))
         
         # Sort by score and select top sentences
         sentence_scores.sort(key=lambda x: x[1], reverse=True)
@@ -199,8 +327,81 @@ class TextCompressor:
         
         return selected_sentences
     
+    def _score_sentences(self, document: AnalyzedDocument) -> List[float]:
+        """
+        Score every sentence of an analysed document
+        
+        A sentence's score depends only on its text, so with the score cache
+        enabled only sentences not scored before are computed.
+        """
+        if self.score_cache is None:
+            return self._score_sentence_arrays(document)
+        
+        keys = document.sentence_keys
+        scores = self.score_cache.get_many(keys)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            fresh = self._score_sentence_arrays(document, missing)
+            self.score_cache.put_many([keys[index] for index in missing], fresh)
+            for index, score in zip(missing, fresh):
+                scores[index] = score
+        return scores
+    
+    def _score_sentence_arrays(self, document: AnalyzedDocument,
+                               indices: Optional[List[int]] = None) -> List[float]:
+        """
+        Score sentences of an analysed document at once
+        
+        Computes the same features as ``_score_sentence_tokens`` as arrays over the
+        shared tokens, adding them in the same order so scores are bit-identical.
+        Regexes run once over the sentences joined by newlines, which keeps word
+        boundaries at sentence edges exactly as when matching each sentence alone.
+        
+        Args:
+            document: Analysed document
+            indices: Sentences to score, all of them if omitted
+        """
+        sentences = document.sentences if indices is None else [document.sentences[index] for index in indices]
+        count = len(sentences)
+        if not count:
+            return []
+        
+        # Length factor (prefer medium-length sentences)
+        lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=count)
+        scores = np.where((lengths >= 20) & (lengths <= 100), 2.0,
+                          np.where((lengths >= 10) & (lengths <= 150), 1.0, 0.0))
+        
+        # Keyword density
+        bounds = document.sentence_bounds
+        content = np.concatenate(([0], np.cumsum(document.content_mask, dtype=np.int64)))
+        content_counts = content[bounds[1:]] - content[bounds[:-1]]
+        word_counts = np.diff(bounds)
+        if indices is not None:
+            content_counts, word_counts = content_counts[indices], word_counts[indices]
+        density = content_counts / np.maximum(word_counts, 1)
+        scores = scores + np.where(word_counts > 0, density * 3.0, 0.0)
+        
+        joined = "\n".join(sentences)
+        starts = np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+        
+        # Presence of numbers (often important)
+        number_positions = [match.start() for match in re.finditer(r'\d+', joined)]
+        has_number = np.bincount(np.searchsorted(starts, number_positions, side="right") - 1, minlength=count) > 0
+        scores = scores + np.where(has_number, 1.0, 0.0)
+        
+        # Presence of capitalized words (proper nouns)
+        noun_positions = [match.start() for match in re.finditer(r'\b[A-Z][a-z]+\b', joined)]
+        proper_nouns = np.bincount(np.searchsorted(starts, noun_positions, side="right") - 1, minlength=count)
+        scores = scores + proper_nouns * 0.5
+        
+        return scores.tolist()
+    
     def _calculate_sentence_score(self, sentence: str) -> float:
         """Calculate importance score for a sentence"""
+        return self._score_sentence_tokens(sentence, word_tokenize(sentence.lower()))
+    
+    def _score_sentence_tokens(self, sentence: str, words: List[str]) -> float:
+        """Importance score of a sentence given its lowercase word tokens"""
         score = 0.0
         
         # Length factor (prefer medium-length sentences)
@@ -211,8 +412,7 @@ class TextCompressor:
             score += 1.0
         
         # Keyword density
-        words = word_tokenize(sentence.lower())
-        stop_words = set(stopwords.words('english'))
+        stop_words = english_stopwords()
         content_words = [w for w in words if w.isalnum() and w not in stop_words]
         
         if len(words) > 0:
@@ -230,23 +430,6 @@ class TextCompressor:
         # Position factor (first and last sentences are often important)
         return score
     
-    def _extract_keywords(self, text: str) -> List[str]:
-        """Extract important keywords from text"""
-        words = word_tokenize(text.lower())
-        stop_words = set(stopwords.words('english'))
-        
-        # Filter out stopwords and short words
-        content_words = [word for word in words 
-                        if word.isalnum() and 
-                        word not in stop_words and 
-                        len(word) > 3]
-        
-        # Get word frequencies
-        word_freq = Counter(content_words)
-        
-        # Return most frequent words
-        return [word for word, freq in word_freq.most_common(20)]
-    
     def _extract_entities(self, text: str) -> List[str]:
         """Extract named entities and important terms"""
         entities = []
@@ -0,0 +1,77 @@
+import numpy as np
+
+from .analyzed_document import AnalyzedDocument
+from .similarity_search import normalize_rows, top_k_similar
+
+
+def sentence_centrality(vectors: np.ndarray, damping: float = 0.85, neighbours: int = 32,
+                        tolerance: float = 1e-6, max_iterations: int = 100) -> np.ndarray:
+    """
+    TextRank scores of sentences from their vectors
+
+    Sentences are linked to their ``neighbours`` most similar sentences (cosine,
+    negatives dropped), in both directions, and PageRank runs by power iteration
+    over that sparse graph, so memory is O(n * neighbours) rather than O(n^2).
+
+    Args:
+        vectors: Array of shape (num_sentences, dimension)
+        damping: PageRank damping factor
+        neighbours: Edges kept per sentence
+        tolerance: Stop once the L1 change between iterations falls below this
+        max_iterations: Upper bound on power iterations
+
+    Returns:
+        float64 array of scores summing to 1
+    """
+    vectors = normalize_rows(vectors)
+    count = len(vectors)
+    if count <= 1:
+        return np.ones(count)
+
+    indices, scores = top_k_similar(vectors, vectors, k=min(neighbours, count - 1) + 1, normalized=True)
+    rows = np.repeat(np.arange(count), indices.shape[1])
+    cols = indices.reshape(-1)
+    weights = np.maximum(scores.reshape(-1), 0).astype(np.float64)
+    keep = (rows != cols) & (weights > 0)
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    # Similarity is symmetric, so every kNN edge is walked both ways
+    rows, cols = np.concatenate((rows, cols)), np.concatenate((cols, rows))
+    weights = np.concatenate((weights, weights))
+
+    out_weight = np.bincount(rows, weights=weights, minlength=count)
+    transition = weights / out_weight[rows] if len(rows) else weights
+    dangling = out_weight == 0
+
+    rank = np.full(count, 1.0 / count)
+    for _ in range(max_iterations):
+        spread = np.bincount(cols, weights=transition * rank[rows], minlength=count) + rank[dangling].sum() / count
+        updated = (1 - damping) / count + damping * spread
+        converged = np.abs(updated - rank).sum() < tolerance
+        rank = updated
+        if converged:
+            break
+    return rank
+
+
+def lexical_vectors(document: AnalyzedDocument, dimension: int = 512) -> np.ndarray:
+    """
+    TF-IDF sentence vectors over content words, for TextRank without embeddings
+
+    Terms are numbered in order of first appearance and folded into ``dimension``
+    buckets, so vectors are deterministic across processes.
+    """
+    count = len(document.sentences)
+    bounds = document.sentence_bounds
+    sentence_of_token = np.repeat(np.arange(count), np.diff(bounds))
+    term_ids = {}
+    buckets = np.fromiter(
+        (term_ids.setdefault(token, len(term_ids)) % dimension for token in document.tokens),
+        dtype=np.int64, count=len(document.tokens)
+    )
+    content = document.content_mask
+
+    counts = np.bincount(
+        sentence_of_token[content] * dimension + buckets[content], minlength=count * dimension
+    ).reshape(count, dimension)
+    document_frequency = (counts > 0).sum(axis=0)
+    return (counts * np.log((1 + count) / (1 + document_frequency))).astype(np.float32)
@@ -0,0 +1,80 @@
+import math
+import re
+import threading
+from typing import Dict, Optional
+
+# Pieces a BPE tokenizer rarely merges across: letter runs, digit groups, single symbols
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def raw_token_count(text: str) -> int:
+    """
+    Uncalibrated token count of ``text``
+
+    Letter runs count one token plus one per further 7 characters, digit groups
+    of up to three and every other non-space character count one each.
+    """
+    total = 0
+    for match in _TOKEN_PIECES.finditer(text):
+        length = match.end() - match.start()
+        total += 1 + (length - 1) // 7 if length > 1 and text[match.start()].isalpha() else 1
+    return total
+
+
+class TokenEstimator:
+    """
+    Local estimate of how many tokens a model counts for a text
+
+    The raw piece count is multiplied by a per-model scale, which moves towards
+    the ratio of reported to estimated prompt tokens every time a model's usage
+    is observed, so estimates track each model's tokenizer without loading it.
+    """
+
+    def __init__(self, scales: Optional[Dict[str, float]] = None, smoothing: float = 0.2):
+        """
+        Args:
+            scales: Initial tokens-per-raw-piece scale by model name (default 1.0)
+            smoothing: Weight of each observation in the running scale
+        """
+        self.scales = dict(scales or {})
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def scale(self, model: str) -> float:
+        return self.scales.get(model, 1.0)
+
+    def estimate(self, text: str, model: str) -> int:
+        """Estimated number of ``model`` tokens in ``text``"""
+        return math.ceil(raw_token_count(text) * self.scale(model))
+
+    def observe(self, model: str, text: str, tokens: int):
+        """
+        Calibrate ``model`` from a text whose true token count is known
+
+        Args:
+            model: Model that counted the tokens
+            text: Text sent to the model
+            tokens: Token count the model reported for it
+        """
+        raw = raw_token_count(text)
+        if raw <= 0 or tokens <= 0:
+            return
+        with self._lock:
+            current = self.scales.get(model)
+            ratio = tokens / raw
+            self.scales[model] = ratio if current is None else (1 - self.smoothing) * current + self.smoothing * ratio
+
+    def characters_for(self, text: str, tokens: int, model: str) -> int:
+        """Characters of ``text`` expected to hold ``tokens`` tokens, at its own density"""
+        estimated = self.estimate(text, model)
+        if estimated <= tokens:
+            return len(text)
+        return max(1, int(len(text) * tokens / estimated))
+
+    def truncate(self, text: str, tokens: int, model: str) -> str:
+        """Longest prefix of ``text``, cut on whitespace, estimated at no more than ``tokens`` tokens"""
+        while self.estimate(text, model) > tokens:
+            cut = self.characters_for(text, tokens, model)
+            space = text.rfind(" ", 0, cut)
+            text = text[:space if space > 0 else min(cut, len(text) - 1)].rstrip()
+        return text
@@ -0,0 +1,84 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# Character positions where a new sentence or paragraph begins
+SENTENCE_BREAK = re.compile(r'[.!?]["\')\]]*\s+|\n\s*\n')
+
+
+class TokenChunker:
+    """
+    Packs text into chunks of at most ``max_tokens`` model tokens
+
+    The document is tokenized once; chunks are slices of its token offsets, cut
+    at the last sentence break that keeps a chunk at least half full, otherwise
+    at the budget. Consecutive chunks share up to ``overlap_tokens`` tokens,
+    starting the overlap on a sentence break when one falls inside it.
+    """
+
+    def __init__(self, token_offsets: Callable[[str], Sequence[Tuple[int, int]]],
+                 max_tokens: int = 254, overlap_tokens: int = 32):
+        """
+        Args:
+            token_offsets: Returns the (start, end) character span of every token
+                in a text, without special tokens (a fast tokenizer's offset mapping)
+            max_tokens: Token budget per chunk, excluding special tokens
+            overlap_tokens: Tokens repeated at the start of the next chunk
+        """
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be between 0 and max_tokens - 1")
+        self.token_offsets = token_offsets
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk(self, text: str, sentence_starts: Optional[Sequence[int]] = None) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Split text into token-budgeted chunks
+
+        Args:
+            text: Text to split
+            sentence_starts: Character offsets where sentences begin, e.g. from an
+                AnalyzedDocument; found with a regex if omitted
+
+        Returns:
+            Tuple of (chunk texts, (start, end) character span of each chunk in ``text``)
+        """
+        offsets = [(start, end) for start, end in self.token_offsets(text) if end > start]
+        if not offsets:
+            return [], []
+
+        count = len(offsets)
+        token_starts = [start for start, _ in offsets]
+        if sentence_starts is None:
+            sentence_starts = [match.end() for match in SENTENCE_BREAK.finditer(text)]
+        # Token positions that begin a sentence, excluding the first token
+        breaks = sorted({
+            position
+            for position in (bisect_left(token_starts, start) for start in sentence_starts)
+            if 0 < position < count
+        })
+
+        chunks, spans = [], []
+        start = 0
+        while True:
+            end = min(start + self.max_tokens, count)
+            if end < count:
+                # Last sentence break keeping the chunk at least half full
+                position = bisect_right(breaks, end) - 1
+                if position >= 0 and breaks[position] - start >= self.max_tokens // 2:
+                    end = breaks[position]
+
+            span = (offsets[start][0], offsets[end - 1][1])
+            chunks.append(text[span[0]:span[1]])
+            spans.append(span)
+            if end >= count:
+                return chunks, spans
+
+            next_start = end - self.overlap_tokens
+            if self.overlap_tokens:
+                position = bisect_left(breaks, next_start)
+                if position < len(breaks) and breaks[position] < end:
+                    next_start = breaks[position]
+            start = max(next_start, start + 1)
@@ -0,0 +1,633 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from array import array
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+from .embedding_cache import NPY_HEADER_SIZE, npy_header, FileLock
+
+
+class VectorIndex:
+    """
+    Persistent IVF-flat index over chunk embeddings from every processed document
+
+    Vectors are L2-normalised, so scores are cosine similarities. Until the
+    index holds ``train_threshold`` vectors it is searched exactly; after that
+    spherical k-means centroids partition it into inverted lists, and a query
+    only scans the ``nprobe`` lists nearest to it. The centroids are retrained
+    whenever the index has grown ``retrain_growth`` times since the last training.
+
+    Training runs in a background thread on a snapshot of the vectors, outside
+    the index lock, so neither the add that made it due nor searches wait for
+    it; the new centroids are published with one log entry, and rows added
+    during training are assigned to them at that point.
+
+    On disk the index is append-only: vectors in a memory-mapped ``vectors.npy``,
+    chunk texts in ``texts.bin`` and every add, remove and training run in
+    ``log.jsonl``, which is replayed on startup. Writers take a file lock, and
+    each process replays the log tail before it reads, so uvicorn workers can
+    share one directory. Once removed rows make up more than
+    ``compact_dead_fraction`` of the index, it is compacted into a new epoch:
+    fresh ``vectors-<epoch>.npy`` and ``texts-<epoch>.bin`` files and a log
+    holding only the live documents, swapped in by replacing the log, which
+    other processes notice on their next sync.
+    """
+
+    TRAIN_POINTS_PER_LIST = 32
+    TRAIN_ITERATIONS = 8
+    COMPACT_MIN_ROWS = 1024
+
+    def __init__(self, index_dir: Optional[str] = None, nprobe: int = 8, train_threshold: int = 10000,
+                 retrain_growth: float = 4.0, max_train_samples: int = 100000,
+                 compact_dead_fraction: float = 0.5):
+        self.index_dir = index_dir
+        self.nprobe = max(1, nprobe)
+        self.train_threshold = max(1, train_threshold)
+        self.retrain_growth = retrain_growth
+        self.max_train_samples = max_train_samples
+        self.compact_dead_fraction = compact_dead_fraction
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.RLock()
+        self._train_lock = threading.Lock()
+        self._training: Optional[threading.Thread] = None
+        self._layout = 0
+        self._log_file = None
+        self._vectors_file = None
+        self._texts_file = None
+        self._reset()
+
+        if self.index_dir:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with self._file_lock():
+                open(self._path("log.jsonl"), "ab").close()
+                if os.path.getsize(self._path("log.jsonl")) == 0:
+                    for name in ("vectors.npy", "texts.bin"):
+                        open(self._path(name), "ab").close()
+                self._sync()
+
+    def _reset(self):
+        """Forget all in-memory state, before replaying a log from the start"""
+        self.epoch = 0
+        self.dimension: Optional[int] = None
+        self.row_count = 0
+        self.trained_rows = 0
+        self.generation = 0
+        self.centroids: Optional[np.ndarray] = None
+
+        # Per-row columns, like PageIndex
+        self._row_docs = array('i')
+        self._row_chunks = array('i')
+        self._row_lists = array('i')
+        self._text_starts = array('q')
+        self._text_ends = array('q')
+        self._alive = bytearray()
+
+        self._doc_names: List[str] = []
+        self._doc_numbers: Dict[str, int] = {}
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._text_length = 0
+        self._log_offset = 0
+        self._lists_dirty = True
+        self._list_order = np.empty(0, dtype=np.int64)
+        self._list_bounds = np.zeros(1, dtype=np.int64)
+
+        self._memory_vectors = np.empty((0, 0), dtype=np.float32)
+        self._memory_texts = bytearray()
+        self._view: Optional[np.memmap] = None
+        self._log_inode: Optional[int] = None
+        # Row numbers change on reset, which invalidates any training snapshot
+        self._layout += 1
+        for handle in (self._log_file, self._vectors_file, self._texts_file):
+            if handle is not None:
+                handle.close()
+        self._log_file = self._vectors_file = self._texts_file = None
+
+    # Public API
+
+    def add(self, doc_id: str, vectors: np.ndarray, texts: Sequence[str]):
+        """
+        Index a document's chunks, replacing any earlier version of the document
+
+        Args:
+            doc_id: Document identifier returned in search results
+            vectors: Chunk embeddings of shape (num_chunks, dimension)
+            texts: Chunk texts, one per vector
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) != len(vectors):
+            raise ValueError("Need exactly one text per vector")
+        digest = self._digest(vectors, texts)
+
+        with self._lock, self._file_lock():
+            self._sync()
+            existing = self._docs.get(doc_id)
+            if existing is not None and existing["digest"] == digest:
+                return
+            if existing is not None:
+                self._write({"op": "remove", "doc_id": doc_id})
+            if not len(vectors):
+                self._compact_if_needed()
+                return
+            if self.dimension is not None and vectors.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+
+            vectors = self._normalise(vectors)
+            encoded = [text.encode("utf-8") for text in texts]
+            lists = self._assign(vectors).tolist() if self.centroids is not None else None
+            self._append_data(vectors, b"".join(encoded))
+            self._write({
+                "op": "add",
+                "doc_id": doc_id,
+                "digest": digest,
+                "dimension": int(vectors.shape[1]),
+                "start": self.row_count,
+                "text_lengths": [len(text) for text in encoded],
+                "lists": lists
+            })
+            self._compact_if_needed()
+            snapshot = self._training_snapshot()
+
+        if snapshot is not None:
+            self._training = threading.Thread(target=self._train, args=(snapshot,),
+                                              name="vector-index-train", daemon=True)
+            self._training.start()
+
+    def remove(self, doc_id: str):
+        """Drop a document's chunks from search results"""
+        with self._lock, self._file_lock():
+            self._sync()
+            if doc_id in self._docs:
+                self._write({"op": "remove", "doc_id": doc_id})
+                self._compact_if_needed()
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks most similar to a query vector
+
+        Args:
+            query: Query embedding of shape (dimension,)
+            k: Number of results
+            nprobe: Inverted lists to scan (defaults to the index setting); ignored before training
+
+        Returns:
+            Up to k hits with doc_id, chunk_index, score and text, best first
+        """
+        with self._lock:
+            self._sync()
+            if self.row_count == 0:
+                return []
+            query = self._normalise(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+            if query.shape[0] != self.dimension:
+                raise ValueError(f"Expected a {self.dimension}-dimensional query, got {query.shape[0]}")
+
+            if self.centroids is None:
+                rows, scores = self._search_exact(query, k)
+            else:
+                rows, scores = self._search_lists(query, k, nprobe or self.nprobe)
+            return [self._hit(int(row), float(score)) for row, score in zip(rows, scores)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size and training state"""
+        with self._lock:
+            self._sync()
+            return {
+                "documents": len(self._docs),
+                "chunks": len(self._alive_rows()),
+                "rows": self.row_count,
+                "dimension": self.dimension,
+                "trained": self.centroids is not None,
+                "lists": 0 if self.centroids is None else len(self.centroids),
+                "nprobe": self.nprobe,
+                "epoch": self.epoch,
+                "training": self._training is not None and self._training.is_alive(),
+                "persistent": bool(self.index_dir)
+            }
+
+    def wait_for_training(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for a background training run, if one is in progress
+
+        Args:
+            timeout: Seconds to wait; None waits until it finishes
+
+        Returns:
+            True if no training run is left in progress
+        """
+        training = self._training
+        if training is None:
+            return True
+        training.join(timeout)
+        return not training.is_alive()
+
+    def shutdown(self):
+        """Let a training run in progress publish its result before the process exits"""
+        self.wait_for_training()
+
+    # Search
+
+    def _search_exact(self, query: np.ndarray, k: int, block_rows: int = 65536):
+        """Scan every live row in blocks, keeping a running top-k"""
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        vectors = self._vectors()
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, self.row_count, block_rows):
+            end = min(start + block_rows, self.row_count)
+            scores = vectors[start:end] @ query
+            rows = np.flatnonzero(alive[start:end])
+            best_rows = np.concatenate([best_rows, rows + start])
+            best_scores = np.concatenate([best_scores, scores[rows]])
+            best_rows, best_scores = self._top_k(best_rows, best_scores, k)
+        return best_rows, best_scores
+
+    def _search_lists(self, query: np.ndarray, k: int, nprobe: int):
+        """Scan only the rows in the inverted lists nearest to the query"""
+        self._build_lists()
+        probe = self._top_k(np.arange(len(self.centroids)), self.centroids @ query, nprobe)[0]
+        rows = np.concatenate([self._list_order[self._list_bounds[l]:self._list_bounds[l + 1]] for l in probe])
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # sequential access through the memory map
+        return self._top_k(rows, self._vectors()[rows] @ query, k)
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray, k: int):
+        """The k best (rows, scores), best first"""
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _build_lists(self):
+        """Group live rows by inverted list (row ids sorted by list, plus list boundaries)"""
+        if not self._lists_dirty:
+            return
+        lists = np.frombuffer(self._row_lists, dtype=np.int32)
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        rows = np.flatnonzero(alive & (lists >= 0))
+        order = np.argsort(lists[rows], kind="stable")
+        self._list_order = rows[order]
+        self._list_bounds = np.searchsorted(lists[self._list_order], np.arange(len(self.centroids) + 1))
+        self._lists_dirty = False
+
+    def _hit(self, row: int, score: float) -> Dict[str, Any]:
+        return {
+            "doc_id": self._doc_names[self._row_docs[row]],
+            "chunk_index": self._row_chunks[row],
+            "score": score,
+            "text": self._read_text(self._text_starts[row], self._text_ends[row])
+        }
+
+    # Training
+
+    def _training_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        Capture what a due training run needs, or None if training is not due (locks held)
+
+        Rows are only ever appended until the next reset, so the captured vector
+        view stays valid after the locks are released.
+        """
+        if self.centroids is None:
+            due = len(self._alive_rows()) >= self.train_threshold
+        else:
+            due = self.row_count >= self.trained_rows * self.retrain_growth
+        if not due or not self._train_lock.acquire(blocking=False):
+            return None  # not due, or another thread is already training
+        return {
+            "layout": self._layout,
+            "generation": self.generation,
+            "rows": self.row_count,
+            "alive_rows": self._alive_rows(),
+            "vectors": self._vectors()
+        }
+
+    def _train(self, snapshot: Dict[str, Any]):
+        """
+        Fit spherical k-means centroids on a sample of the snapshot's live rows and reassign every row
+
+        Runs in a background thread without the index lock, which is only taken
+        to publish the result. The result is dropped if the index was compacted,
+        reloaded or retrained (possibly by another process) in the meantime.
+        """
+        try:
+            alive_rows, vectors, rows = snapshot["alive_rows"], snapshot["vectors"], snapshot["rows"]
+            nlist = max(1, min(4096, int(4 * math.sqrt(len(alive_rows)))))
+            rng = np.random.default_rng(0)
+            sample_size = min(len(alive_rows), self.max_train_samples, nlist * self.TRAIN_POINTS_PER_LIST)
+            sample = np.sort(rng.choice(alive_rows, sample_size, replace=False))
+
+            centroids = self._spherical_kmeans(np.asarray(vectors[sample]), min(nlist, sample_size), rng)
+            assignments = np.empty(rows, dtype=np.int32)
+            for start in range(0, rows, 65536):
+                end = min(start + 65536, rows)
+                assignments[start:end] = np.argmax(vectors[start:end] @ centroids.T, axis=1)
+
+            with self._lock, self._file_lock():
+                self._sync()
+                if self._layout != snapshot["layout"] or self.generation != snapshot["generation"]:
+                    self.logger.info("Vector index changed during training, discarding the result")
+                    return
+                if self.row_count > rows:
+                    added = self._vectors()[rows:self.row_count] @ centroids.T
+                    assignments = np.concatenate([assignments, np.argmax(added, axis=1).astype(np.int32)])
+                self._publish_training(centroids, assignments)
+        except Exception as e:
+            self.logger.error(f"Vector index training failed: {e}")
+        finally:
+            self._train_lock.release()
+
+    def _publish_training(self, centroids: np.ndarray, assignments: np.ndarray):
+        """Store centroids and per-row assignments as the next generation (locks held)"""
+        generation = self.generation + 1
+        self._save_array(f"centroids-{generation}.npy", centroids)
+        self._save_array(f"assignments-{generation}.npy", assignments)
+        self._write({"op": "train", "generation": generation, "rows": len(assignments)},
+                    centroids=centroids, assignments=assignments)
+        for name in (f"centroids-{generation - 1}.npy", f"assignments-{generation - 1}.npy"):
+            if self.index_dir and os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self.logger.info(f"Trained vector index: {len(centroids)} lists over {len(assignments)} rows")
+
+    def _spherical_kmeans(self, sample: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+        """Lloyd iterations on the unit sphere; empty lists are re-seeded from random points"""
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.TRAIN_ITERATIONS):
+            labels = np.empty(len(sample), dtype=np.int64)
+            for start in range(0, len(sample), 16384):
+                labels[start:start + 16384] = np.argmax(sample[start:start + 16384] @ centroids.T, axis=1)
+            counts = np.bincount(labels, minlength=nlist)
+            filled = np.flatnonzero(counts)
+            starts = (np.cumsum(counts) - counts)[filled]
+            sums = sample[rng.choice(len(sample), nlist, replace=False)]  # re-seeds lists left empty
+            sums[filled] = np.add.reduceat(sample[np.argsort(labels, kind="stable")], starts)
+            centroids = self._normalise(sums)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    # Log and storage
+
+    def _write(self, entry: Dict[str, Any], **arrays):
+        """Append an entry to the log (if persistent) and apply it in memory (locks held)"""
+        if self.index_dir:
+            line = json.dumps(entry) + "\n"
+            with open(self._path("log.jsonl"), "r+", encoding="utf-8") as f:
+                f.truncate(self._log_offset)  # drop a partial line from an interrupted write
+                f.seek(self._log_offset)
+                f.write(line)
+            self._log_offset += len(line.encode("utf-8"))
+        self._apply(entry, **arrays)
+
+    def _sync(self):
+        """Replay log entries written since the last sync, possibly by another process"""
+        if not self.index_dir:
+            return
+        if self._log_file is None or os.stat(self._path("log.jsonl")).st_ino != self._log_inode:
+            # First load, or another process compacted the index into a new log
+            self._reload()
+            return
+        if os.fstat(self._log_file.fileno()).st_size == self._log_offset:
+            return
+        self._log_file.seek(self._log_offset)
+        for line in self._log_file:
+            if not line.endswith(b"\n"):
+                break
+            self._apply(json.loads(line))
+            self._log_offset += len(line)
+
+    def _reload(self, attempts: int = 5):
+        """
+        Replay the current log from the start, holding open the log and its epoch's data files
+
+        Open handles keep a consistent view even if another process compacts the
+        index meanwhile; a compaction that removes the data files between opening
+        the log and opening them is retried.
+        """
+        for attempt in range(attempts):
+            self._reset()
+            self._log_file = open(self._path("log.jsonl"), "rb")
+            self._log_inode = os.fstat(self._log_file.fileno()).st_ino
+            first = self._log_file.readline()
+            epoch = json.loads(first).get("epoch", 0) if first.endswith(b"\n") else 0
+            try:
+                self._vectors_file = open(self._path(self._data_name("vectors", epoch)), "rb")
+                self._texts_file = open(self._path(self._data_name("texts", epoch)), "rb")
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+                continue
+            self._log_file.seek(0)
+            self._sync()
+            return
+
+    def _apply(self, entry: Dict[str, Any], centroids: Optional[np.ndarray] = None,
+               assignments: Optional[np.ndarray] = None):
+        op = entry["op"]
+        if op == "epoch":
+            self.epoch = entry["epoch"]
+        elif op == "add":
+            self.dimension = entry["dimension"]
+            doc_number = self._doc_numbers.setdefault(entry["doc_id"], len(self._doc_names))
+            if doc_number == len(self._doc_names):
+                self._doc_names.append(entry["doc_id"])
+            count = len(entry["text_lengths"])
+            self._docs[entry["doc_id"]] = {"start": entry["start"], "count": count, "digest": entry["digest"]}
+            lists = entry["lists"] if entry["lists"] is not None else [-1] * count
+            for chunk_index, text_length in enumerate(entry["text_lengths"]):
+                self._row_docs.append(doc_number)
+                self._row_chunks.append(chunk_index)
+                self._row_lists.append(lists[chunk_index])
+                self._text_starts.append(self._text_length)
+                self._text_length += text_length
+                self._text_ends.append(self._text_length)
+                self._alive.append(1)
+            self.row_count += count
+        elif op == "remove":
+            doc = self._docs.pop(entry["doc_id"], None)
+            if doc is not None:
+                self._alive[doc["start"]:doc["start"] + doc["count"]] = bytes(doc["count"])
+        elif op == "train":
+            generation = entry["generation"]
+            if centroids is None:
+                try:
+                    centroids = np.load(self._path(f"centroids-{generation}.npy"))
+                    assignments = np.load(self._path(f"assignments-{generation}.npy"))
+                except FileNotFoundError:
+                    return  # superseded by a later training run, which removed these files
+            self.centroids = centroids
+            self._row_lists[:entry["rows"]] = array('i', assignments[:entry["rows"]].tobytes())
+            self.trained_rows = entry["rows"]
+            self.generation = generation
+        self._lists_dirty = True
+        self._view = None
+
+    def _append_data(self, vectors: np.ndarray, text_bytes: bytes):
+        """Append vectors and chunk text to storage (locks held)"""
+        if not self.index_dir:
+            # Grow by doubling so repeated adds stay amortised O(rows)
+            needed = self.row_count + len(vectors)
+            if needed > len(self._memory_vectors):
+                grown = np.empty((max(needed, 2 * len(self._memory_vectors)), vectors.shape[1]), dtype=np.float32)
+                if self.row_count:
+                    grown[:self.row_count] = self._memory_vectors[:self.row_count]
+                self._memory_vectors = grown
+            self._memory_vectors[self.row_count:needed] = vectors
+            self._memory_texts.extend(text_bytes)
+            return
+        row_bytes = vectors.shape[1] * 4
+        with open(self._path(self._data_name("vectors")), "r+b") as f:
+            f.truncate(NPY_HEADER_SIZE + self.row_count * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+            f.seek(0)
+            f.write(npy_header(self.row_count + len(vectors), vectors.shape[1]))
+        with open(self._path(self._data_name("texts")), "r+b") as f:
+            f.truncate(self._text_length)
+            f.seek(0, os.SEEK_END)
+            f.write(text_bytes)
+
+    def _vectors(self) -> np.ndarray:
+        if not self.index_dir:
+            return self._memory_vectors[:self.row_count]
+        if self._view is None:
+            self._view = np.memmap(self._vectors_file, dtype=np.float32, mode="r",
+                                   offset=NPY_HEADER_SIZE, shape=(self.row_count, self.dimension or 0))
+        return self._view
+
+    def _read_text(self, start: int, end: int) -> str:
+        return self._read_text_bytes(start, end).decode("utf-8")
+
+    def _read_text_bytes(self, start: int, end: int) -> bytes:
+        if not self.index_dir:
+            return bytes(self._memory_texts[start:end])
+        return os.pread(self._texts_file.fileno(), end - start, start)
+
+    # Compaction
+
+    def _compact_if_needed(self):
+        """Compact once removed rows make up more than compact_dead_fraction of the index (locks held)"""
+        dead = self.row_count - len(self._alive_rows())
+        if dead >= self.COMPACT_MIN_ROWS and dead > self.compact_dead_fraction * self.row_count:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the index with only live rows, as a new epoch (locks held)
+
+        Row assignments and centroids carry over as a new training generation,
+        so the compacted index needs no retraining.
+        """
+        epoch = self.epoch + 1
+        vectors = self._vectors()
+        docs = sorted(self._docs.items(), key=lambda item: item[1]["start"])
+        live_rows = np.concatenate([np.arange(doc["start"], doc["start"] + doc["count"]) for _, doc in docs]
+                                   or [np.empty(0, dtype=np.int64)])
+        dimension = self.dimension or 0
+
+        entries: List[Dict[str, Any]] = [{"op": "epoch", "epoch": epoch}]
+        text_parts = []
+        start = 0
+        for doc_id, doc in docs:
+            first, last = doc["start"], doc["start"] + doc["count"] - 1
+            text_parts.append(self._read_text_bytes(self._text_starts[first], self._text_ends[last]))
+            entries.append({
+                "op": "add",
+                "doc_id": doc_id,
+                "digest": doc["digest"],
+                "dimension": dimension,
+                "start": start,
+                "text_lengths": [self._text_ends[row] - self._text_starts[row] for row in range(first, last + 1)],
+                "lists": None
+            })
+            start += doc["count"]
+        texts = b"".join(text_parts)
+
+        centroids = self.centroids
+        assignments = None
+        if centroids is not None:
+            assignments = np.frombuffer(self._row_lists, dtype=np.int32)[live_rows].copy()
+            entries.append({"op": "train", "generation": self.generation + 1, "rows": len(live_rows)})
+
+        removed_rows = self.row_count - len(live_rows)
+        previous = (self._data_name("vectors"), self._data_name("texts"), self.generation)
+        if self.index_dir:
+            with open(self._path(self._data_name("vectors", epoch)), "wb") as f:
+                f.write(npy_header(len(live_rows), dimension))
+                for block in range(0, len(live_rows), 65536):
+                    f.write(np.ascontiguousarray(vectors[live_rows[block:block + 65536]], dtype="<f4").tobytes())
+            with open(self._path(self._data_name("texts", epoch)), "wb") as f:
+                f.write(texts)
+            if assignments is not None:
+                self._save_array(f"centroids-{self.generation + 1}.npy", centroids)
+                self._save_array(f"assignments-{self.generation + 1}.npy", assignments)
+            tmp_path = self._path("log.jsonl.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            os.replace(tmp_path, self._path("log.jsonl"))
+            self._reload()
+            # Other processes keep reading the old files through open handles until they sync
+            for name in (previous[0], previous[1], f"centroids-{previous[2]}.npy", f"assignments-{previous[2]}.npy"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+        else:
+            compacted = np.asarray(vectors[live_rows], dtype=np.float32).reshape(len(live_rows), dimension)
+            self._reset()
+            self._memory_vectors = compacted
+            self._memory_texts = bytearray(texts)
+            for entry in entries:
+                self._apply(entry, **({"centroids": centroids, "assignments": assignments}
+                                      if entry["op"] == "train" else {}))
+        self.logger.info(f"Compacted vector index: dropped {removed_rows} removed rows, kept {len(live_rows)}")
+
+    def _save_array(self, name: str, values: np.ndarray):
+        if not self.index_dir:
+            return
+        tmp_path = self._path(f"{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, values)
+        os.replace(tmp_path, self._path(name))
+
+    def _alive_rows(self) -> np.ndarray:
+        return np.flatnonzero(np.frombuffer(self._alive, dtype=np.uint8))
+
+    def _file_lock(self):
+        if not self.index_dir:
+            return _NullLock()
+        return FileLock(self._path("index.lock"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _data_name(self, kind: str, epoch: Optional[int] = None) -> str:
+        """File name of the vectors or texts of an epoch (default: the current one)"""
+        epoch = self.epoch if epoch is None else epoch
+        extension = "npy" if kind == "vectors" else "bin"
+        return f"{kind}.{extension}" if epoch == 0 else f"{kind}-{epoch}.{extension}"
+
+    @staticmethod
+    def _normalise(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+    @staticmethod
+    def _digest(vectors: np.ndarray, texts: Sequence[str]) -> str:
+        digest = hashlib.sha256(np.ascontiguousarray(vectors).tobytes())
+        for text in texts:
+            digest.update(text.encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
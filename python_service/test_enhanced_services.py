@@ -8,9 +8,45 @@ from typing import Dict, Any
 import requests
 
 from services.text_compressor import TextCompressor
+from services.analyzed_document import AnalyzedDocument
 from services.openrouter_service import OpenRouterService
 from services.enhanced_graph_builder import EnhancedGraphBuilder
+from services.graph_builder import GraphBuilder
+from services.graph_context import GraphContext
 from services.pdf_processor import PDFProcessor
+from services.pdf_sandbox import PDFSandbox, PDFSandboxBusy, PDFSandboxLimitExceeded
+from services.result_cache import ResultCache, hash_stream
+from services.embedding_batching import EmbeddingBatcher, encode_in_batches, length_sorted_batches
+from services.embedding_pooling import pool_embeddings
+from services.embedding_cache import EmbeddingCache
+from services.embedding_codec import encode_vectors, decode_vectors
+from services.vector_index import VectorIndex
+from services.similarity_graph import DocumentSimilarityGraph, top_k_similarity_edges
+from services.similarity_search import top_k_similar
+from services.token_chunker import TokenChunker
+from services.embedding_backends import check_equivalence, mean_pool_hidden_states
+from services.textrank import sentence_centrality
+from services.hierarchical_compressor import HierarchicalCompressor, iter_windows
+from services.token_budget import TokenEstimator, raw_token_count
+from services.sentence_segmenter import boundary_agreement, regex_sentences
+
+
+def make_test_pdf(page_lines):
+    """Build an in-memory PDF with one page per list of text lines"""
+    import io
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    for lines in page_lines:
+        y = 750
+        for line in lines:
+            pdf.drawString(72, y, line)
+            y -= 20
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
 
 class TestTextCompressor:
     """Test cases for TextCompressor service"""
@@ -68,13 +104,81 @@ class TestTextCompressor:
             self.compressor.compress_text(self.sample_text, target_length=100, method="invalid")
     
     def test_extract_keywords(self):
-        """Test keyword extraction"""
-        keywords = self.compressor._extract_keywords(self.sample_text)
+        """Test keyword extraction from the shared analysis"""
+        keywords = self.compressor.analyze(self.sample_text).keywords(20)
         
         assert isinstance(keywords, list)
         assert len(keywords) > 0
         assert all(isinstance(k, str) for k in keywords)
     
+    def test_analyzed_document_shared(self):
+        """Test that a shared AnalyzedDocument gives the same compression as tokenising per call"""
+        from nltk.tokenize import word_tokenize
+        document = AnalyzedDocument.analyze(self.sample_text)
+        
+        assert all(self.sample_text[start:end] == sentence
+                   for sentence, (start, end) in zip(document.sentences, document.sentence_spans))
+        assert document.sentence_tokens(2) == word_tokenize(document.sentences[2].lower())
+        for method in ("smart", "extractive", "keyword"):
+            shared = self.compressor.compress_text(self.sample_text, target_length=200, method=method, document=document)
+            assert shared == self.compressor.compress_text(self.sample_text, target_length=200, method=method)
+    
+    def test_vectorised_sentence_scores_match_heuristic(self):
+        """Test that batch sentence scores equal the per-sentence heuristic exactly"""
+        import re
+        import random
+        import numpy as np
+        random.seed(5)
+        words = "Alpha beta Gamma 42 delta the of is a to x1 Paris. , ( )".split()
+        sentences = [" ".join(random.choice(words) for _ in range(random.randint(0, 40))) + "." for _ in range(500)]
+        tokens, bounds = [], [0]
+        for sentence in sentences:
+            tokens.extend(re.findall(r"\w+|[^\w\s]", sentence.lower()))
+            bounds.append(len(tokens))
+        
+        with patch("services.analyzed_document.english_stopwords", return_value=frozenset({"the", "of", "is", "a", "to"})), \
+             patch("services.text_compressor.english_stopwords", return_value=frozenset({"the", "of", "is", "a", "to"})):
+            document = AnalyzedDocument(" ".join(sentences), sentences, [], tokens, np.asarray(bounds))
+            expected = [self.compressor._score_sentence_tokens(sentence, document.sentence_tokens(index))
+                        for index, sentence in enumerate(sentences)]
+            assert self.compressor._score_sentences(document) == expected
+    
+    def test_edit_rescores_only_changed_sentences(self):
+        """Test that the sentence caches make an edited document re-tokenise and re-score only what changed"""
+        import re
+        sentences = [f"Sentence {number} covers Topic {number % 9} for the report." for number in range(200)]
+        edited = list(sentences)
+        edited[100] = "This sentence was edited in the Editor."
+        word_tokenize = Mock(side_effect=lambda sentence: re.findall(r"\w+|[^\w\s]", sentence))
+        
+        with patch("services.analyzed_document.sent_tokenize", side_effect=lambda text: re.split(r"(?<=\.) ", text)), \
+             patch("services.analyzed_document.word_tokenize", word_tokenize), \
+             patch("services.analyzed_document.english_stopwords", return_value=frozenset({"the", "for", "in"})):
+            compressor = TextCompressor(cache_items=1000)
+            compressor.compress_text(" ".join(sentences), target_length=500, method="extractive")
+            word_tokenize.reset_mock()
+            incremental = compressor.compress_text(" ".join(edited), target_length=500, method="extractive")
+            
+            assert word_tokenize.call_count == 1
+            assert compressor.score_cache.get_stats()["misses"] == 201
+            assert incremental == TextCompressor().compress_text(" ".join(edited), target_length=500, method="extractive")
+    
+    def test_textrank_compression(self):
+        """Test that TextRank keeps the most central sentences within budget, in document order"""
+        import numpy as np
+        sentences = ["Cats purr.", "Dogs bark loudly.", "Cats and dogs are pets.", "Stocks fell today."]
+        text = " ".join(sentences)
+        vectors = np.array([[1, 0, 0.2], [0, 1, 0.2], [0.7, 0.7, 0.3], [0, 0, 1]], dtype=np.float32)
+        with patch("services.analyzed_document.english_stopwords", return_value=frozenset()):
+            document = AnalyzedDocument(text, sentences, [], [], np.zeros(len(sentences) + 1, dtype=np.int64))
+        
+        result = self.compressor.compress_text(text, target_length=45, method="textrank",
+                                               document=document, sentence_vectors=vectors)
+        
+        assert result["compressed_text"] == "Cats purr. Cats and dogs are pets."
+        assert result["compressed_length"] <= 45 and result["method"] == "textrank"
+        assert result["preserved_elements"] == {"key_sentences": 2, "vectors": "embeddings"}
+    
     def test_extract_entities(self):
         """Test entity extraction"""
         entities = self.compressor._extract_entities(self.sample_text)
@@ -193,6 +297,7 @@ class TestEnhancedGraphBuilder:
     
     def setup_method(self):
         self.builder = EnhancedGraphBuilder(use_openrouter=False, compression_target=1000)
+        self.context = GraphContext()
         self.sample_text = """
         Artificial Intelligence (AI) is transforming the world. Machine Learning algorithms 
         are being used in various applications. Deep Learning models have achieved remarkable 
@@ -230,7 +335,7 @@ class TestEnhancedGraphBuilder:
     @pytest.mark.asyncio
     async def test_generate_traditional_graph(self):
         """Test traditional graph generation"""
-        result = await self.builder._generate_traditional_graph(self.sample_text, self.sample_metadata)
+        result = await self.builder._generate_traditional_graph(self.context, self.sample_text, self.sample_metadata)
         
         assert "entities" in result
         assert "relationships" in result
@@ -256,10 +361,10 @@ class TestEnhancedGraphBuilder:
     
     def test_add_document_node(self):
         """Test document node addition"""
-        node_id = self.builder._add_document_node(self.sample_metadata)
+        node_id = self.builder._add_document_node(self.context, self.sample_metadata)
         
-        assert node_id in self.builder.graph.nodes()
-        node_data = self.builder.graph.nodes[node_id]
+        assert node_id in self.context.graph.nodes()
+        node_data = self.context.graph.nodes[node_id]
         assert node_data["type"] == "document"
         assert node_data["title"] == "AI Overview"
     
@@ -272,21 +377,37 @@ class TestEnhancedGraphBuilder:
             "dates": []
         }
         
-        entity_nodes = self.builder._add_entity_nodes(entities)
+        entity_nodes = self.builder._add_entity_nodes(self.context, entities)
         
         assert "concepts" in entity_nodes
         assert "keywords" in entity_nodes
         assert len(entity_nodes["concepts"]) == 2
         assert len(entity_nodes["keywords"]) == 2
     
+    def test_annotate_source_pages(self):
+        """Test that entity nodes cite the pages their label appears on"""
+        from services.page_index import PageIndex
+        text = "Machine Learning intro. Deep Learning basics. More machine learning."
+        index = PageIndex()
+        index.add(1, 0, 23)
+        index.add(2, 24, 45)
+        index.add(3, 46, len(text))
+        
+        self.builder._add_document_node(self.context, self.sample_metadata)
+        self.builder._add_entity_nodes(self.context, {"concepts": ["Machine Learning", "Deep Learning"], "keywords": []})
+        self.builder._annotate_source_pages(self.context, text, index)
+        
+        pages = {data["label"]: data.get("pages") for _, data in self.context.graph.nodes(data=True) if "label" in data}
+        assert pages == {"Machine Learning": [1, 3], "Deep Learning": [2]}
+    
     def test_analyze_graph(self):
         """Test graph analysis"""
         # Add some nodes and edges first
-        self.builder._add_document_node(self.sample_metadata)
+        self.builder._add_document_node(self.context, self.sample_metadata)
         entities = {"concepts": ["AI"], "keywords": ["algorithm"]}
-        entity_nodes = self.builder._add_entity_nodes(entities)
+        entity_nodes = self.builder._add_entity_nodes(self.context, entities)
         
-        analysis = self.builder._analyze_graph()
+        analysis = self.builder._analyze_graph(self.context)
         
         assert "total_nodes" in analysis
         assert "total_edges" in analysis
@@ -296,11 +417,11 @@ class TestEnhancedGraphBuilder:
     def test_serialize_graph(self):
         """Test graph serialization"""
         # Add some nodes and edges first
-        self.builder._add_document_node(self.sample_metadata)
+        self.builder._add_document_node(self.context, self.sample_metadata)
         entities = {"concepts": ["AI"], "keywords": ["algorithm"]}
-        self.builder._add_entity_nodes(entities)
+        self.builder._add_entity_nodes(self.context, entities)
         
-        graph_data = self.builder._serialize_graph()
+        graph_data = self.builder._serialize_graph(self.context)
         
         assert "nodes" in graph_data
         assert "edges" in graph_data
@@ -345,6 +466,953 @@ class TestEnhancedGraphBuilder:
         assert "ai_used" in result
         assert result["ai_used"] is True
         mock_openrouter.generate_graph_from_text.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_build_graph_reports_ai_fallback(self):
+        """Test that a failed AI call is reported as a fallback, not as AI use"""
+        from unittest.mock import AsyncMock
+        builder = EnhancedGraphBuilder(use_openrouter=True, compression_target=1000)
+        builder.openrouter_service = Mock()
+        builder.openrouter_service.generate_graph_from_text.side_effect = Exception("429 rate limited")
+        builder._generate_traditional_graph = AsyncMock(return_value={"entities": [], "relationships": []})
+        
+        result = await builder.build_graph(self.sample_text, self.sample_metadata)
+        
+        assert result["ai_used"] is False and result["ai_fallback"] is True
+        builder._generate_traditional_graph.assert_awaited_once()
+
+
+class TestGraphBuilderConcurrency:
+    """Concurrent builds on one shared builder must stay isolated"""
+    
+    TITLES = [f"Doc{i}" for i in range(16)]
+    
+    @staticmethod
+    def _ai_graph(text, metadata):
+        """Fake AI response naming only the requesting document's topics"""
+        import time
+        time.sleep(0.01)  # let other builds run between graph setup and node insertion
+        title = metadata["title"]
+        return {
+            "graph_data": {
+                "nodes": [{"id": f"{title}_{i}", "label": f"{title} topic {i}", "type": "concept",
+                           "importance": "high"} for i in range(5)],
+                "edges": [{"source": f"{title}_0", "target": f"{title}_{i}", "label": "related"} for i in range(1, 5)]
+            },
+            "analysis": {},
+            "metadata": {}
+        }
+    
+    @staticmethod
+    def _graph_of(result):
+        graph_data = result["graph_data"]
+        nodes = sorted((node["id"], node.get("label", node.get("name"))) for node in graph_data["nodes"])
+        edges = sorted(tuple(sorted((edge["source"], edge["target"]))) for edge in graph_data["edges"])
+        return nodes, edges
+    
+    def _build_in_threads(self, builder, jobs):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return list(executor.map(lambda job: asyncio.run(builder.build_graph(*job)), jobs))
+    
+    def test_enhanced_builder_threads_isolated(self):
+        """Interleaved AI builds each get exactly their own nodes, as when run alone"""
+        builder = EnhancedGraphBuilder(use_openrouter=True, compression_target=1000)
+        builder.openrouter_service = Mock()
+        builder.openrouter_service.generate_graph_from_text.side_effect = self._ai_graph
+        jobs = [(f"{title} discusses its topics.", {"title": title}) for title in self.TITLES]
+        
+        expected = [self._graph_of(asyncio.run(builder.build_graph(*job))) for job in jobs]
+        results = self._build_in_threads(builder, jobs)
+        
+        for title, result, graph in zip(self.TITLES, results, expected):
+            assert self._graph_of(result) == graph
+            assert result["total_nodes"] == 6 and result["total_edges"] == 9
+            labels = [node["label"] for node in result["graph_data"]["nodes"] if node["type"] != "document"]
+            assert all(label.startswith(f"{title} ") for label in labels)
+    
+    def test_graph_builder_threads_isolated(self):
+        """Concurrent heuristic builds match their sequential results"""
+        builder = GraphBuilder()
+        jobs = [(f"{title} uses Python. {title} and Rust", {"title": title}) for title in self.TITLES]
+        
+        expected = [self._graph_of(asyncio.run(builder.build_graph(*job))) for job in jobs]
+        results = self._build_in_threads(builder, jobs)
+        
+        assert [self._graph_of(result) for result in results] == expected
+    
+    def test_graph_builder_uses_compressor_segmenter(self):
+        """The heuristic builder analyses text with its compressor's segmenter"""
+        builder = GraphBuilder(text_compressor=TextCompressor(segmenter="regex"))
+        text = "Python is a language. Rust is a language. Python uses Rust. " * 3
+        
+        with patch("services.analyzed_document.sent_tokenize", side_effect=AssertionError("punkt used")), \
+                patch("services.analyzed_document.word_tokenize", side_effect=str.split), \
+                patch("services.analyzed_document.english_stopwords", return_value=frozenset({"is", "a"})):
+            sentences = builder.text_compressor.analyze(text).sentences
+            builder._extract_relationships(text)
+        
+        assert sentences == regex_sentences(text)
+
+
+class TestPDFProcessor:
+    """Test cases for PDFProcessor"""
+    
+    def setup_method(self):
+        self.pdf_bytes = make_test_pdf([
+            [f"Page {n} covers Machine Learning topic {n}.", f"Second line of page {n}."]
+            for n in range(1, 8)
+        ] + [[]])
+    
+    @pytest.mark.asyncio
+    async def test_process_pdf_sequential(self):
+        """Test sequential text extraction"""
+        import io
+        processor = PDFProcessor()
+        text, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+        
+        assert "Page 1 covers Machine Learning topic 1." in text
+        assert "--- Page" not in text
+        assert metadata["total_pages"] == 8
+        assert metadata["processing_method"] == "pdfplumber"
+    
+    @pytest.mark.asyncio
+    async def test_process_pdf_parallel_matches_sequential(self):
+        """Test that page-sharded extraction returns the same text as the sequential path"""
+        import io
+        sequential = PDFProcessor()
+        parallel = PDFProcessor(max_workers=2, pages_per_shard=3, parallel_min_pages=2)
+        try:
+            expected = await sequential.process_pdf(io.BytesIO(self.pdf_bytes))
+            result = await parallel.process_pdf(io.BytesIO(self.pdf_bytes))
+        finally:
+            parallel.shutdown()
+        
+        assert result == expected
+    
+    @pytest.mark.asyncio
+    async def test_process_pdf_engines_agree(self):
+        """Test that every engine extracts the same words from a plain text-layer PDF"""
+        import io
+        texts = {}
+        for engine in ("pdfium", "pdfplumber", "pypdf2", "auto"):
+            processor = PDFProcessor(engine=engine)
+            text, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+            assert metadata["processing_method"] == engine
+            texts[engine] = text.split()
+        
+        assert texts["pdfium"] == texts["pdfplumber"] == texts["pypdf2"] == texts["auto"]
+    
+    @pytest.mark.asyncio
+    async def test_auto_engine_prefers_pdfium_for_text_pages(self):
+        """Test that auto mode routes plain text pages to PDFium"""
+        import io
+        processor = PDFProcessor(engine="auto")
+        _, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+        
+        assert metadata["page_engines"] == {"pdfium": 8}
+    
+    def test_auto_engine_uses_pdfplumber_for_layout_pages(self):
+        """Test that pages dominated by vector paths go to pdfplumber"""
+        import io
+        from reportlab.pdfgen import canvas
+        from services.pdf_engines import open_document
+        
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer)
+        for row in range(10):
+            pdf.line(72, 700 - row * 20, 400, 700 - row * 20)
+            pdf.drawString(80, 705 - row * 20, f"Row {row}")
+        pdf.save()
+        
+        with open_document("auto", io.BytesIO(buffer.getvalue()), layout_path_threshold=5) as document:
+            text, engine = document.extract_page(0)
+        
+        assert engine == "pdfplumber"
+        assert "Row 9" in text
+    
+    @pytest.mark.asyncio
+    async def test_process_pdf_from_mmap(self, tmp_path):
+        """Test extraction from a memory-mapped upload with more than one engine reading it"""
+        import io
+        import mmap
+        path = tmp_path / "upload.pdf"
+        path.write_bytes(self.pdf_bytes)
+        expected = await PDFProcessor(engine="auto").process_pdf(io.BytesIO(self.pdf_bytes))
+        
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            result = await PDFProcessor(engine="auto").process_pdf(mapped)
+            # Engines must release their views so the map can be closed
+            mapped.close()
+        
+        assert result == expected
+    
+    @pytest.mark.asyncio
+    async def test_iter_pages_offsets_match_full_text(self):
+        """Test that streamed page records line up with the full extracted text"""
+        import io
+        for processor in (PDFProcessor(), PDFProcessor(max_workers=2, pages_per_shard=3, parallel_min_pages=2)):
+            try:
+                text, _ = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+                records = [record async for record in processor.iter_pages(io.BytesIO(self.pdf_bytes))]
+            finally:
+                processor.shutdown()
+            
+            assert [record["page"] for record in records] == list(range(1, 9))
+            for record in records:
+                offset = record["char_offset"]
+                assert text[offset:offset + len(record["text"])] == record["text"]
+            assert records[-1]["text"] == ""
+    
+    def test_page_text_assembler_matches_clean_text(self):
+        """Test that incremental assembly reproduces marker-joined cleaning exactly"""
+        from services.pdf_processor import PageTextAssembler
+        pages = ["  First\n page\ttext ", "", "   \n", "Third --- Page 9 --- page", "\nLast  line\n"]
+        
+        joined = "".join(f"\n--- Page {n + 1} ---\n{page}\n" for n, page in enumerate(pages) if page)
+        assembler = PageTextAssembler()
+        records = [assembler.add_page(page) for page in pages]
+        
+        text = assembler.get_text()
+        assert text == PDFProcessor()._clean_text(joined)
+        for offset, page_text in records:
+            assert text[offset:offset + len(page_text)] == page_text
+    
+    @pytest.mark.asyncio
+    async def test_page_index_and_page_range(self):
+        """Test that extracted text carries a page index and page ranges skip other pages"""
+        import io
+        from services.page_index import PageIndex
+        processor = PDFProcessor()
+        text, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+        index = PageIndex.from_dict(metadata["page_index"])
+        
+        assert len(index) == 7
+        assert index.page_for_offset(text.index("topic 3.")) == 3
+        assert index.pages_for_span(text.index("topic 2."), text.index("topic 4.")) == [2, 3, 4]
+        
+        partial, partial_metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes), page_range=(3, 4))
+        partial_index = PageIndex.from_dict(partial_metadata["page_index"])
+        
+        assert "topic 3." in partial and "topic 4." in partial
+        assert "topic 2." not in partial and "topic 5." not in partial
+        assert partial_metadata["page_range"] == [3, 4]
+        assert partial_index.pages.tolist() == [3, 4]
+        assert partial_index.page_for_offset(partial.index("topic 4.")) == 4
+    
+    @pytest.mark.asyncio
+    async def test_invalid_page_range(self):
+        """Test that reversed page ranges are rejected"""
+        import io
+        with pytest.raises(ValueError, match="Invalid page range"):
+            await PDFProcessor().process_pdf(io.BytesIO(self.pdf_bytes), page_range=(4, 2))
+    
+    def test_unknown_engine(self):
+        """Test opening a document with an unknown engine"""
+        import io
+        from services.pdf_engines import open_document
+        
+        with pytest.raises(ValueError, match="Unknown PDF engine"):
+            open_document("invalid", io.BytesIO(self.pdf_bytes))
+
+
+class TestPDFSandbox:
+    """Test cases for sandboxed PDF extraction"""
+    
+    def setup_method(self):
+        self.pdf_bytes = make_test_pdf([[f"Sandboxed page {n}."] for n in range(1, 5)])
+    
+    @pytest.mark.asyncio
+    async def test_sandboxed_matches_in_process(self):
+        """Test that sandboxed extraction, sharded or not, returns the in-process result"""
+        import io
+        sandbox = PDFSandbox(max_workers=2)
+        try:
+            expected_text, expected_metadata = await PDFProcessor(engine="auto").process_pdf(io.BytesIO(self.pdf_bytes))
+            for processor in (PDFProcessor(engine="auto", sandbox=sandbox),
+                              PDFProcessor(engine="auto", max_workers=2, pages_per_shard=1,
+                                           parallel_min_pages=2, sandbox=sandbox)):
+                text, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes))
+                assert text == expected_text
+                assert metadata["page_index"] == expected_metadata["page_index"]
+                assert metadata["page_engines"] == expected_metadata["page_engines"]
+                assert metadata["partial"] is False
+            
+            pages = [page async for page in PDFProcessor(engine="auto", sandbox=sandbox).iter_pages(io.BytesIO(self.pdf_bytes))]
+            assert [page["page"] for page in pages] == [1, 2, 3, 4]
+            assert pages[2]["text"] == "Sandboxed page 3."
+        finally:
+            sandbox.shutdown()
+    
+    @pytest.mark.asyncio
+    async def test_page_timeout_returns_partial_text(self):
+        """Test that pages past the per-page limit are skipped instead of failing the document"""
+        import io
+        sandbox = PDFSandbox(max_workers=1, page_timeout=1e-6)
+        try:
+            processor = PDFProcessor(sandbox=sandbox)
+            text, metadata = await processor.process_pdf(io.BytesIO(self.pdf_bytes), page_range=(1, 2))
+        finally:
+            sandbox.shutdown()
+        
+        assert text == ""
+        assert metadata["skipped_pages"] == [1, 2]
+        assert metadata["partial"] is True
+    
+    @pytest.mark.asyncio
+    async def test_limits_raise(self):
+        """Test that breaking the document deadline or memory ceiling raises instead of falling back"""
+        import io
+        for sandbox in (PDFSandbox(timeout=0.001), PDFSandbox(max_rss_mb=1)):
+            try:
+                with pytest.raises(PDFSandboxLimitExceeded):
+                    await PDFProcessor(sandbox=sandbox).process_pdf(io.BytesIO(self.pdf_bytes))
+            finally:
+                sandbox.shutdown()
+    
+    def test_queue_wait_not_charged(self):
+        """Test that waiting for a worker does not count against the document, and long waits raise busy"""
+        import threading
+        sandbox = PDFSandbox(max_workers=1, timeout=1.0, queue_timeout=0.2)
+        try:
+            worker = sandbox._acquire()
+            with pytest.raises(PDFSandboxBusy):
+                sandbox.job("pypdf2", self.pdf_bytes).describe()
+            
+            # Queued for longer than the document's whole time budget, then served normally
+            sandbox.queue_timeout = 10
+            threading.Timer(1.5, sandbox._release, args=(worker, True)).start()
+            page_count, _ = sandbox.job("pypdf2", self.pdf_bytes).describe()
+            assert page_count == 4
+            assert sandbox._idle == [worker]
+        finally:
+            sandbox.shutdown()
+
+
+class TestResultCache:
+    """Test cases for the content-addressed result cache"""
+    
+    def test_hash_stream(self):
+        """Test that streams hash to the SHA-256 of their bytes"""
+        import hashlib
+        import io
+        data = b"%PDF-1.4 test" * 1000
+        stream = io.BytesIO(data)
+        
+        assert hash_stream(stream, chunk_size=100) == hashlib.sha256(data).hexdigest()
+        assert stream.tell() == 0
+    
+    def test_make_key_depends_on_fingerprint(self):
+        """Test that configuration changes produce different keys"""
+        key = ResultCache.make_key("process-pdf", "abc", "config-1")
+        
+        assert key == ResultCache.make_key("process-pdf", "abc", "config-1")
+        assert key != ResultCache.make_key("process-pdf", "abc", "config-2")
+        assert key != ResultCache.make_key("extract-text", "abc", "config-1")
+    
+    def test_memory_lru_eviction(self):
+        """Test that the memory tier stays bounded"""
+        cache = ResultCache(cache_dir=None, max_memory_items=2)
+        cache.set("a", {"value": 1})
+        cache.set("b", {"value": 2})
+        cache.get("a")
+        cache.set("c", {"value": 3})
+        
+        assert cache.get("b") is None
+        assert cache.get("a") == {"value": 1}
+        assert cache.get("c") == {"value": 3}
+    
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test that a new cache instance reads entries written by another"""
+        ResultCache(cache_dir=str(tmp_path)).set("key1", {"text_content": "hello"})
+        
+        cache = ResultCache(cache_dir=str(tmp_path))
+        
+        assert cache.get("key1") == {"text_content": "hello"}
+        assert cache.get_stats()["disk_hits"] == 1
+        assert cache.get("key1") == {"text_content": "hello"}
+        assert cache.get_stats()["memory_hits"] == 1
+    
+    def test_prune_disk(self, tmp_path):
+        """Test that pruning keeps the disk tier under its byte budget"""
+        cache = ResultCache(cache_dir=str(tmp_path), max_memory_items=0, max_disk_bytes=250)
+        for n in range(10):
+            cache.set(f"key{n:02d}", {"payload": "x" * 80})
+        cache.prune_disk()
+        
+        remaining = [name for _, _, files in os.walk(tmp_path) for name in files]
+        assert 0 < len(remaining) <= 2
+
+
+class TestEmbeddingBatching:
+    """Test cases for batched chunk encoding"""
+    
+    def test_batches_are_length_sorted(self):
+        """Test that batches group texts of similar length and cover every text once"""
+        texts = ["a" * n for n in (5, 40, 1, 30, 10)]
+        batches = length_sorted_batches(texts, batch_size=2)
+        
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert [[len(texts[i]) for i in batch] for batch in batches] == [[40, 30], [10, 5], [1]]
+    
+    def test_encode_in_batches_preserves_order(self):
+        """Test that vectors come back in input order with bounded batch sizes"""
+        import numpy as np
+        calls = []
+        
+        def encode(batch):
+            calls.append(len(batch))
+            return np.array([[len(text), 1.0] for text in batch])
+        
+        texts = ["x" * n for n in (3, 9, 1, 7, 5)]
+        vectors = encode_in_batches(encode, texts, batch_size=2)
+        
+        assert vectors.dtype == np.float32
+        assert vectors[:, 0].tolist() == [3, 9, 1, 7, 5]
+        assert calls == [2, 2, 1]
+        assert encode_in_batches(encode, [], batch_size=2).shape == (0, 0)
+    
+    @pytest.mark.asyncio
+    async def test_batcher_shares_forward_passes(self):
+        """Test that concurrent requests are encoded together and each gets its own rows"""
+        import numpy as np
+        calls = []
+        
+        def encode(batch):
+            calls.append(len(batch))
+            return np.array([[float(text.split(":")[0]), float(text.split(":")[1])] for text in batch])
+        
+        batcher = EmbeddingBatcher(encode, max_batch_size=64, max_wait_ms=50)
+        try:
+            results = await asyncio.gather(*[
+                batcher.encode([f"{request}:{item}" for item in range(3)])
+                for request in range(20)
+            ])
+        finally:
+            batcher.close()
+        
+        for request, vectors in enumerate(results):
+            assert vectors.tolist() == [[request, item] for item in range(3)]
+        assert sum(calls) == 60
+        assert len(calls) < 20
+        assert batcher.get_stats()["requests"] == 20
+    
+    def test_pool_embeddings(self):
+        """Test document pooling strategies over chunk vectors"""
+        import numpy as np
+        vectors = np.array([[1.0, 0.0], [0.0, 1.0]])
+        
+        assert np.allclose(pool_embeddings(vectors, "mean"), [2 ** -0.5, 2 ** -0.5])
+        assert np.allclose(pool_embeddings(vectors, "max"), [2 ** -0.5, 2 ** -0.5])
+        weighted = pool_embeddings(vectors, "weighted_mean", lengths=[300, 100])
+        assert np.isclose(np.linalg.norm(weighted), 1.0)
+        assert np.isclose(weighted[0] / weighted[1], 3.0)
+        
+        with pytest.raises(ValueError):
+            pool_embeddings(vectors, "weighted_mean")
+        with pytest.raises(ValueError):
+            pool_embeddings(vectors, "median")
+
+
+class TestEmbeddingCache:
+    """Test cases for the chunk embedding cache"""
+    
+    def test_memory_tier(self):
+        """Test hits, misses and LRU eviction without a disk tier"""
+        import numpy as np
+        cache = EmbeddingCache(max_memory_items=2)
+        keys = [EmbeddingCache.make_key("model", text) for text in ("a", "b", "c")]
+        cache.put_many(keys, np.eye(3, dtype=np.float32))
+        
+        vectors, missing = cache.get_many(keys, 3)
+        assert missing == [0]
+        assert vectors[1:].tolist() == [[0, 1, 0], [0, 0, 1]]
+        assert EmbeddingCache.make_key("other-model", "a") != keys[0]
+    
+    def test_memory_only_writes(self):
+        """Test that vectors stored with persist=False never reach the disk tier"""
+        import numpy as np
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = EmbeddingCache(cache_dir=cache_dir)
+            keys = [EmbeddingCache.make_key("model", text) for text in ("a", "b")]
+            cache.put_many(keys, np.eye(2, dtype=np.float32), persist=False)
+            
+            assert cache.get_many(keys, 2)[1] == []
+            assert cache.get_stats()["disk_rows"] == 0
+    
+    def test_disk_tier_persists(self):
+        """Test that vectors survive a restart and the segment is a loadable .npy file"""
+        import numpy as np
+        with tempfile.TemporaryDirectory() as cache_dir:
+            keys = [EmbeddingCache.make_key("model", f"chunk {n}") for n in range(5)]
+            vectors = np.random.rand(5, 8).astype(np.float32)
+            first = EmbeddingCache(cache_dir=cache_dir)
+            first.put_many(keys[:3], vectors[:3])
+            first.put_many(keys[2:], vectors[2:])
+            
+            second = EmbeddingCache(cache_dir=cache_dir, max_memory_items=0)
+            found, missing = second.get_many(keys + ["unknown"], 8)
+            stats = second.get_stats()
+            
+            assert missing == [5]
+            assert np.array_equal(found[:5], vectors)
+            assert stats["disk_hits"] == 5 and stats["disk_rows"] == 5
+            assert np.array_equal(np.load(os.path.join(cache_dir, "vectors-8.npy"), mmap_mode="r"), vectors)
+    
+    def test_disk_tier_rotates(self):
+        """Test that the disk tier stays within its cap and keeps vectors still in use"""
+        import numpy as np
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Room for 8 rows of dimension 8: two segments of 4
+            cache = EmbeddingCache(cache_dir=cache_dir, max_memory_items=0,
+                                   max_disk_mb=8 * (8 * 4 + EmbeddingCache.INDEX_LINE_BYTES) / 2 ** 20)
+            keys = [EmbeddingCache.make_key("model", f"chunk {n}") for n in range(11)]
+            vectors = np.random.rand(11, 8).astype(np.float32)
+            cache.put_many(keys[:4], vectors[:4])
+            cache.put_many(keys[4:8], vectors[4:8])
+            
+            found, missing = cache.get_many(keys[:1], 8)  # copied forward from the previous segment
+            cache.put_many(keys[8:], vectors[8:])
+            stats = cache.get_stats()
+            
+            assert missing == [] and np.array_equal(found[0], vectors[0])
+            assert stats["disk_rotations"] == 2 and stats["disk_rows"] == 8
+            assert stats["disk_bytes"] <= stats["disk_max_bytes"] + 4 * 128
+            assert cache.get_many(keys[:4], 8)[1] == [1, 2, 3]
+            assert not os.path.exists(os.path.join(cache_dir, "vectors-8.npy"))
+
+
+class TestEmbeddingCodec:
+    """Test cases for compact embedding transport"""
+    
+    def test_round_trip(self):
+        """Test that every format decodes back to the original vectors within its precision"""
+        import numpy as np
+        vectors = np.random.randn(6, 384).astype(np.float32)
+        
+        assert encode_vectors(vectors, "json") == vectors.tolist()
+        assert np.array_equal(decode_vectors(encode_vectors(vectors, "float32")), vectors)
+        assert np.allclose(decode_vectors(encode_vectors(vectors, "float16")), vectors, atol=1e-2)
+        int8 = decode_vectors(encode_vectors(vectors, "int8"))
+        assert np.all(np.abs(int8 - vectors) <= np.abs(vectors).max(axis=1, keepdims=True) / 254 + 1e-6)
+        assert decode_vectors(encode_vectors(vectors[0], "int8")).shape == (384,)
+        assert decode_vectors(encode_vectors(np.zeros((0, 0)), "int8")).shape == (0, 0)
+    
+    def test_int8_is_much_smaller_than_json(self):
+        """Test the serialised size reduction of the packed formats"""
+        import numpy as np
+        vectors = np.random.randn(50, 384).astype(np.float32)
+        json_size = len(json.dumps(encode_vectors(vectors, "json")))
+        
+        assert len(json.dumps(encode_vectors(vectors, "float16"))) * 7 < json_size
+        assert len(json.dumps(encode_vectors(vectors, "int8"))) * 14 < json_size
+        with pytest.raises(ValueError):
+            encode_vectors(vectors, "bfloat16")
+
+
+class TestVectorIndex:
+    """Test cases for the chunk vector index"""
+    
+    def make_documents(self, count=20, chunks=50, dimension=32):
+        import numpy as np
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((10, dimension))
+        return [
+            (centers[rng.integers(0, 10, chunks)] + 0.2 * rng.standard_normal((chunks, dimension))).astype(np.float32)
+            for _ in range(count)
+        ]
+    
+    def test_exact_and_ivf_search_agree(self):
+        """Test that trained IVF search finds the same top hits as the exact scan"""
+        import numpy as np
+        documents = self.make_documents()
+        exact = VectorIndex(train_threshold=10 ** 6)
+        ivf = VectorIndex(train_threshold=500, nprobe=8)
+        for number, vectors in enumerate(documents):
+            texts = [f"doc{number} chunk{chunk}" for chunk in range(len(vectors))]
+            exact.add(f"doc{number}", vectors, texts)
+            ivf.add(f"doc{number}", vectors, texts)
+        assert ivf.wait_for_training(timeout=30)
+        
+        assert not exact.get_stats()["trained"] and ivf.get_stats()["trained"]
+        for query in documents[3][:10]:
+            exact_hits = exact.search(query, k=5)
+            ivf_hits = ivf.search(query, k=5)
+            assert exact_hits[0]["text"] == ivf_hits[0]["text"]
+            assert np.isclose(exact_hits[0]["score"], 1.0, atol=1e-5)
+            assert len({hit["text"] for hit in exact_hits} & {hit["text"] for hit in ivf_hits}) >= 4
+    
+    def test_persistence_and_replacement(self):
+        """Test that the index reloads from disk and re-indexing a document replaces it"""
+        documents = self.make_documents(count=3)
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = VectorIndex(index_dir=index_dir, train_threshold=100)
+            for number, vectors in enumerate(documents):
+                index.add(f"doc{number}", vectors, [f"doc{number} chunk{chunk}" for chunk in range(len(vectors))])
+            index.add("doc1", documents[1][:2], ["new first chunk", "new second chunk"])
+            index.remove("doc2")
+            assert index.wait_for_training(timeout=30)
+            
+            reloaded = VectorIndex(index_dir=index_dir)
+            stats = reloaded.get_stats()
+            hit = reloaded.search(documents[1][1], k=1)[0]
+            
+            assert stats["documents"] == 2 and stats["chunks"] == 52 and stats["trained"]
+            assert (hit["doc_id"], hit["chunk_index"], hit["text"]) == ("doc1", 1, "new second chunk")
+            assert all(hit["doc_id"] != "doc2" for hit in reloaded.search(documents[2][0], k=20))
+    
+    def test_compaction(self):
+        """Test that removed rows are compacted away and other instances follow the new epoch"""
+        import os
+        documents = self.make_documents(count=4)
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = VectorIndex(index_dir=index_dir, train_threshold=100)
+            index.COMPACT_MIN_ROWS = 10
+            other = VectorIndex(index_dir=index_dir)
+            for number, vectors in enumerate(documents):
+                index.add(f"doc{number}", vectors, [f"doc{number} chunk{chunk}" for chunk in range(len(vectors))])
+            assert other.get_stats()["rows"] == 200 and index.wait_for_training(timeout=30)
+            for number in range(3):
+                index.remove(f"doc{number}")
+            
+            stats = index.get_stats()
+            assert stats["epoch"] == 1 and stats["rows"] == stats["chunks"] == 50 and stats["trained"]
+            assert not os.path.exists(os.path.join(index_dir, "vectors.npy"))
+            for reader in (index, other, VectorIndex(index_dir=index_dir)):
+                hit = reader.search(documents[3][7], k=1)[0]
+                assert (hit["doc_id"], hit["chunk_index"], hit["text"]) == ("doc3", 7, "doc3 chunk7")
+    
+    def test_training_does_not_block_search(self):
+        """Test that searches are served while the index trains"""
+        import threading
+        documents = self.make_documents(count=4)
+        index = VectorIndex(train_threshold=150)
+        train = index._spherical_kmeans
+        searched = []
+        
+        def train_while_searching(*args):
+            searcher = threading.Thread(target=lambda: searched.append(index.search(documents[0][0], k=1)))
+            searcher.start()
+            searcher.join(timeout=5)
+            return train(*args)
+        
+        index._spherical_kmeans = train_while_searching
+        for number, vectors in enumerate(documents):
+            index.add(f"doc{number}", vectors, [f"doc{number} chunk{chunk}" for chunk in range(len(vectors))])
+        assert index.wait_for_training(timeout=30)
+        
+        assert searched and searched[0][0]["text"] == "doc0 chunk0"
+        assert index.get_stats()["trained"]
+    
+    def test_add_does_not_wait_for_training(self):
+        """Test that the add that makes training due returns while k-means is still running"""
+        import threading
+        documents = self.make_documents(count=2)
+        index = VectorIndex(train_threshold=50)
+        train = index._spherical_kmeans
+        started, release = threading.Event(), threading.Event()
+        
+        def blocked_train(*args):
+            started.set()
+            release.wait(timeout=30)
+            return train(*args)
+        
+        index._spherical_kmeans = blocked_train
+        index.add("doc0", documents[0], [f"doc0 chunk{chunk}" for chunk in range(len(documents[0]))])
+        assert started.wait(timeout=5)
+        index.add("doc1", documents[1], [f"doc1 chunk{chunk}" for chunk in range(len(documents[1]))])
+        stats = index.get_stats()
+        release.set()
+        
+        assert stats["training"] and not stats["trained"] and stats["chunks"] == 100
+        assert index.wait_for_training(timeout=30) and index.get_stats()["trained"]
+        assert index.search(documents[1][3], k=1)[0]["text"] == "doc1 chunk3"
+
+
+class TestEmbeddingBackends:
+    """Test cases for the backend equivalence check and ONNX pooling"""
+    
+    def test_mean_pooling_ignores_padding(self):
+        """Test that padded positions do not change a sentence vector"""
+        import numpy as np
+        rng = np.random.default_rng(2)
+        hidden = rng.standard_normal((2, 5, 8)).astype(np.float32)
+        mask = np.array([[1, 1, 1, 0, 0], [1, 1, 1, 1, 1]])
+        pooled = mean_pool_hidden_states(hidden, mask)
+        
+        expected = hidden[0, :3].mean(axis=0)
+        assert np.allclose(pooled[0], expected / np.linalg.norm(expected), atol=1e-6)
+        assert np.allclose(np.linalg.norm(pooled, axis=1), 1.0)
+    
+    def test_equivalence_check_tolerance(self):
+        """Test that small perturbations pass the cosine check and large ones fail"""
+        import numpy as np
+        rng = np.random.default_rng(3)
+        texts = [f"text {number}" for number in range(20)]
+        reference = rng.standard_normal((20, 384)).astype(np.float32)
+        encode = lambda noise: (lambda batch: reference + noise * rng.standard_normal(reference.shape))
+        
+        close = check_equivalence(lambda batch: reference, encode(0.01), texts)
+        far = check_equivalence(lambda batch: reference, encode(1.0), texts)
+        
+        assert close["passed"] and close["min_cosine"] > 0.99 and close["samples"] == 20
+        assert not far["passed"] and far["mean_cosine"] < 0.9
+
+
+class TestTextRank:
+    """Test cases for sentence centrality"""
+    
+    def test_hub_sentence_ranks_first(self):
+        """Test that the sparse ranking matches dense TextRank and ranks a hub sentence first"""
+        import numpy as np
+        rng = np.random.default_rng(6)
+        centers = np.eye(3, 16)
+        vectors = np.vstack([centers[i % 3] + 0.1 * rng.standard_normal(16) for i in range(30)] + [centers.sum(axis=0)])
+        
+        scores = sentence_centrality(vectors, neighbours=64, tolerance=1e-12)
+        
+        # Dense TextRank over the full clipped cosine graph
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarity = np.maximum(unit @ unit.T, 0)
+        np.fill_diagonal(similarity, 0)
+        transition = similarity / similarity.sum(axis=1, keepdims=True)
+        dense = np.full(31, 1 / 31)
+        for _ in range(200):
+            dense = 0.15 / 31 + 0.85 * transition.T @ dense
+        
+        assert np.argmax(scores) == 30
+        assert np.allclose(scores, dense, atol=1e-6) and np.isclose(scores.sum(), 1.0)
+        assert sentence_centrality(vectors[:1]).tolist() == [1.0]
+
+
+class TestSentenceSegmenter:
+    """Test cases for the regex sentence segmenter"""
+    
+    def test_abbreviations_decimals_and_ellipses(self):
+        """Test that abbreviations, initials, decimals and ellipses do not end sentences"""
+        text = ('Dr. Smith paid $3.50 for it. Then he left! Did he? Yes... and no. The U.S. Army e.g. works. '
+                'J. R. Tolkien wrote books, etc. Then "It ended." See Fig. 3 now. He sat. Wait... What?')
+        
+        assert regex_sentences(text) == [
+            "Dr. Smith paid $3.50 for it.", "Then he left!", "Did he?", "Yes... and no.",
+            "The U.S. Army e.g. works.", "J. R. Tolkien wrote books, etc.", 'Then "It ended."',
+            "See Fig. 3 now.", "He sat.", "Wait...", "What?"
+        ]
+        assert regex_sentences("  ") == [] and regex_sentences("No terminal punctuation") == ["No terminal punctuation"]
+    
+    def test_boundary_agreement_and_document_analysis(self):
+        """Test the agreement metric and that documents can be analysed with the regex segmenter"""
+        import re
+        text = "One two. Three four. Five six. Seven."
+        scores = boundary_agreement(text, ["One two.", "Three four.", "Five six.", "Seven."],
+                                    ["One two. Three four.", "Five six.", "Seven."])
+        assert scores["precision"] == 1.0 and scores["recall"] == 2 / 3
+        
+        with patch("services.analyzed_document.word_tokenize", side_effect=lambda sentence: re.findall(r"\w+|[^\w\s]", sentence)), \
+             patch("services.analyzed_document.english_stopwords", return_value=frozenset()):
+            document = AnalyzedDocument.analyze(text, segmenter="regex")
+        assert document.sentences == regex_sentences(text)
+        assert all(text[start:end] == sentence for sentence, (start, end) in zip(document.sentences, document.sentence_spans))
+        with pytest.raises(ValueError, match="Unknown sentence segmenter"):
+            AnalyzedDocument.analyze(text, segmenter="spacy")
+
+
+class TestTokenBudget:
+    """Test cases for token estimation and token-budgeted compression"""
+    
+    def test_estimator_calibrates_per_model(self):
+        """Test that observed usage rescales one model's estimates and truncation respects the budget"""
+        text = "Knowledge graphs connect 1234 entities, relationships and themes. " * 20
+        estimator = TokenEstimator()
+        raw = raw_token_count(text)
+        
+        estimator.observe("model-a", text, 2 * raw)
+        
+        assert estimator.estimate(text, "model-a") == 2 * raw
+        assert estimator.estimate(text, "model-b") == raw
+        truncated = estimator.truncate(text, 50, "model-a")
+        assert estimator.estimate(truncated, "model-a") <= 50 and text.startswith(truncated)
+    
+    def test_compress_to_tokens_fills_budget(self):
+        """Test that the character target is rescaled until the output nearly fills the token budget"""
+        compressor = TextCompressor()
+        text = " ".join(f"Sentence {number} describes the compression budget in detail." for number in range(300))
+        
+        def truncating(text, target_length, method, document, sentence_vectors):
+            return {"compressed_text": text[:target_length // 2], "method": method}
+        
+        with patch.object(compressor, "compress_text", side_effect=truncating), \
+                patch("services.text_compressor.AnalyzedDocument"):
+            result = compressor.compress_to_tokens(text, 200, TokenEstimator(), "model")
+        
+        assert 180 <= result["estimated_tokens"] <= 200 and result["target_tokens"] == 200
+    
+    def test_graph_text_budget(self):
+        """Test that the prompt template's tokens come out of the graph prompt budget"""
+        service = OpenRouterService(api_key="test_key", max_prompt_tokens=1000)
+        budget = service.graph_text_budget({"title": "Test"})
+        
+        assert 0 < budget < 1000
+        assert OpenRouterService(api_key="test_key").graph_text_budget() is None
+
+
+class TestHierarchicalCompressor:
+    """Test cases for map-reduce compression of long texts"""
+    
+    def test_windows_cut_at_sentences_and_keep_text(self):
+        """Test that windows fit the size, end on sentences and together hold the whole text"""
+        pages = [" ".join(f"Page {page} sentence {number} is here." for number in range(40)) for page in range(30)]
+        windows = list(iter_windows(iter(pages), 2000))
+        
+        assert len(windows) > 1 and all(len(window) <= 2000 for window in windows)
+        assert all(window.endswith(".") for window in windows)
+        assert " ".join(windows).split() == " ".join(pages).split()
+    
+    def test_reduce_runs_levels_until_one_window(self):
+        """Test that a long text is reduced over several levels and keeps document order"""
+        compressor = Mock()
+        compressor.compress_text.side_effect = lambda text, target_length, method: {"compressed_text": text[:target_length]}
+        text = "\n\n".join(f"Section {number} opens here. " + "Filler sentence. " * 60 for number in range(200))
+        
+        result = asyncio.run(HierarchicalCompressor(compressor, window_size=4000).reduce(text, 500))
+        
+        assert result["original_length"] == len(text)
+        assert result["levels"] >= 2 and result["windows"][0] > result["windows"][-1]
+        assert len(result["reduced_text"]) <= 4000
+        assert result["reduced_text"].startswith("Section 0 opens here.")
+        assert all(call.kwargs["method"] == "textrank" for call in compressor.compress_text.call_args_list)
+
+
+class TestTokenChunker:
+    """Test cases for the token-budgeted chunker"""
+    
+    @staticmethod
+    def word_offsets(text):
+        import re
+        return [match.span() for match in re.finditer(r"\w+|[^\w\s]", text)]
+    
+    def test_chunks_respect_budget_and_spans(self):
+        """Test that chunks fit the token budget, overlap, end on sentences and map back to the text"""
+        text = " ".join(f"Sentence number {number} talks about topic {number % 7} in some detail." for number in range(200))
+        calls = []
+        chunker = TokenChunker(lambda value: calls.append(value) or self.word_offsets(value), max_tokens=64, overlap_tokens=8)
+        chunks, spans = chunker.chunk(text)
+        
+        assert len(calls) == 1
+        assert len(chunks) > 1 and all(len(self.word_offsets(chunk)) <= 64 for chunk in chunks)
+        assert all(text[start:end] == chunk for chunk, (start, end) in zip(chunks, spans))
+        assert all(chunk.endswith(".") for chunk in chunks)
+        assert all(spans[position + 1][0] < spans[position][1] for position in range(len(spans) - 1))
+        assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    
+    def test_long_sentence_and_empty_text(self):
+        """Test that a sentence over budget is cut on tokens and empty text gives no chunks"""
+        text = " ".join(["word"] * 100)
+        chunks, spans = TokenChunker(self.word_offsets, max_tokens=30, overlap_tokens=0).chunk(text)
+        
+        assert [len(chunk.split()) for chunk in chunks] == [30, 30, 30, 10]
+        assert TokenChunker(self.word_offsets).chunk("   ") == ([], [])
+
+
+class TestSimilaritySearch:
+    """Test cases for batched top-k similarity"""
+    
+    def test_one_and_many_queries_match_brute_force(self):
+        """Test that single and blocked batch queries return the exact cosine top-k"""
+        import numpy as np
+        rng = np.random.default_rng(4)
+        corpus = rng.standard_normal((500, 24)).astype(np.float32)
+        queries = rng.standard_normal((70, 24)).astype(np.float32)
+        
+        indices, scores = top_k_similar(queries, corpus, k=5, block_size=16)
+        single_indices, single_scores = top_k_similar(queries[3], corpus, k=5)
+        
+        cosines = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ (corpus / np.linalg.norm(corpus, axis=1, keepdims=True)).T
+        assert indices.shape == (70, 5) and single_indices.shape == (5,)
+        assert np.array_equal(indices, np.argsort(-cosines, axis=1)[:, :5])
+        assert np.allclose(scores, np.sort(cosines, axis=1)[:, ::-1][:, :5], atol=1e-5)
+        assert np.array_equal(single_indices, indices[3]) and np.allclose(single_scores, scores[3])
+    
+    def test_k_larger_than_corpus(self):
+        """Test that k is capped at the corpus size and results stay sorted"""
+        import numpy as np
+        indices, scores = top_k_similar(np.array([1.0, 0.0]), np.array([[0.0, 1.0], [1.0, 0.1], [-1.0, 0.0]]), k=10)
+        assert indices.tolist() == [1, 0, 2] and np.all(np.diff(scores) <= 0)
+    
+    def test_exclude_self(self):
+        """Test that a corpus queried against itself never returns a row's own match"""
+        import numpy as np
+        corpus = np.array([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]])
+        indices, scores = top_k_similar(corpus, corpus, k=10, block_size=2, exclude_self=True)
+        assert indices.tolist() == [[1, 2], [0, 2], [1, 0]] and np.all(np.isfinite(scores))
+
+
+class TestSimilarityGraph:
+    """Test cases for the cross-document similarity graph"""
+    
+    def test_blocked_top_k_matches_dense(self):
+        """Test that blocked top-k edges match a brute-force pairwise scan"""
+        import numpy as np
+        rng = np.random.default_rng(1)
+        matrix = rng.standard_normal((300, 16)).astype(np.float32)
+        sources, targets, weights = top_k_similarity_edges(matrix, top_k=5, threshold=0.3, block_size=64)
+        
+        normalised = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        scores = normalised @ normalised.T
+        np.fill_diagonal(scores, -np.inf)
+        top = np.argsort(-scores, axis=1)[:, :5]
+        expected = {
+            (min(row, column), max(row, column))
+            for row in range(len(matrix)) for column in top[row] if scores[row, column] >= 0.3
+        }
+        
+        assert set(zip(sources.tolist(), targets.tolist())) == expected
+        assert np.allclose(weights, scores[sources, targets], atol=1e-5)
+    
+    def test_cache_invalidated_by_document_changes(self):
+        """Test that graphs are reused until a document changes, including from another instance"""
+        import numpy as np
+        with tempfile.TemporaryDirectory() as store_dir:
+            path = os.path.join(store_dir, "documents")
+            graph = DocumentSimilarityGraph(store_path=path)
+            graph.put("a", np.array([1.0, 0.0, 0.0]))
+            graph.put("b", np.array([0.9, 0.1, 0.0]))
+            graph.put("c", np.array([0.0, 0.0, 1.0]))
+            
+            first = graph.get_graph(top_k=2, threshold=0.5)
+            assert not first["cached"] and graph.get_graph(top_k=2, threshold=0.5)["cached"]
+            assert [(edge["source"], edge["target"]) for edge in first["edges"]] == [("a", "b")]
+            
+            graph.put("b", np.array([0.9, 0.1, 0.0]))  # unchanged embedding keeps the cache
+            assert graph.get_graph(top_k=2, threshold=0.5)["cached"]
+            
+            DocumentSimilarityGraph(store_path=path).put("d", np.array([0.0, 0.1, 0.9]))
+            updated = graph.get_graph(top_k=2, threshold=0.5)
+            assert not updated["cached"] and updated["total_documents"] == 4
+            assert ("c", "d") in [(edge["source"], edge["target"]) for edge in updated["edges"]]
+    
+    def test_append_only_store_rewrites_dead_rows(self):
+        """Test that replaced embeddings are appended, then rewritten away, consistently across instances"""
+        import numpy as np
+        with tempfile.TemporaryDirectory() as store_dir:
+            path = os.path.join(store_dir, "documents")
+            graph = DocumentSimilarityGraph(store_path=path)
+            graph.REWRITE_MIN_ROWS = 4
+            other = DocumentSimilarityGraph(store_path=path)
+            graph.put("a", np.array([1.0, 0.0]))
+            graph.put("b", np.array([0.0, 1.0]))
+            assert other.get_stats()["rows"] == 2
+            for step in range(1, 4):
+                graph.put("a", np.array([1.0, 0.1 * step]))
+            
+            stats = graph.get_stats()
+            assert stats["documents"] == 2 and stats["rows"] == 2
+            assert np.load(f"{path}.npy").shape == (2, 2)
+            for reader in (graph, other, DocumentSimilarityGraph(store_path=path)):
+                edges = reader.get_graph(top_k=1, threshold=0.0)["edges"]
+                assert reader.get_stats()["version"] == stats["version"]
+                assert np.isclose(edges[0]["weight"], 0.3 / np.hypot(1.0, 0.3), atol=1e-4)
 
 
 class TestIntegration:
@@ -1,6 +1,8 @@
 import fs from 'fs';
 import path from 'path';
 
+const PYTHON_SERVICE_URL = process.env.PYTHON_SERVICE_URL || 'http://localhost:8000';
+
 export async function GET() {
   try {
     const dataPath = path.join(process.cwd(), 'data', 'processed_pdfs.json');
@@ -18,7 +20,8 @@ export async function GET() {
     const pdfs = JSON.parse(fs.readFileSync(dataPath, 'utf8'));
     
     // Generate graph data from PDFs
-    const graphData = generateGraphData(pdfs);
+    const similarityEdges = await fetchSimilarityEdges(pdfs);
+    const graphData = generateGraphData(pdfs, similarityEdges);
 
     return new Response(JSON.stringify({ 
       success: true, 
@@ -40,7 +43,37 @@ export async function GET() {
   }
 }
 
-function generateGraphData(pdfs) {
+// Embedding-based document edges from the Python service; null falls back to summary overlap
+async function fetchSimilarityEdges(pdfs) {
+  try {
+    const response = await fetch(`${PYTHON_SERVICE_URL}/similarity-graph`);
+    if (!response.ok) {
+      return null;
+    }
+
+    const similarityGraph = await response.json();
+    const known = new Set(pdfs.map(pdf => pdf.file_id));
+    const embedded = new Set(similarityGraph.nodes.map(node => node.id));
+    // Documents processed before the service stored embeddings are missing from its graph
+    if (pdfs.some(pdf => !embedded.has(pdf.file_id))) {
+      return null;
+    }
+
+    return similarityGraph.edges
+      .filter(edge => known.has(edge.source) && known.has(edge.target))
+      .map(edge => ({
+        source: `pdf_${edge.source}`,
+        target: `pdf_${edge.target}`,
+        weight: edge.weight,
+        type: 'similarity'
+      }));
+  } catch (error) {
+    console.warn('Similarity graph unavailable, using summary overlap:', error.message);
+    return null;
+  }
+}
+
+function generateGraphData(pdfs, similarityEdges = null) {
   const nodes = [];
   const edges = [];
   const nodeMap = new Map();
@@ -62,7 +95,11 @@ function generateGraphData(pdfs) {
   });
 
   // Generate connections based on content similarity
-  for (let i = 0; i < pdfs.length; i++) {
+  if (similarityEdges) {
+    edges.push(...similarityEdges);
+  }
+
+  for (let i = 0; !similarityEdges && i < pdfs.length; i++) {
     for (let j = i + 1; j < pdfs.length; j++) {
       const similarity = calculateSimilarity(pdfs[i], pdfs[j]);
       